@@ -0,0 +1,99 @@
+"""Maintenance commands for the PRODIGY AI backend.
+
+Usage: python manage.py <command>
+"""
+import argparse
+import asyncio
+import json
+
+import server
+
+
+async def _ensure_indexes():
+    return await server.ensure_indexes()
+
+
+async def _rebuild_leaderboard():
+    return await server.rebuild_leaderboard()
+
+
+async def _migrate_file_text():
+    return await server.migrate_file_text()
+
+
+async def _reindex_file_chunks():
+    return await server.reindex_file_chunks()
+
+
+async def _rebuild_search_index():
+    return await server.rebuild_search_index()
+
+
+async def _backfill_conversations():
+    return await server.backfill_conversations()
+
+
+async def _rebuild_notification_counters():
+    return await server.rebuild_notification_counters()
+
+
+async def _backfill_due_dates():
+    return await server.backfill_due_dates()
+
+
+async def _migrate_files_to_blobs():
+    return await server.migrate_files_to_blobs()
+
+
+async def _backfill_folder_ancestors():
+    return await server.backfill_folder_ancestors()
+
+
+async def _sweep_blobs():
+    return await server.blob_collector.sweep()
+
+
+async def _backfill_previews():
+    return await server.backfill_previews()
+
+
+async def _reconcile_denormalized_fields():
+    return await server.reconcile_denormalized_fields()
+
+
+COMMANDS = {
+    "ensure-indexes": (_ensure_indexes, "Create or reconcile the declared Mongo indexes"),
+    "rebuild-leaderboard": (_rebuild_leaderboard, "Recompute the materialized leaderboard from submissions"),
+    "migrate-file-text": (_migrate_file_text, "Move inline files.text_content into the file_chunks store"),
+    "reindex-file-chunks": (_reindex_file_chunks, "Recompute retrieval terms/embeddings for stored chunks"),
+    "rebuild-search-index": (_rebuild_search_index, "Re-create search entries for classes, assignments, announcements and files"),
+    "backfill-conversations": (_backfill_conversations, "Assign conversation ids and sequence numbers to legacy chat messages"),
+    "rebuild-notification-counters": (_rebuild_notification_counters, "Set expiry on legacy notifications and recompute unread counters"),
+    "backfill-due-dates": (_backfill_due_dates, "Parse legacy assignment due_date strings into due_at datetimes"),
+    "migrate-files-to-blobs": (_migrate_files_to_blobs, "Move legacy per-upload files into the content-addressed blob store"),
+    "backfill-folder-ancestors": (_backfill_folder_ancestors, "Fill the ancestors path on folders created before it existed"),
+    "sweep-blobs": (_sweep_blobs, "Delete the bytes of unreferenced blobs past their grace period"),
+    "backfill-previews": (_backfill_previews, "Render thumbnails for existing image and PDF uploads"),
+    "reconcile-denormalized-fields": (_reconcile_denormalized_fields, "Rewrite copied names that differ from their source document"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PRODIGY AI maintenance commands")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, (_, help_text) in COMMANDS.items():
+        sub.add_parser(name, help=help_text)
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            return await COMMANDS[args.command][0]()
+        finally:
+            server.client.close()
+
+    result = asyncio.run(run())
+    print(json.dumps(result, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,15 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import JSONResponse, RedirectResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, ReplaceOne, UpdateOne, CursorType
+from pymongo.errors import DuplicateKeyError, BulkWriteError, CollectionInvalid
 import os
 import logging
 from pathlib import Path
+from urllib.parse import quote
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional
 import uuid
@@ -14,14 +18,26 @@ import bcrypt
 import jwt
 import aiofiles
 from PyPDF2 import PdfReader
+from PIL import Image, ImageOps
+import numpy as np
+import json
+import base64
 import io
+import hashlib
+import time
+import re
+import asyncio
+from collections import OrderedDict, Counter
+from contextlib import asynccontextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
 # JWT Settings
@@ -32,6 +48,8 @@ JWT_EXPIRATION_HOURS = 72
 # File upload settings
 UPLOAD_DIR = ROOT_DIR / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
 
 app = FastAPI(title="PRODIGY AI")
 api_router = APIRouter(prefix="/api")
@@ -113,8 +131,11 @@ class FolderCreate(BaseModel):
     parent_id: Optional[str] = None
     class_id: Optional[str] = None
 
+class FolderMove(BaseModel):
+    parent_id: Optional[str] = None
+
 class ChatMessage(BaseModel):
-    receiver_id: str
+    receiver_id: Optional[str] = None
     content: str
     class_id: Optional[str] = None
 
@@ -131,11 +152,78 @@ class NotificationCreate(BaseModel):
 
 # ==================== HELPERS ====================
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+class PasswordHasher:
+    """Runs bcrypt on a dedicated, size-limited thread pool.
+
+    bcrypt releases the GIL while it works, so threads keep the event loop
+    free without the cost of a process pool. Requests beyond ``max_pending``
+    are rejected with 503 instead of queueing without bound.
+    """
+
+    def __init__(self, workers: int, max_pending: int, rounds: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    async def _run(self, fn, *args):
+        if self.in_flight >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        hashed = await self._run(bcrypt.hashpw, password.encode(), salt)
+        return hashed.decode()
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(bcrypt.checkpw, password.encode(), hashed.encode())
+
+    def needs_rehash(self, hashed: str) -> bool:
+        try:
+            return int(hashed.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "in_flight": self.in_flight,
+            "queued": max(self.in_flight - self.workers, 0),
+            "peak_in_flight": self.peak_in_flight,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+        }
+
+password_hasher = PasswordHasher(
+    workers=int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    max_pending=int(os.environ.get("PASSWORD_HASH_MAX_PENDING", "256")),
+    rounds=int(os.environ.get("BCRYPT_ROUNDS", "12")),
+)
+
+async def hash_password(password: str) -> str:
+    return await password_hasher.hash(password)
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode(), hashed.encode())
+async def verify_password(password: str, hashed: str) -> bool:
+    return await password_hasher.verify(password, hashed)
 
 def create_token(user_id: str, role: str) -> str:
     payload = {
@@ -145,13 +233,87 @@ def create_token(user_id: str, role: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0})
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __contains__(self, key) -> bool:
+        """Whether ``key`` is live, without counting a lookup or refreshing it."""
+        entry = self._data.get(key)
+        return entry is not None and entry[0] >= time.monotonic()
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+# Authenticated users keyed by id; any write to a users document must call
+# invalidate_cached_user so that the next request sees the new state.
+user_cache = TTLCache(
+    maxsize=int(os.environ.get("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("USER_CACHE_TTL_SECONDS", "60")),
+)
+
+def invalidate_cached_user(user_id: str):
+    user_cache.invalidate(user_id)
+
+async def cached_user(user_id: str) -> dict:
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await db.users.find_one({"id": user_id}, {"_id": 0})
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
-        return user
+        user_cache.set(user_id, user)
+    return dict(user)
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await user_from_token(credentials.credentials)
+
+async def user_from_token(token: str) -> dict:
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        if "scope" in payload:
+            # Scoped tokens (e.g. the calendar feed) are not session tokens
+            raise HTTPException(status_code=401, detail="Invalid token")
+        return await cached_user(payload["user_id"])
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
@@ -160,6 +322,950 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 def generate_class_code() -> str:
     return str(uuid.uuid4())[:8].upper()
 
+async def user_classes(user: dict, projection: dict) -> List[dict]:
+    """Classes the user teaches (teachers) or is enrolled in (students)."""
+    query = {"teacher_id": user["id"]} if user["role"] == "teacher" else {"students": user["id"]}
+    return await db.classes.find(query, {"_id": 0, **projection}).to_list(None)
+
+def parse_due_date(value: str) -> Optional[datetime]:
+    """Normalise a due date string to an aware UTC datetime.
+
+    Accepts ISO dates and datetimes. Values without an offset are taken as
+    UTC, and a bare date means the end of that day. Returns None when the
+    string cannot be parsed.
+    """
+    value = (value or "").strip()
+    try:
+        if len(value) == 10:
+            parsed = datetime.combine(datetime.fromisoformat(value).date(), datetime.max.time().replace(microsecond=0))
+        else:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+# ==================== INDEXES ====================
+
+# Every collection the routes query, with the index set that serves those queries.
+# Each entry: (name, keys, options, queries served). Names are stable so that
+# startup can reconcile the live index set against this declaration.
+INDEX_SPECS = {
+    "users": [
+        ("id_unique", [("id", 1)], {"unique": True}, ["get_current_user", "update_profile", "get_class_students", "get_conversations"]),
+        ("email_unique", [("email", 1)], {"unique": True}, ["login", "signup duplicate check"]),
+        ("username_unique", [("username", 1)], {"unique": True}, ["signup duplicate check"]),
+    ],
+    "classes": [
+        ("id_unique", [("id", 1)], {"unique": True}, ["get_class", "delete_class", "create_announcement", "create_assignment", "get_class_analytics"]),
+        ("class_code_unique", [("class_code", 1)], {"unique": True}, ["join_class"]),
+        ("teacher_id", [("teacher_id", 1)], {}, ["get_classes (teacher)", "class id resolution for teachers", "search (teacher)"]),
+        ("students", [("students", 1)], {}, ["get_classes (student)", "class id resolution for students", "get_student_analytics", "search (student)"]),
+    ],
+    "assignments": [
+        ("id_unique", [("id", 1)], {"unique": True}, ["get_assignment", "create_submission"]),
+        ("class_id_due_date", [("class_id", 1), ("due_date", 1), ("id", 1)], {}, ["get_assignments", "get_class_analytics", "get_leaderboard"]),
+        ("class_id_due_at", [("class_id", 1), ("due_at", 1)], {}, ["get_calendar_events", "calendar_feed", "student_dashboard"]),
+    ],
+    "submissions": [
+        ("id_unique", [("id", 1)], {"unique": True}, ["grade_submission"]),
+        ("assignment_student_unique", [("assignment_id", 1), ("student_id", 1)], {"unique": True}, ["create_submission duplicate check", "get_submissions", "get_class_analytics", "get_leaderboard"]),
+        ("student_id_submitted_at", [("student_id", 1), ("submitted_at", -1), ("id", -1)], {}, ["get_submissions (student)", "get_student_analytics"]),
+        ("submitted_at", [("submitted_at", -1), ("id", -1)], {}, ["get_submissions (teacher, unfiltered)"]),
+        ("file_ids", [("file_ids", 1)], {}, ["download access to submission attachments"]),
+    ],
+    "notifications": [
+        ("id_unique", [("id", 1)], {"unique": True}, ["mark_notification_read"]),
+        ("user_id_created_at", [("user_id", 1), ("created_at", -1), ("id", -1)], {}, ["get_notifications"]),
+        ("expires_at", [("expires_at", 1)], {}, ["NotificationRetention sweep"]),
+        ("sweep_id", [("sweep_id", 1)], {"partialFilterExpression": {"sweep_id": {"$exists": True}}}, ["NotificationRetention sweep (claimed batch)"]),
+    ],
+    "notification_counters": [
+        ("user_id_unique", [("user_id", 1)], {"unique": True}, ["get_unread_count", "notification fan-out", "mark_notification_read", "mark_all_read"]),
+    ],
+    "announcements": [
+        ("id_unique", [("id", 1)], {"unique": True}, []),
+        ("class_id_created_at", [("class_id", 1), ("created_at", -1), ("id", -1)], {}, ["get_announcements"]),
+        ("author_id", [("author_id", 1)], {}, ["DenormalizedFieldPropagator (author_name)"]),
+    ],
+    "files": [
+        ("id_unique", [("id", 1)], {"unique": True}, ["get_file", "delete_file", "ai_chat (file context)"]),
+        ("ingest_status", [("ingest_status", 1)], {"partialFilterExpression": {"ingest_status": {"$in": ["pending", "processing"]}}}, ["DocumentIngestion.recover"]),
+        ("owner_id_folder_id", [("owner_id", 1), ("folder_id", 1), ("created_at", 1), ("id", 1)], {}, ["get_files (own)", "search"]),
+        ("class_id_folder_id", [("class_id", 1), ("folder_id", 1), ("created_at", 1), ("id", 1)], {}, ["get_files (class)"]),
+        ("folder_id", [("folder_id", 1)], {}, ["delete_folder"]),
+    ],
+    "blobs": [
+        ("sha256_unique", [("sha256", 1)], {"unique": True}, ["BlobStore.commit", "BlobStore.release"]),
+        ("refcount_released_at", [("refcount", 1), ("released_at", 1)], {}, ["BlobCollector.sweep"]),
+        ("reaping", [("reaping", 1)], {"partialFilterExpression": {"reaping": True}}, ["BlobCollector.sweep (resume)"]),
+        ("preview_status", [("preview_status", 1)], {"partialFilterExpression": {"preview_status": {"$in": ["pending", "processing"]}}}, ["PreviewGenerator.recover"]),
+    ],
+    "file_chunks": [
+        ("file_id_seq_unique", [("file_id", 1), ("seq", 1)], {"unique": True}, ["load_document_context", "store_document_text", "delete_file"]),
+    ],
+    "folders": [
+        ("id_unique", [("id", 1)], {"unique": True}, ["delete_folder"]),
+        ("owner_id_parent_id", [("owner_id", 1), ("parent_id", 1), ("created_at", 1), ("id", 1)], {}, ["get_folders (own)"]),
+        ("class_id_parent_id", [("class_id", 1), ("parent_id", 1), ("created_at", 1), ("id", 1)], {}, ["get_folders (class)"]),
+        ("ancestors", [("ancestors", 1)], {}, ["subtree listing, size, move and delete"]),
+    ],
+    "chat_messages": [
+        ("id_unique", [("id", 1)], {"unique": True}, []),
+        ("conversation_seq_unique", [("conversation_id", 1), ("seq", 1)], {"unique": True, "partialFilterExpression": {"seq": {"$exists": True}}}, ["get_messages", "send_message"]),
+        ("sender_id", [("sender_id", 1)], {}, ["DenormalizedFieldPropagator (sender_name)", "get_conversations (legacy)"]),
+        # Serve the fallbacks for messages not yet numbered by backfill-conversations
+        ("receiver_id_created_at", [("receiver_id", 1), ("created_at", -1)], {}, ["get_conversations (legacy)"]),
+        ("class_id_created_at", [("class_id", 1), ("created_at", 1), ("id", 1)], {}, ["get_messages (legacy class)"]),
+    ],
+    "conversations": [
+        ("id_unique", [("id", 1)], {"unique": True}, ["send_message (sequence allocation)", "get_messages (read marker)"]),
+        ("participants_last_time", [("participants", 1), ("last_time", -1)], {}, ["get_conversations"]),
+    ],
+    "search_docs": [
+        ("kind_ref_unique", [("kind", 1), ("ref_id", 1)], {"unique": True}, ["index_for_search", "remove_from_search"]),
+        ("tokens", [("tokens", 1)], {}, ["search (exact terms and type-ahead prefix)"]),
+        ("class_id", [("class_id", 1)], {}, ["delete_class search cleanup"]),
+    ],
+    "leaderboard": [
+        ("scope_student_unique", [("scope", 1), ("student_id", 1)], {"unique": True}, ["grade_submission (incremental update)", "rebuild_leaderboard"]),
+        ("student_id", [("student_id", 1)], {}, ["DenormalizedFieldPropagator (student_name)"]),
+        ("scope_ranking", [("scope", 1), ("average_score", -1), ("graded_count", -1)], {}, ["get_leaderboard"]),
+    ],
+    "propagation_jobs": [
+        ("id_unique", [("id", 1)], {"unique": True}, ["get_propagation_job", "DenormalizedFieldPropagator"]),
+        ("requested_by_created_at", [("requested_by", 1), ("created_at", -1)], {}, ["get_propagation_jobs"]),
+        ("status", [("status", 1)], {"partialFilterExpression": {"status": {"$in": ["pending", "running"]}}}, ["DenormalizedFieldPropagator.recover"]),
+    ],
+    "ai_chats": [
+        ("user_id_created_at", [("user_id", 1), ("created_at", -1)], {}, ["ai_chat history"]),
+    ],
+}
+
+# Indexes that earlier releases created and that are now superseded; dropped at startup.
+RETIRED_INDEXES = {
+    "submissions": ["student_id"],
+    "chat_messages": ["sender_receiver_created_at", "sender_receiver_read"],
+}
+
+def _index_matches(existing: dict, keys: list, options: dict) -> bool:
+    return (
+        [(field, int(direction)) for field, direction in existing.get("key", [])] == list(keys)
+        and bool(existing.get("unique", False)) == bool(options.get("unique", False))
+        and existing.get("expireAfterSeconds") == options.get("expireAfterSeconds")
+        and existing.get("partialFilterExpression") == options.get("partialFilterExpression")
+    )
+
+INDEX_STANDIN_SUFFIX = "_standin"
+
+async def _rebuild_index(collection, name: str, keys: list, options: dict):
+    """Replace index ``name`` with a new definition. A stand-in over the same
+    leading keys is built first and dropped last, so queries never run
+    without an index while the replacement builds."""
+    standin = f"{name}{INDEX_STANDIN_SUFFIX}"
+    standin_options = {k: v for k, v in options.items() if k not in ("unique", "expireAfterSeconds")}
+    # The trailing _id only keeps the key pattern distinct from ``keys``
+    await collection.create_index(list(keys) + [("_id", 1)], name=standin, **standin_options)
+    await collection.drop_index(name)
+    await collection.create_index(keys, name=name, **options)
+    await collection.drop_index(standin)
+
+async def ensure_indexes() -> list:
+    """Create missing indexes and rebuild any whose definition has drifted.
+
+    Returns one report row per declared index: the collection, index name,
+    what happened at startup and which queries the index serves.
+    """
+    report = []
+    for collection_name, specs in INDEX_SPECS.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        for name in RETIRED_INDEXES.get(collection_name, []):
+            if name in existing:
+                await collection.drop_index(name)
+                del existing[name]
+                logger.info(f"Dropped retired index {collection_name}.{name}")
+        declared = {name for name, _, _, _ in specs}
+        for name, keys, options, serves in specs:
+            status = "ok"
+            try:
+                if name in existing and not _index_matches(existing[name], keys, options):
+                    await _rebuild_index(collection, name, keys, options)
+                    status = "rebuilt"
+                elif name not in existing:
+                    await collection.create_index(keys, name=name, **options)
+                    status = "created"
+                standin = f"{name}{INDEX_STANDIN_SUFFIX}"
+                if standin in existing:
+                    # Left behind by a rebuild that failed on an earlier start
+                    await collection.drop_index(standin)
+                    del existing[standin]
+            except Exception as e:
+                # Typically duplicate data blocking a unique index; keep serving.
+                logger.error(f"Index {collection_name}.{name} could not be built: {e}")
+                status = "failed"
+            report.append({
+                "collection": collection_name,
+                "index": name,
+                "keys": keys,
+                "unique": bool(options.get("unique", False)),
+                "status": status,
+                "serves": serves,
+            })
+        for name in existing:
+            if name != "_id_" and name not in declared:
+                logger.warning(f"Undeclared index {collection_name}.{name} left in place")
+    return report
+
+# ==================== PAGINATION ====================
+
+MAX_PAGE_SIZE = 200
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def page_limit(default: int):
+    return Query(default, ge=1, le=MAX_PAGE_SIZE)
+
+async def keyset_page(collection, query: dict, projection: dict, sort: list, limit: int,
+                      cursor: Optional[str], response: Response) -> list:
+    """Return one page of ``collection`` ordered by ``sort``.
+
+    ``sort`` must end with a unique field (``id``) so that the key is total.
+    The position after the last returned document is sent back as an opaque
+    cursor in the X-Next-Cursor header; the header is absent on the last page.
+    """
+    if cursor:
+        values = decode_cursor(cursor, len(sort))
+        clauses = []
+        for i, (field, direction) in enumerate(sort):
+            clause = {f: v for (f, _), v in zip(sort[:i], values[:i])}
+            clause[field] = {"$gt" if direction == 1 else "$lt": values[i]}
+            clauses.append(clause)
+        query = {"$and": [query, {"$or": clauses}]}
+    docs = await collection.find(query, projection).sort(sort).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([docs[-1].get(field) for field, _ in sort])
+    return docs
+
+# ==================== PUSH ====================
+
+class PushConnection:
+    """One WebSocket client. Events wait in a bounded queue; a client that
+    falls ``maxsize`` events behind is disconnected rather than buffered
+    without limit, and is expected to reconnect and refetch."""
+
+    def __init__(self, user_id: str, maxsize: int):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def offer(self, event: dict) -> bool:
+        if self.overflowed:
+            return False
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.overflowed = True
+            return False
+
+class MemoryPushBroker:
+    """Single-process broker: events go straight to the local hub."""
+
+    name = "memory"
+
+    async def start(self, deliver):
+        self._deliver = deliver
+
+    async def stop(self):
+        pass
+
+    async def publish(self, items: List[tuple]):
+        self._deliver(items)
+
+class MongoPushBroker:
+    """Shares events between uvicorn workers through a capped collection.
+
+    Each worker delivers its own events locally right away, appends them to
+    ``push_events`` and tails the collection for events from other workers.
+    """
+
+    name = "mongo"
+
+    def __init__(self, collection: str, size_bytes: int):
+        self.collection_name = collection
+        self.size_bytes = size_bytes
+        self.origin = str(uuid.uuid4())
+        self._task = None
+
+    async def start(self, deliver):
+        self._deliver = deliver
+        try:
+            await db.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass
+        self._task = asyncio.create_task(self._tail())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def publish(self, items: List[tuple]):
+        self._deliver(items)
+        await db[self.collection_name].insert_one({
+            "origin": self.origin,
+            "items": [{"user_ids": user_ids, "event": event} for user_ids, event in items],
+            "created_at": datetime.now(timezone.utc),
+        })
+
+    async def _tail(self):
+        collection = db[self.collection_name]
+        # Start after the newest existing event; history is not replayed
+        last = await collection.find_one({}, sort=[("$natural", -1)])
+        last_id = last["_id"] if last else None
+        while True:
+            query = {"origin": {"$ne": self.origin}}
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            try:
+                cursor = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for doc in cursor:
+                        last_id = doc["_id"]
+                        self._deliver([(item["user_ids"], item["event"]) for item in doc["items"]])
+                    await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Push broker tail failed: {e}")
+            await asyncio.sleep(1)
+
+class PushHub:
+    """Routes events to the WebSocket connections of their recipients."""
+
+    def __init__(self, broker, queue_size: int, max_connections: int):
+        self.broker = broker
+        self.queue_size = queue_size
+        self.max_connections = max_connections
+        self._connections = {}
+        self.peak_connections = 0
+        self.published = 0
+        self.delivered = 0
+        self.slow_disconnects = 0
+        self.rejected = 0
+
+    async def start(self):
+        await self.broker.start(self._deliver_local)
+
+    async def stop(self):
+        await self.broker.stop()
+
+    @property
+    def connection_count(self) -> int:
+        return sum(len(conns) for conns in self._connections.values())
+
+    def connect(self, user_id: str) -> Optional[PushConnection]:
+        if self.connection_count >= self.max_connections:
+            self.rejected += 1
+            return None
+        conn = PushConnection(user_id, self.queue_size)
+        self._connections.setdefault(user_id, set()).add(conn)
+        self.peak_connections = max(self.peak_connections, self.connection_count)
+        return conn
+
+    def disconnect(self, conn: PushConnection):
+        conns = self._connections.get(conn.user_id)
+        if conns is not None:
+            conns.discard(conn)
+            if not conns:
+                del self._connections[conn.user_id]
+
+    async def publish(self, user_ids: List[str], event: dict):
+        await self.publish_many([(user_ids, event)])
+
+    async def publish_many(self, items: List[tuple]):
+        """Send each ``(user_ids, event)`` pair to every connection of those users."""
+        items = [(list(dict.fromkeys(user_ids)), event) for user_ids, event in items if user_ids]
+        if not items:
+            return
+        self.published += len(items)
+        try:
+            await self.broker.publish(items)
+        except Exception as e:
+            # Push is best effort; the data is already stored and can be refetched
+            logger.error(f"Push publish failed: {e}")
+
+    def _deliver_local(self, items: List[tuple]):
+        for user_ids, event in items:
+            for user_id in user_ids:
+                for conn in list(self._connections.get(user_id, ())):
+                    if conn.offer(event):
+                        self.delivered += 1
+                    elif conn.overflowed:
+                        self.slow_disconnects += 1
+                        self.disconnect(conn)
+
+    def stats(self) -> dict:
+        return {
+            "broker": self.broker.name,
+            "connections": self.connection_count,
+            "users": len(self._connections),
+            "peak_connections": self.peak_connections,
+            "max_connections": self.max_connections,
+            "queue_size": self.queue_size,
+            "published": self.published,
+            "delivered": self.delivered,
+            "slow_disconnects": self.slow_disconnects,
+            "rejected": self.rejected,
+        }
+
+PUSH_HEARTBEAT_SECONDS = float(os.environ.get("PUSH_HEARTBEAT_SECONDS", "25"))
+
+push_hub = PushHub(
+    broker=MongoPushBroker(
+        collection=os.environ.get("PUSH_EVENTS_COLLECTION", "push_events"),
+        size_bytes=int(os.environ.get("PUSH_EVENTS_BYTES", str(16 * 1024 * 1024))),
+    ) if os.environ.get("PUSH_BROKER", "memory") == "mongo" else MemoryPushBroker(),
+    queue_size=int(os.environ.get("PUSH_QUEUE_SIZE", "100")),
+    max_connections=int(os.environ.get("PUSH_MAX_CONNECTIONS", "5000")),
+)
+
+# ==================== NOTIFICATION FAN-OUT ====================
+
+class NotificationFanout:
+    """Delivers one notification to many users with batched insert_many.
+
+    Notification ids are derived from the source key and recipient, so
+    replaying a fan-out is idempotent: the unique index on notifications.id
+    rejects the repeats and they are counted as duplicates. With
+    NOTIFICATION_FANOUT_ASYNC enabled, publish() only enqueues the job and a
+    background worker writes it, so the HTTP response does not wait.
+    """
+
+    def __init__(self, batch_size: int, background: bool):
+        self.batch_size = batch_size
+        self.background = background
+        self._queue = None
+        self._worker = None
+        self.fanouts = 0
+        self.delivered = 0
+        self.duplicates = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+        self.last_ms = 0.0
+
+    async def start(self):
+        if self.background and self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            await self._queue.join()
+            self._worker.cancel()
+            self._worker = None
+
+    async def publish(self, user_ids: List[str], title: str, content: str, type: str, source: str):
+        """Notify ``user_ids``. ``source`` identifies the triggering event (e.g.
+        ``assignment:<id>``) and must be stable across retries."""
+        job = (list(dict.fromkeys(user_ids)), title, content, type, source)
+        if not job[0]:
+            return
+        if self._worker is not None:
+            self._queue.put_nowait(job)
+        else:
+            await self._deliver(*job)
+
+    async def _run(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._deliver(*job)
+            except Exception as e:
+                logger.error(f"Notification fan-out failed for {job[4]}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, user_ids: List[str], title: str, content: str, type: str, source: str):
+        started = time.monotonic()
+        now = datetime.now(timezone.utc)
+        created_at = now.isoformat()
+        expires_at = now + timedelta(days=NOTIFICATION_RETENTION_DAYS)
+        docs = [{
+            "id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"{source}/{user_id}")),
+            "user_id": user_id,
+            "title": title,
+            "content": content,
+            "type": type,
+            "read": False,
+            "created_at": created_at,
+            "expires_at": expires_at
+        } for user_id in user_ids]
+        try:
+            for i in range(0, len(docs), self.batch_size):
+                batch = docs[i:i + self.batch_size]
+                failed = set()
+                try:
+                    result = await db.notifications.insert_many(batch, ordered=False)
+                    self.delivered += len(result.inserted_ids)
+                except BulkWriteError as e:
+                    errors = e.details.get("writeErrors", [])
+                    if any(err.get("code") != 11000 for err in errors):
+                        raise
+                    self.duplicates += len(errors)
+                    self.delivered += e.details.get("nInserted", 0)
+                    failed = {err["index"] for err in errors}
+                # Count and push only what was inserted, so a replayed fan-out is a no-op
+                inserted = [doc for j, doc in enumerate(batch) if j not in failed]
+                if inserted:
+                    await db.notification_counters.bulk_write([
+                        UpdateOne(
+                            {"user_id": doc["user_id"]},
+                            {"$inc": {"unread": 1}, "$setOnInsert": {"read_all_at": ""}},
+                            upsert=True
+                        ) for doc in inserted
+                    ], ordered=False)
+                await push_hub.publish_many([
+                    ([doc["user_id"]], {"type": "notification", "notification": compact_notification(doc)})
+                    for doc in inserted
+                ])
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            self.fanouts += 1
+            self.total_seconds += elapsed
+            self.last_ms = round(elapsed * 1000, 2)
+
+    def stats(self) -> dict:
+        return {
+            "background": self._worker is not None,
+            "batch_size": self.batch_size,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "fanouts": self.fanouts,
+            "delivered": self.delivered,
+            "duplicates": self.duplicates,
+            "failures": self.failures,
+            "last_ms": self.last_ms,
+            "avg_ms": round(self.total_seconds / self.fanouts * 1000, 2) if self.fanouts else 0.0,
+        }
+
+notification_fanout = NotificationFanout(
+    batch_size=int(os.environ.get("NOTIFICATION_BATCH_SIZE", "500")),
+    background=os.environ.get("NOTIFICATION_FANOUT_ASYNC", "false").lower() == "true",
+)
+
+# ==================== NOTIFICATION INBOX ====================
+
+# Each user has a notification_counters document holding their unread count
+# and a read-all high-water mark (read_all_at, an ISO timestamp; "" when never
+# used). A notification is unread when read is False and it was created after
+# read_all_at, so "read all" is one counter write instead of an update_many
+# over the user's whole history. Counters are adjusted with $inc on fan-out,
+# single reads and retention, which keeps the unread badge an O(1) lookup.
+
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get("NOTIFICATION_RETENTION_DAYS", "90"))
+
+def compact_notification(doc: dict, read_all_at: str = "") -> dict:
+    """Inbox view of a notification: no storage fields, and ``read`` folded
+    together with the read-all mark."""
+    return {
+        "id": doc["id"],
+        "title": doc["title"],
+        "content": doc["content"],
+        "type": doc["type"],
+        "read": bool(doc.get("read")) or doc["created_at"] <= read_all_at,
+        "created_at": doc["created_at"],
+    }
+
+async def get_notification_counter(user_id: str) -> dict:
+    counter = await db.notification_counters.find_one({"user_id": user_id}, {"_id": 0})
+    return counter or {"user_id": user_id, "unread": 0, "read_all_at": ""}
+
+class NotificationRetention:
+    """Deletes notifications past their expires_at in batches and takes the
+    unread ones off their owners' counters.
+
+    This runs in-process rather than as a Mongo TTL index because a TTL
+    delete cannot adjust notification_counters.
+    """
+
+    def __init__(self, interval_seconds: float, batch_size: int, claim_seconds: float = 600):
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.claim_seconds = claim_seconds
+        self._task = None
+        self.sweeps = 0
+        self.deleted = 0
+        self.unread_expired = 0
+        self.last_sweep_at = None
+
+    async def start(self):
+        if self.interval_seconds > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Notification retention sweep failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def sweep(self) -> dict:
+        now = datetime.now(timezone.utc)
+        deleted = unread_expired = 0
+        while True:
+            # Every worker runs this sweeper, so each batch is claimed with a
+            # sweep id first and only the claimant adjusts counters for it.
+            # Claims left by a worker that died mid-batch are retaken.
+            sweep_id = str(uuid.uuid4())
+            claimable = {"expires_at": {"$lte": now}, "$or": [
+                {"sweep_id": {"$exists": False}},
+                {"swept_at": {"$lte": now - timedelta(seconds=self.claim_seconds)}},
+            ]}
+            candidates = await db.notifications.find(claimable, {"_id": 0, "id": 1}).limit(self.batch_size).to_list(self.batch_size)
+            if not candidates:
+                break
+            await db.notifications.update_many(
+                {**claimable, "id": {"$in": [c["id"] for c in candidates]}},
+                {"$set": {"sweep_id": sweep_id, "swept_at": now}}
+            )
+            docs = await db.notifications.find(
+                {"sweep_id": sweep_id},
+                {"_id": 0, "id": 1, "user_id": 1, "read": 1, "created_at": 1}
+            ).to_list(None)
+            if not docs:
+                continue
+            user_ids = list({d["user_id"] for d in docs})
+            marks = {c["user_id"]: c.get("read_all_at", "") async for c in db.notification_counters.find(
+                {"user_id": {"$in": user_ids}}, {"_id": 0, "user_id": 1, "read_all_at": 1}
+            )}
+            unread = Counter(
+                d["user_id"] for d in docs
+                if not d.get("read") and d["created_at"] > marks.get(d["user_id"], "")
+            )
+            result = await db.notifications.delete_many({"sweep_id": sweep_id})
+            if unread:
+                await db.notification_counters.bulk_write([
+                    UpdateOne({"user_id": user_id}, [
+                        {"$set": {"unread": {"$max": [0, {"$subtract": ["$unread", n]}]}}}
+                    ]) for user_id, n in unread.items()
+                ], ordered=False)
+            deleted += result.deleted_count
+            unread_expired += sum(unread.values())
+        self.sweeps += 1
+        self.deleted += deleted
+        self.unread_expired += unread_expired
+        self.last_sweep_at = now.isoformat()
+        return {"deleted": deleted, "unread_expired": unread_expired}
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "retention_days": NOTIFICATION_RETENTION_DAYS,
+            "sweeps": self.sweeps,
+            "deleted": self.deleted,
+            "unread_expired": self.unread_expired,
+            "last_sweep_at": self.last_sweep_at,
+        }
+
+notification_retention = NotificationRetention(
+    interval_seconds=float(os.environ.get("NOTIFICATION_SWEEP_SECONDS", "3600")),
+    batch_size=int(os.environ.get("NOTIFICATION_SWEEP_BATCH", "1000")),
+)
+
+async def rebuild_notification_counters() -> dict:
+    """Give notifications stored before counters existed an expires_at, and
+    recompute every user's unread count from the notifications themselves."""
+    ops = []
+    async for n in db.notifications.find({"expires_at": {"$exists": False}}, {"_id": 0, "id": 1, "created_at": 1}):
+        created = datetime.fromisoformat(n["created_at"])
+        if created.tzinfo is None:
+            created = created.replace(tzinfo=timezone.utc)
+        ops.append(UpdateOne({"id": n["id"]}, {"$set": {"expires_at": created + timedelta(days=NOTIFICATION_RETENTION_DAYS)}}))
+    for i in range(0, len(ops), 1000):
+        await db.notifications.bulk_write(ops[i:i + 1000], ordered=False)
+    
+    marks = {c["user_id"]: c.get("read_all_at", "") async for c in db.notification_counters.find({}, {"_id": 0})}
+    unread = Counter()
+    users = set(marks)
+    async for n in db.notifications.find({}, {"_id": 0, "user_id": 1, "read": 1, "created_at": 1}):
+        users.add(n["user_id"])
+        if not n.get("read") and n["created_at"] > marks.get(n["user_id"], ""):
+            unread[n["user_id"]] += 1
+    counter_ops = [UpdateOne(
+        {"user_id": user_id},
+        {"$set": {"unread": unread.get(user_id, 0)}, "$setOnInsert": {"read_all_at": ""}},
+        upsert=True
+    ) for user_id in users]
+    for i in range(0, len(counter_ops), 1000):
+        await db.notification_counters.bulk_write(counter_ops[i:i + 1000], ordered=False)
+    return {"expires_at_set": len(ops), "counters": len(counter_ops)}
+
+# ==================== DENORMALIZED FIELDS ====================
+
+# Names are copied into the documents that display them so that reads need
+# no joins. Every copy is registered here as
+# (source collection, source field) -> [(target collection, target field, key)]
+# where ``key`` on the target holds the source document's id. Changing a
+# source field queues a propagation job that rewrites the copies in batches.
+DENORMALIZED_FIELDS = {
+    ("users", "full_name"): [
+        ("classes", "teacher_name", "teacher_id"),
+        ("announcements", "author_name", "author_id"),
+        ("submissions", "student_name", "student_id"),
+        ("chat_messages", "sender_name", "sender_id"),
+        ("leaderboard", "student_name", "student_id"),
+    ],
+    ("classes", "name"): [
+        ("assignments", "class_name", "class_id"),
+        ("announcements", "class_name", "class_id"),
+    ],
+}
+
+class DenormalizedFieldPropagator:
+    """Rewrites denormalized copies after a source field changes.
+
+    Jobs live in propagation_jobs with per-target progress. Each batch reads
+    the source's current value and rewrites up to ``batch_size`` copies that
+    differ from it, so jobs are idempotent, overlapping renames converge on
+    the latest value, and a restart simply resumes. A job stays open until
+    ``settle_seconds`` after the change and then makes a final pass, which
+    catches copies written by processes still holding the old value in
+    their user cache. A job that raises is retried with exponential backoff
+    and marked failed after ``max_attempts``.
+    """
+
+    def __init__(self, batch_size: int, batch_pause: float, settle_seconds: float, stale_after: float,
+                 max_attempts: int = 5, retry_seconds: float = 5):
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.settle_seconds = settle_seconds
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self._queue = None
+        self._task = None
+        self.jobs_completed = 0
+        self.jobs_retried = 0
+        self.jobs_failed = 0
+        self.documents_updated = 0
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        await self.recover()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._queue = None
+
+    async def recover(self):
+        """Requeue pending jobs and jobs whose worker died mid-run."""
+        stale = (datetime.now(timezone.utc) - timedelta(seconds=self.stale_after)).isoformat()
+        await db.propagation_jobs.update_many(
+            {"status": "running", "heartbeat_at": {"$lt": stale}},
+            {"$set": {"status": "pending"}}
+        )
+        async for job in db.propagation_jobs.find({"status": "pending"}, {"_id": 0, "id": 1}):
+            self._queue.put_nowait(job["id"])
+
+    async def changed(self, source: str, source_id: str, fields: dict, requested_by: Optional[str] = None) -> List[str]:
+        """Queue propagation for the registered fields among ``fields``."""
+        job_ids = []
+        now = datetime.now(timezone.utc)
+        for field in fields:
+            targets = DENORMALIZED_FIELDS.get((source, field))
+            if not targets:
+                continue
+            job = {
+                "id": str(uuid.uuid4()),
+                "source": source,
+                "field": field,
+                "source_id": source_id,
+                "value": fields[field],
+                "requested_by": requested_by,
+                "status": "pending",
+                "targets": [
+                    {"collection": c, "field": f, "key": k, "updated": 0, "done": False}
+                    for c, f, k in targets
+                ],
+                "updated": 0,
+                "settle_at": (now + timedelta(seconds=self.settle_seconds)).isoformat(),
+                "created_at": now.isoformat(),
+            }
+            await db.propagation_jobs.insert_one(job)
+            if self._queue is not None:
+                self._queue.put_nowait(job["id"])
+            job_ids.append(job["id"])
+        return job_ids
+
+    async def _run(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self.run_job(job_id)
+            except Exception as e:
+                await self._retry_or_fail(job_id, e)
+
+    async def _retry_or_fail(self, job_id: str, error: Exception):
+        # Errors here are mostly transient (failover, timeouts), so the job is
+        # retried with exponential backoff; finished targets are not redone
+        job = await db.propagation_jobs.find_one_and_update(
+            {"id": job_id},
+            {"$inc": {"attempts": 1}, "$set": {"error": str(error)[:500]}},
+            projection={"_id": 0, "id": 1, "attempts": 1}
+        )
+        attempts = job.get("attempts", 0) + 1 if job is not None else self.max_attempts
+        if attempts < self.max_attempts:
+            delay = self.retry_seconds * 2 ** (attempts - 1)
+            logger.warning(f"Propagation job {job_id} failed (attempt {attempts}), retrying in {delay:g}s: {error}")
+            await db.propagation_jobs.update_one({"id": job_id}, {"$set": {"status": "pending"}})
+            self._requeue_later(job_id, delay)
+            self.jobs_retried += 1
+            return
+        logger.error(f"Propagation job {job_id} failed after {attempts} attempts: {error}")
+        await db.propagation_jobs.update_one({"id": job_id}, {"$set": {"status": "failed"}})
+        self.jobs_failed += 1
+
+    def _requeue_later(self, job_id: str, delay: float):
+        queue = self._queue
+        if queue is not None:
+            asyncio.get_running_loop().call_later(max(delay, 0), queue.put_nowait, job_id)
+
+    async def run_job(self, job_id: str):
+        job = await db.propagation_jobs.find_one_and_update(
+            {"id": job_id, "status": "pending"},
+            {"$set": {"status": "running", "heartbeat_at": datetime.now(timezone.utc).isoformat()}},
+            projection={"_id": 0, "source": 1, "field": 1, "source_id": 1, "targets": 1, "settle_at": 1}
+        )
+        if not job:
+            return
+        for index, target in enumerate(job["targets"]):
+            if target["done"]:
+                continue
+            updated = await self.propagate(job["source"], job["field"], job["source_id"], target, job_id)
+            await db.propagation_jobs.update_one(
+                {"id": job_id},
+                {
+                    "$set": {f"targets.{index}.done": True, "heartbeat_at": datetime.now(timezone.utc).isoformat()},
+                    "$inc": {f"targets.{index}.updated": updated, "updated": updated},
+                }
+            )
+        
+        remaining = (datetime.fromisoformat(job["settle_at"]) - datetime.now(timezone.utc)).total_seconds()
+        if remaining > 0 and self._queue is not None:
+            # Reopen every target for one more pass once caches have expired
+            await db.propagation_jobs.update_one(
+                {"id": job_id},
+                {"$set": {"status": "pending", **{f"targets.{i}.done": False for i in range(len(job["targets"]))}}}
+            )
+            self._requeue_later(job_id, remaining)
+            return
+        await db.propagation_jobs.update_one(
+            {"id": job_id},
+            {"$set": {"status": "done", "finished_at": datetime.now(timezone.utc).isoformat()}}
+        )
+        self.jobs_completed += 1
+
+    async def propagate(self, source: str, field: str, source_id: str, target: dict, job_id: Optional[str] = None) -> int:
+        """Bring one target's copies of ``field`` in line with the source
+        document, a batch at a time. Returns the number rewritten."""
+        doc = await db[source].find_one({"id": source_id}, {"_id": 0, field: 1})
+        if doc is None:
+            return 0
+        value = doc.get(field)
+        collection = db[target["collection"]]
+        stale = {target["key"]: source_id, target["field"]: {"$ne": value}}
+        updated = 0
+        while True:
+            ids = [d["_id"] async for d in collection.find(stale, {"_id": 1}).limit(self.batch_size)]
+            if not ids:
+                return updated
+            result = await collection.update_many(
+                {"_id": {"$in": ids}, **stale}, {"$set": {target["field"]: value}}
+            )
+            updated += result.modified_count
+            self.documents_updated += result.modified_count
+            if job_id:
+                await db.propagation_jobs.update_one(
+                    {"id": job_id}, {"$set": {"heartbeat_at": datetime.now(timezone.utc).isoformat()}}
+                )
+            if self.batch_pause:
+                # Leave room for request traffic between batches
+                await asyncio.sleep(self.batch_pause)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "jobs_completed": self.jobs_completed,
+            "jobs_retried": self.jobs_retried,
+            "jobs_failed": self.jobs_failed,
+            "documents_updated": self.documents_updated,
+        }
+
+denormalized_fields = DenormalizedFieldPropagator(
+    batch_size=int(os.environ.get("DENORM_BATCH_SIZE", "500")),
+    batch_pause=float(os.environ.get("DENORM_BATCH_PAUSE_SECONDS", "0.05")),
+    settle_seconds=user_cache.ttl,
+    stale_after=float(os.environ.get("DENORM_STALE_SECONDS", "300")),
+    max_attempts=int(os.environ.get("DENORM_MAX_ATTEMPTS", "5")),
+    retry_seconds=float(os.environ.get("DENORM_RETRY_SECONDS", "5")),
+)
+
+async def reconcile_denormalized_fields() -> dict:
+    """Rewrite every registered copy that differs from its source."""
+    updated = {}
+    for (source, field), targets in DENORMALIZED_FIELDS.items():
+        for collection, target_field, key in targets:
+            # One pass per target: each source document probes its copies
+            # through the target's key index for one that disagrees
+            stale = db[source].aggregate([
+                {"$project": {"_id": 0, "id": 1, "value": {"$ifNull": [f"${field}", None]}}},
+                {"$lookup": {
+                    "from": collection, "localField": "id", "foreignField": key,
+                    "let": {"value": "$value"},
+                    "pipeline": [
+                        {"$match": {"$expr": {"$ne": [{"$ifNull": [f"${target_field}", None]}, "$$value"]}}},
+                        {"$limit": 1},
+                        {"$project": {"_id": 1}},
+                    ],
+                    "as": "stale",
+                }},
+                {"$match": {"stale": {"$ne": []}}},
+                {"$project": {"id": 1}},
+            ])
+            target = {"collection": collection, "field": target_field, "key": key}
+            async for doc in stale:
+                n = await denormalized_fields.propagate(source, field, doc["id"], target)
+                if n:
+                    updated[f"{collection}.{target_field}"] = updated.get(f"{collection}.{target_field}", 0) + n
+    return {"updated": updated}
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/signup")
@@ -172,13 +1278,16 @@ async def signup(user: UserCreate):
         "id": str(uuid.uuid4()),
         "username": user.username,
         "email": user.email,
-        "password": hash_password(user.password),
+        "password": await hash_password(user.password),
         "full_name": user.full_name,
         "role": user.role,
         "avatar": None,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.users.insert_one(user_doc)
+    try:
+        await db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email or username already exists")
     
     token = create_token(user_doc["id"], user_doc["role"])
     return {
@@ -189,9 +1298,19 @@ async def signup(user: UserCreate):
 @api_router.post("/auth/login")
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user["password"]):
+    if not user or not await verify_password(credentials.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    # Upgrade hashes created under a different BCRYPT_ROUNDS while we hold the plaintext
+    if password_hasher.needs_rehash(user["password"]):
+        new_hash = await hash_password(credentials.password)
+        await db.users.update_one(
+            {"id": user["id"], "password": user["password"]},
+            {"$set": {"password": new_hash}}
+        )
+        invalidate_cached_user(user["id"])
+        password_hasher.rehashed += 1
+    
     token = create_token(user["id"], user["role"])
     return {
         "token": token,
@@ -207,9 +1326,25 @@ async def update_profile(update: UserUpdate, current_user: dict = Depends(get_cu
     update_data = {k: v for k, v in update.model_dump().items() if v is not None}
     if update_data:
         await db.users.update_one({"id": current_user["id"]}, {"$set": update_data})
+        invalidate_cached_user(current_user["id"])
+        changed = {k: v for k, v in update_data.items() if current_user.get(k) != v}
+        await denormalized_fields.changed("users", current_user["id"], changed, requested_by=current_user["id"])
     updated = await db.users.find_one({"id": current_user["id"]}, {"_id": 0, "password": 0})
     return updated
 
+@api_router.get("/propagation-jobs")
+async def get_propagation_jobs(current_user: dict = Depends(get_current_user)):
+    return await db.propagation_jobs.find(
+        {"requested_by": current_user["id"]}, {"_id": 0}
+    ).sort("created_at", -1).limit(20).to_list(20)
+
+@api_router.get("/propagation-jobs/{job_id}")
+async def get_propagation_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = await db.propagation_jobs.find_one({"id": job_id, "requested_by": current_user["id"]}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 # ==================== CLASS ROUTES ====================
 
 @api_router.post("/classes")
@@ -228,7 +1363,19 @@ async def create_class(class_data: ClassCreate, current_user: dict = Depends(get
         "students": [],
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.classes.insert_one(class_doc)
+    for _ in range(5):
+        try:
+            await db.classes.insert_one(class_doc)
+            break
+        except DuplicateKeyError:
+            class_doc.pop("_id", None)
+            class_doc["class_code"] = generate_class_code()
+    else:
+        raise HTTPException(status_code=500, detail="Could not allocate a class code")
+    await index_for_search(
+        "class", class_doc["id"], class_doc["name"], f"{class_doc['subject']} {class_doc['description']}",
+        class_id=class_doc["id"]
+    )
     return {k: v for k, v in class_doc.items() if k != "_id"}
 
 @api_router.get("/classes")
@@ -273,6 +1420,8 @@ async def delete_class(class_id: str, current_user: dict = Depends(get_current_u
         raise HTTPException(status_code=403, detail="Not authorized")
     
     await db.classes.delete_one({"id": class_id})
+    await db.leaderboard.delete_many({"scope": class_id})
+    await db.search_docs.delete_many({"class_id": class_id, "kind": {"$ne": "file"}})
     return {"message": "Class deleted"}
 
 @api_router.get("/classes/{class_id}/students")
@@ -318,24 +1467,27 @@ async def create_announcement(data: AnnouncementCreate, current_user: dict = Dep
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.announcements.insert_one(announcement)
+    await index_for_search("announcement", announcement["id"], data.title, data.content, class_id=data.class_id)
     
     # Create notifications for students
-    for student_id in class_doc.get("students", []):
-        notification = {
-            "id": str(uuid.uuid4()),
-            "user_id": student_id,
-            "title": f"New announcement in {class_doc['name']}",
-            "content": data.title,
-            "type": "announcement",
-            "read": False,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.notifications.insert_one(notification)
+    await notification_fanout.publish(
+        class_doc.get("students", []),
+        f"New announcement in {class_doc['name']}",
+        data.title,
+        "announcement",
+        f"announcement:{announcement['id']}"
+    )
     
     return {k: v for k, v in announcement.items() if k != "_id"}
 
 @api_router.get("/announcements")
-async def get_announcements(class_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_announcements(
+    response: Response,
+    class_id: Optional[str] = None,
+    limit: int = page_limit(50),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
     query = {}
     if class_id:
         query["class_id"] = class_id
@@ -350,7 +1502,9 @@ async def get_announcements(class_id: Optional[str] = None, current_user: dict =
         class_ids = [c["id"] for c in classes]
         query["class_id"] = {"$in": class_ids}
     
-    announcements = await db.announcements.find(query, {"_id": 0}).sort("created_at", -1).to_list(50)
+    announcements = await keyset_page(
+        db.announcements, query, {"_id": 0}, [("created_at", -1), ("id", -1)], limit, cursor, response
+    )
     return announcements
 
 # ==================== ASSIGNMENT ROUTES ====================
@@ -360,6 +1514,10 @@ async def create_assignment(data: AssignmentCreate, current_user: dict = Depends
     if current_user["role"] != "teacher":
         raise HTTPException(status_code=403, detail="Only teachers can create assignments")
     
+    due_at = parse_due_date(data.due_date)
+    if due_at is None:
+        raise HTTPException(status_code=400, detail="Invalid due date")
+    
     class_doc = await db.classes.find_one({"id": data.class_id})
     if not class_doc or class_doc["teacher_id"] != current_user["id"]:
         raise HTTPException(status_code=403, detail="Not authorized")
@@ -371,29 +1529,33 @@ async def create_assignment(data: AssignmentCreate, current_user: dict = Depends
         "title": data.title,
         "description": data.description,
         "due_date": data.due_date,
+        "due_at": due_at,
         "max_points": data.max_points,
         "teacher_id": current_user["id"],
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.assignments.insert_one(assignment)
+    await index_for_search("assignment", assignment["id"], data.title, data.description, class_id=data.class_id)
     
     # Notify students
-    for student_id in class_doc.get("students", []):
-        notification = {
-            "id": str(uuid.uuid4()),
-            "user_id": student_id,
-            "title": f"New assignment in {class_doc['name']}",
-            "content": data.title,
-            "type": "assignment",
-            "read": False,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.notifications.insert_one(notification)
+    await notification_fanout.publish(
+        class_doc.get("students", []),
+        f"New assignment in {class_doc['name']}",
+        data.title,
+        "assignment",
+        f"assignment:{assignment['id']}"
+    )
     
     return {k: v for k, v in assignment.items() if k != "_id"}
 
 @api_router.get("/assignments")
-async def get_assignments(class_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_assignments(
+    response: Response,
+    class_id: Optional[str] = None,
+    limit: int = page_limit(100),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
     query = {}
     if class_id:
         query["class_id"] = class_id
@@ -406,7 +1568,9 @@ async def get_assignments(class_id: Optional[str] = None, current_user: dict = D
         class_ids = [c["id"] for c in classes]
         query["class_id"] = {"$in": class_ids}
     
-    assignments = await db.assignments.find(query, {"_id": 0}).sort("due_date", 1).to_list(100)
+    assignments = await keyset_page(
+        db.assignments, query, {"_id": 0}, [("due_date", 1), ("id", 1)], limit, cursor, response
+    )
     return assignments
 
 @api_router.get("/assignments/{assignment_id}")
@@ -438,6 +1602,7 @@ async def create_submission(data: SubmissionCreate, current_user: dict = Depends
     submission = {
         "id": str(uuid.uuid4()),
         "assignment_id": data.assignment_id,
+        "class_id": assignment["class_id"],
         "student_id": current_user["id"],
         "student_name": current_user["full_name"],
         "content": data.content,
@@ -446,11 +1611,20 @@ async def create_submission(data: SubmissionCreate, current_user: dict = Depends
         "remarks": None,
         "submitted_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.submissions.insert_one(submission)
+    try:
+        await db.submissions.insert_one(submission)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Already submitted")
     return {k: v for k, v in submission.items() if k != "_id"}
 
 @api_router.get("/submissions")
-async def get_submissions(assignment_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_submissions(
+    response: Response,
+    assignment_id: Optional[str] = None,
+    limit: int = page_limit(100),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
     query = {}
     if assignment_id:
         query["assignment_id"] = assignment_id
@@ -458,7 +1632,9 @@ async def get_submissions(assignment_id: Optional[str] = None, current_user: dic
     if current_user["role"] == "student":
         query["student_id"] = current_user["id"]
     
-    submissions = await db.submissions.find(query, {"_id": 0}).to_list(100)
+    submissions = await keyset_page(
+        db.submissions, query, {"_id": 0}, [("submitted_at", -1), ("id", -1)], limit, cursor, response
+    )
     return submissions
 
 @api_router.put("/submissions/grade")
@@ -466,117 +1642,1372 @@ async def grade_submission(data: GradeSubmission, current_user: dict = Depends(g
     if current_user["role"] != "teacher":
         raise HTTPException(status_code=403, detail="Only teachers can grade")
     
-    await db.submissions.update_one(
+    # graded_version counts gradings so that every one gets its own
+    # notification, including a regrade back to an earlier value
+    previous = await db.submissions.find_one_and_update(
         {"id": data.submission_id},
-        {"$set": {"grade": data.grade, "remarks": data.remarks}}
+        {"$set": {"grade": data.grade, "remarks": data.remarks}, "$inc": {"graded_version": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
     )
-    
-    submission = await db.submissions.find_one({"id": data.submission_id}, {"_id": 0})
+    if not previous:
+        raise HTTPException(status_code=404, detail="Submission not found")
+    submission = {
+        **previous, "grade": data.grade, "remarks": data.remarks,
+        "graded_version": previous.get("graded_version", 0) + 1,
+    }
+    await record_grade_in_leaderboard(submission, previous.get("grade"))
     
     # Notify student
-    notification = {
-        "id": str(uuid.uuid4()),
-        "user_id": submission["student_id"],
-        "title": "Assignment graded",
-        "content": f"You received {data.grade} points",
-        "type": "grade",
-        "read": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
-    await db.notifications.insert_one(notification)
+    await notification_fanout.publish(
+        [submission["student_id"]],
+        "Assignment graded",
+        f"You received {data.grade} points",
+        "grade",
+        f"grade:{submission['id']}:{submission['graded_version']}"
+    )
+    await push_hub.publish([submission["student_id"]], {
+        "type": "submission.graded",
+        "submission": {k: submission.get(k) for k in ("id", "assignment_id", "class_id", "grade", "remarks")}
+    })
     
     return submission
 
-# ==================== FILE ROUTES ====================
+# ==================== TEXT ANALYSIS ====================
 
-@api_router.post("/files/upload")
-async def upload_file(
-    file: UploadFile = File(...),
-    folder_id: Optional[str] = Form(None),
-    class_id: Optional[str] = Form(None),
-    current_user: dict = Depends(get_current_user)
-):
-    file_id = str(uuid.uuid4())
-    file_ext = Path(file.filename).suffix
-    file_path = UPLOAD_DIR / f"{file_id}{file_ext}"
-    
-    content = await file.read()
-    async with aiofiles.open(file_path, 'wb') as f:
-        await f.write(content)
-    
-    # Extract text if PDF
-    text_content = None
-    if file_ext.lower() == '.pdf':
-        try:
-            pdf_reader = PdfReader(io.BytesIO(content))
-            text_content = " ".join([page.extract_text() or "" for page in pdf_reader.pages])
-        except Exception as e:
-            logger.error(f"PDF extraction error: {e}")
-    
-    file_doc = {
-        "id": file_id,
-        "filename": file.filename,
-        "file_path": str(file_path),
-        "file_type": file.content_type,
-        "file_size": len(content),
-        "folder_id": folder_id,
-        "class_id": class_id,
-        "owner_id": current_user["id"],
-        "text_content": text_content,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
-    await db.files.insert_one(file_doc)
-    return {k: v for k, v in file_doc.items() if k != "_id"}
+_WORD_RE = re.compile(r"[a-z0-9]+")
 
-@api_router.get("/files")
-async def get_files(
-    folder_id: Optional[str] = None,
-    class_id: Optional[str] = None,
-    current_user: dict = Depends(get_current_user)
-):
-    query = {}
-    if folder_id:
-        query["folder_id"] = folder_id
-    if class_id:
-        query["class_id"] = class_id
-    else:
-        query["owner_id"] = current_user["id"]
-    
-    files = await db.files.find(query, {"_id": 0, "text_content": 0}).to_list(100)
-    return files
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from has have how i in is it its me my of on or "
+    "so than that the their them then there these they this to was we were what when where which "
+    "who why will with you your".split()
+)
 
-@api_router.get("/files/{file_id}")
-async def get_file(file_id: str, current_user: dict = Depends(get_current_user)):
-    file_doc = await db.files.find_one({"id": file_id}, {"_id": 0})
-    if not file_doc:
-        raise HTTPException(status_code=404, detail="File not found")
-    return file_doc
+def tokenize(text: str) -> List[str]:
+    """Lower-cased alphanumeric terms without stopwords."""
+    return [w for w in _WORD_RE.findall(text.lower()) if w not in STOPWORDS]
 
-@api_router.delete("/files/{file_id}")
-async def delete_file(file_id: str, current_user: dict = Depends(get_current_user)):
-    file_doc = await db.files.find_one({"id": file_id})
-    if not file_doc:
-        raise HTTPException(status_code=404, detail="File not found")
-    if file_doc["owner_id"] != current_user["id"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    
-    # Delete physical file
-    try:
-        os.remove(file_doc["file_path"])
-    except:
-        pass
-    
-    await db.files.delete_one({"id": file_id})
-    return {"message": "File deleted"}
+EMBEDDING_DIMS = 512
 
-# ==================== FOLDER ROUTES ====================
+def hashed_embedding(text: str, dims: int = EMBEDDING_DIMS) -> np.ndarray:
+    """Offline bag-of-words embedding: word and bigram features hashed into
+    ``dims`` buckets, L2-normalised so that a dot product is cosine similarity."""
+    words = _WORD_RE.findall(text.lower())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vec = np.zeros(dims, dtype=np.float32)
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dims
+        vec[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
 
-@api_router.post("/folders")
-async def create_folder(data: FolderCreate, current_user: dict = Depends(get_current_user)):
-    folder = {
-        "id": str(uuid.uuid4()),
-        "name": data.name,
-        "parent_id": data.parent_id,
+# ==================== DOCUMENT INGESTION ====================
+
+def count_pdf_pages(path: str) -> int:
+    return len(PdfReader(path).pages)
+
+def extract_pdf_pages(path: str, start: int, stop: int) -> list:
+    """Text of pages [start, stop). Runs in an ingestion worker process."""
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, min(stop, len(reader.pages)))]
+
+# Extracted text lives in file_chunks, one document per page section, so that
+# files documents stay small and readers fetch only the chunks they need.
+CHUNK_MAX_CHARS = 2000
+
+def split_page(text: str, max_chars: int = CHUNK_MAX_CHARS) -> List[str]:
+    """Split page text into sections of at most ``max_chars``, on whitespace where possible."""
+    sections = []
+    while len(text) > max_chars:
+        cut = text.rfind(" ", 0, max_chars)
+        cut = cut if cut > 0 else max_chars
+        sections.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text:
+        sections.append(text)
+    return sections
+
+async def store_document_text(file_id: str, pages: List[str]):
+    chunks = []
+    offset = 0
+    for page_number, page_text in enumerate(pages, start=1):
+        for section in split_page(page_text):
+            chunks.append({
+                "file_id": file_id,
+                "seq": len(chunks),
+                "page": page_number,
+                "offset": offset,
+                "length": len(section),
+                "byte_size": len(section.encode()),
+                "text": section,
+                **chunk_retrieval_fields(section),
+            })
+            offset += len(section) + 1
+    await db.file_chunks.delete_many({"file_id": file_id})
+    for i in range(0, len(chunks), 500):
+        await db.file_chunks.insert_many(chunks[i:i + 500])
+    await db.files.update_one(
+        {"id": file_id},
+        {"$set": {"chunk_count": len(chunks), "text_length": max(offset - 1, 0)}, "$unset": {"text_content": ""}}
+    )
+
+async def load_document_context(file_doc: dict, max_chars: int) -> str:
+    """Leading document text up to ``max_chars``, reading only as many chunks as needed."""
+    if file_doc.get("text_content"):
+        # Not yet migrated by `manage.py migrate-file-text`
+        return file_doc["text_content"][:max_chars]
+    parts, used = [], 0
+    cursor = db.file_chunks.find({"file_id": file_doc["id"]}, {"_id": 0, "text": 1}).sort("seq", 1).batch_size(8)
+    async for chunk in cursor:
+        parts.append(chunk["text"][:max_chars - used])
+        used += len(parts[-1]) + 1
+        if used >= max_chars:
+            break
+    return " ".join(parts)
+
+async def reindex_file_chunks() -> dict:
+    """Recompute retrieval fields for chunks written before they existed
+    (or after toggling AI_RETRIEVAL_EMBEDDINGS)."""
+    updated = 0
+    batch = []
+    async for chunk in db.file_chunks.find({}, {"_id": 1, "text": 1}):
+        batch.append(UpdateOne({"_id": chunk["_id"]}, {"$set": chunk_retrieval_fields(chunk["text"])}))
+        if len(batch) >= 500:
+            updated += (await db.file_chunks.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        updated += (await db.file_chunks.bulk_write(batch, ordered=False)).modified_count
+    document_index_cache.clear()
+    return {"updated": updated}
+
+async def migrate_file_text() -> dict:
+    """Move inline text_content from files documents into file_chunks."""
+    migrated = 0
+    async for doc in db.files.find({"text_content": {"$type": "string"}}, {"_id": 0, "id": 1, "text_content": 1}):
+        await store_document_text(doc["id"], [doc["text_content"]])
+        migrated += 1
+    return {"migrated": migrated}
+
+class DocumentIngestion:
+    """Extracts text from uploaded PDFs off the request path.
+
+    Status lives on the files document: ingest_status moves from pending to
+    processing to ready or failed, with pages_total/pages_done as progress.
+    Pages are extracted in batches on a process pool, so a large textbook
+    neither blocks the event loop nor holds the GIL, and at most
+    ``concurrency`` documents are worked on at once.
+    """
+
+    def __init__(self, workers: int, concurrency: int, pages_per_batch: int, stale_after: float):
+        self.workers = workers
+        self.concurrency = concurrency
+        self.pages_per_batch = pages_per_batch
+        self.stale_after = stale_after
+        self._executor = None
+        self._queue = None
+        self._tasks = []
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.pages = 0
+
+    async def start(self):
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+        await self.recover()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def recover(self):
+        """Requeue pending files and files whose worker died mid-extraction."""
+        stale = (datetime.now(timezone.utc) - timedelta(seconds=self.stale_after)).isoformat()
+        await db.files.update_many(
+            {"ingest_status": "processing", "ingest_started_at": {"$lt": stale}},
+            {"$set": {"ingest_status": "pending"}}
+        )
+        async for doc in db.files.find({"ingest_status": "pending"}, {"_id": 0, "id": 1}):
+            self.submit(doc["id"])
+
+    def submit(self, file_id: str):
+        self._queue.put_nowait(file_id)
+
+    async def _run(self):
+        while True:
+            file_id = await self._queue.get()
+            self.active += 1
+            try:
+                await self._process(file_id)
+            except Exception as e:
+                logger.error(f"Ingestion failed for {file_id}: {e}")
+            finally:
+                self.active -= 1
+                self._queue.task_done()
+
+    async def _process(self, file_id: str):
+        # Claim the file so that only one worker (or app process) extracts it
+        file_doc = await db.files.find_one_and_update(
+            {"id": file_id, "ingest_status": "pending"},
+            {"$set": {"ingest_status": "processing", "ingest_started_at": datetime.now(timezone.utc).isoformat()}},
+            projection={"_id": 0, "file_path": 1, "storage": 1, "sha256": 1}
+        )
+        if not file_doc:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            async with file_local_path(file_doc) as local_path:
+                path = str(local_path)
+                total = await loop.run_in_executor(self._executor, count_pdf_pages, path)
+                await db.files.update_one({"id": file_id}, {"$set": {"pages_total": total, "pages_done": 0}})
+                pages = []
+                for start in range(0, total, self.pages_per_batch):
+                    batch = await loop.run_in_executor(
+                        self._executor, extract_pdf_pages, path, start, start + self.pages_per_batch
+                    )
+                    pages += batch
+                    self.pages += len(batch)
+                    await db.files.update_one({"id": file_id}, {"$set": {"pages_done": len(pages)}})
+            await store_document_text(file_id, pages)
+            await index_file_body_for_search(file_id)
+            await db.files.update_one({"id": file_id}, {"$set": {"ingest_status": "ready"}})
+            self.completed += 1
+        except Exception as e:
+            logger.error(f"PDF extraction error: {e}")
+            await db.files.update_one(
+                {"id": file_id},
+                {"$set": {"ingest_status": "failed", "ingest_error": str(e)[:500]}}
+            )
+            self.failed += 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "concurrency": self.concurrency,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "active": self.active,
+            "completed": self.completed,
+            "failed": self.failed,
+            "pages_extracted": self.pages,
+        }
+
+document_ingestion = DocumentIngestion(
+    workers=int(os.environ.get("INGEST_WORKERS", "2")),
+    concurrency=int(os.environ.get("INGEST_CONCURRENCY", "2")),
+    pages_per_batch=int(os.environ.get("INGEST_PAGES_PER_BATCH", "20")),
+    stale_after=float(os.environ.get("INGEST_STALE_SECONDS", "600")),
+)
+
+# ==================== DOCUMENT RETRIEVAL ====================
+
+# Chunks are ranked per question with BM25 over the term counts stored at
+# ingestion. With AI_RETRIEVAL_EMBEDDINGS enabled each chunk also stores a
+# hashed embedding and the score blends in cosine similarity.
+RETRIEVAL_EMBEDDINGS = os.environ.get("AI_RETRIEVAL_EMBEDDINGS", "false").lower() == "true"
+AI_CONTEXT_TOKEN_BUDGET = int(os.environ.get("AI_CONTEXT_TOKEN_BUDGET", "2000"))
+CHARS_PER_TOKEN = 4
+BM25_K1 = 1.5
+BM25_B = 0.75
+EMBEDDING_WEIGHT = 0.3
+MIN_RELATIVE_SCORE = 0.25
+
+def chunk_retrieval_fields(text: str) -> dict:
+    terms = tokenize(text)
+    fields = {"terms": dict(Counter(terms)), "term_count": len(terms)}
+    if RETRIEVAL_EMBEDDINGS:
+        fields["embedding"] = hashed_embedding(text).astype(np.float16).tobytes()
+    return fields
+
+class DocumentIndex:
+    """In-memory BM25 (and optional embedding) index over one file's chunks."""
+
+    def __init__(self, chunks: List[dict]):
+        self.seqs = np.array([c["seq"] for c in chunks], dtype=np.int64)
+        self.lengths = np.array([c.get("length", 0) for c in chunks], dtype=np.int64)
+        self.term_counts = np.array([c.get("term_count", 0) for c in chunks], dtype=np.float32)
+        self.avg_terms = float(self.term_counts.mean()) if len(chunks) else 0.0
+        self.postings = {}
+        for i, chunk in enumerate(chunks):
+            for term, tf in chunk.get("terms", {}).items():
+                self.postings.setdefault(term, []).append((i, tf))
+        embeddings = [c.get("embedding") for c in chunks]
+        self.embeddings = (
+            np.stack([np.frombuffer(e, dtype=np.float16).astype(np.float32) for e in embeddings])
+            if chunks and all(embeddings) else None
+        )
+
+    def scores(self, question: str) -> np.ndarray:
+        n = len(self.seqs)
+        scores = np.zeros(n, dtype=np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.term_counts / max(self.avg_terms, 1.0))
+        for term in set(tokenize(question)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = np.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            rows = np.array([i for i, _ in postings])
+            tfs = np.array([tf for _, tf in postings], dtype=np.float32)
+            scores[rows] += idf * tfs * (BM25_K1 + 1) / (tfs + norm[rows])
+        if self.embeddings is not None and scores.any():
+            scores = (1 - EMBEDDING_WEIGHT) * scores / scores.max() + EMBEDDING_WEIGHT * (self.embeddings @ hashed_embedding(question))
+        return scores
+
+    def select(self, question: str, max_chars: int) -> List[int]:
+        """Chunk seqs to include for ``question``, best first, within ``max_chars``."""
+        scores = self.scores(question)
+        if scores.any():
+            # Drop weak matches (terms shared by every chunk) rather than pad the budget
+            order = [i for i in np.argsort(-scores, kind="stable") if scores[i] >= MIN_RELATIVE_SCORE * scores.max()]
+        else:
+            order = range(len(self.seqs))
+        selected, used = [], 0
+        for i in order:
+            if used + self.lengths[i] > max_chars and selected:
+                continue
+            selected.append(int(self.seqs[i]))
+            used += int(self.lengths[i])
+            if used >= max_chars:
+                break
+        return selected
+
+document_index_cache = TTLCache(maxsize=64, ttl=600)
+
+async def get_document_index(file_doc: dict) -> Optional[DocumentIndex]:
+    key = (file_doc["id"], file_doc.get("chunk_count"))
+    index = document_index_cache.get(key)
+    if index is None:
+        chunks = await db.file_chunks.find(
+            {"file_id": file_doc["id"]},
+            {"_id": 0, "seq": 1, "length": 1, "terms": 1, "term_count": 1, "embedding": 1}
+        ).to_list(None)
+        if not chunks or any("terms" not in c for c in chunks):
+            return None
+        index = DocumentIndex(chunks)
+        document_index_cache.set(key, index)
+    return index
+
+async def select_document_context(file_doc: dict, question: str, max_chars: int) -> str:
+    """The chunks most relevant to ``question``, in document order, within ``max_chars``."""
+    index = await get_document_index(file_doc) if file_doc.get("chunk_count") else None
+    if index is None:
+        return await load_document_context(file_doc, max_chars)
+    seqs = index.select(question, max_chars)
+    chunks = await db.file_chunks.find(
+        {"file_id": file_doc["id"], "seq": {"$in": seqs}},
+        {"_id": 0, "page": 1, "text": 1}
+    ).sort("seq", 1).to_list(len(seqs))
+    return "\n\n".join(f"[page {c['page']}] {c['text'][:max_chars]}" for c in chunks)
+
+# ==================== FILE STORAGE ====================
+
+class LocalStorage:
+    """Keeps object bytes on the local disk under ``root``."""
+
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def local_path(self, key: str) -> Optional[Path]:
+        return self.root / key
+
+    async def save(self, key: str, source: Path):
+        """Move ``source`` into place as ``key`` (the source is consumed)."""
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source, path)
+
+    async def exists(self, key: str) -> bool:
+        return (self.root / key).exists()
+
+    async def delete(self, key: str):
+        (self.root / key).unlink(missing_ok=True)
+
+    async def read(self, key: str) -> bytes:
+        async with aiofiles.open(self.root / key, 'rb') as f:
+            return await f.read()
+
+    @asynccontextmanager
+    async def local_copy(self, key: str):
+        yield self.root / key
+
+    async def presigned_url(self, key: str, filename: str, content_type: str) -> Optional[str]:
+        # Local bytes are served by the API (or the proxy via X-Accel-Redirect)
+        return None
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "root": str(self.root)}
+
+class S3Storage:
+    """Keeps object bytes in an S3-compatible bucket (AWS, MinIO, ...).
+
+    Large objects are sent as parallel multipart uploads and downloads are
+    handed out as presigned URLs so the bytes bypass the API workers.
+    boto3 is blocking, so calls run on a small thread pool.
+    """
+
+    name = "s3"
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, multipart_threshold: int = 8 * 1024 * 1024,
+                 part_size: int = 8 * 1024 * 1024, concurrency: int = 4, presign_seconds: int = 300):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.exceptions import ClientError
+        self._client_error = ClientError
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.multipart_threshold = multipart_threshold
+        self.transfer = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=part_size,
+            max_concurrency=concurrency,
+        )
+        self.presign_seconds = presign_seconds
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="s3")
+        self.uploaded = 0
+        self.multipart_uploads = 0
+        self.bytes_uploaded = 0
+        self.presigned = 0
+
+    async def _call(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    def local_path(self, key: str) -> Optional[Path]:
+        return None
+
+    async def save(self, key: str, source: Path):
+        size = source.stat().st_size
+        try:
+            await self._call(self.client.upload_file, str(source), self.bucket, self.prefix + key, Config=self.transfer)
+        finally:
+            source.unlink(missing_ok=True)
+        self.uploaded += 1
+        self.bytes_uploaded += size
+        if size >= self.multipart_threshold:
+            self.multipart_uploads += 1
+
+    async def exists(self, key: str) -> bool:
+        try:
+            await self._call(self.client.head_object, Bucket=self.bucket, Key=self.prefix + key)
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    async def delete(self, key: str):
+        await self._call(self.client.delete_object, Bucket=self.bucket, Key=self.prefix + key)
+
+    async def read(self, key: str) -> bytes:
+        response = await self._call(self.client.get_object, Bucket=self.bucket, Key=self.prefix + key)
+        return await self._call(response["Body"].read)
+
+    @asynccontextmanager
+    async def local_copy(self, key: str):
+        """Download ``key`` to a temp file for code that needs a real path."""
+        path = blob_store.temp_path()
+        try:
+            await self._call(self.client.download_file, self.bucket, self.prefix + key, str(path), Config=self.transfer)
+            yield path
+        finally:
+            path.unlink(missing_ok=True)
+
+    async def presigned_url(self, key: str, filename: str, content_type: str) -> Optional[str]:
+        self.presigned += 1
+        # Signing is local computation, no request is made
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self.prefix + key,
+                "ResponseContentDisposition": f"attachment; filename*=UTF-8''{quote(filename)}",
+                "ResponseContentType": content_type,
+            },
+            ExpiresIn=self.presign_seconds,
+        )
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "bucket": self.bucket,
+            "uploaded": self.uploaded,
+            "multipart_uploads": self.multipart_uploads,
+            "bytes_uploaded": self.bytes_uploaded,
+            "presigned": self.presigned,
+        }
+
+def create_file_storage():
+    if os.environ.get("STORAGE_BACKEND", "local") != "s3":
+        return LocalStorage(UPLOAD_DIR)
+    return S3Storage(
+        bucket=os.environ["S3_BUCKET"],
+        prefix=os.environ.get("S3_PREFIX", ""),
+        endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+        region=os.environ.get("S3_REGION"),
+        multipart_threshold=int(os.environ.get("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024))),
+        part_size=int(os.environ.get("S3_PART_SIZE", str(8 * 1024 * 1024))),
+        concurrency=int(os.environ.get("S3_MAX_CONCURRENCY", "4")),
+        presign_seconds=int(os.environ.get("S3_PRESIGN_SECONDS", "300")),
+    )
+
+file_storage = create_file_storage()
+
+# ==================== BLOB STORE ====================
+
+class BlobStore:
+    """Content-addressed storage for uploaded bytes.
+
+    Each distinct SHA-256 is stored once, as ``blobs/<2 hex>/<sha256>`` in
+    the configured file storage, and the blobs collection counts the file
+    documents that reference it. Releasing the last reference only stamps
+    released_at; BlobCollector deletes the bytes once the grace period has
+    passed.
+    """
+
+    def __init__(self, storage, tmp_dir: Path):
+        self.storage = storage
+        self.tmp_dir = tmp_dir
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.stored = 0
+        self.deduplicated = 0
+        self.bytes_saved = 0
+
+    def key_for(self, sha256: str) -> str:
+        return f"blobs/{sha256[:2]}/{sha256}"
+
+    def temp_path(self) -> Path:
+        return self.tmp_dir / uuid.uuid4().hex
+
+    async def commit(self, temp: Path, sha256: str, size: int):
+        """Take a reference on ``sha256`` whose bytes were written to ``temp``.
+        The temp file is moved into storage for new content, otherwise dropped."""
+        key = self.key_for(sha256)
+        deadline = time.monotonic() + BLOB_COMMIT_WAIT_SECONDS
+        delay = 0.05
+        while True:
+            try:
+                before = await db.blobs.find_one_and_update(
+                    {"sha256": sha256, "reaping": {"$ne": True}},
+                    {
+                        "$inc": {"refcount": 1},
+                        "$unset": {"released_at": ""},
+                        "$setOnInsert": {"size": size, "created_at": datetime.now(timezone.utc).isoformat()}
+                    },
+                    upsert=True,
+                    return_document=ReturnDocument.BEFORE
+                )
+                break
+            except DuplicateKeyError:
+                pass
+            # The collector has claimed this blob. A claim older than
+            # BLOB_REAP_STALE_SECONDS belongs to a sweep that died, so take
+            # the blob back (the bytes are re-saved from temp below);
+            # otherwise wait for the delete to finish.
+            stale = datetime.now(timezone.utc) - timedelta(seconds=BLOB_REAP_STALE_SECONDS)
+            taken = await db.blobs.update_one(
+                {"sha256": sha256, "reaping": True, "reaping_at": {"$lte": stale}},
+                {
+                    "$set": {"refcount": 1},
+                    "$unset": {
+                        "reaping": "", "reaping_id": "", "reaping_at": "", "released_at": "",
+                        "preview_status": "", "preview_sizes": "",
+                    },
+                }
+            )
+            if taken.modified_count:
+                before = None
+                break
+            if time.monotonic() + delay > deadline:
+                temp.unlink(missing_ok=True)
+                raise HTTPException(status_code=503, detail="Storage busy, please retry", headers={"Retry-After": "1"})
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+        if before is None or not await self.storage.exists(key):
+            await self.storage.save(key, temp)
+            self.stored += 1
+        else:
+            temp.unlink(missing_ok=True)
+            self.deduplicated += 1
+            self.bytes_saved += size
+
+    async def release(self, sha256s: list):
+        """Drop one reference per entry of ``sha256s``. Blobs left with no
+        references are deleted later by the collector, after a grace period."""
+        counts = Counter(sha256s)
+        if not counts:
+            return
+        await db.blobs.bulk_write([
+            UpdateOne({"sha256": sha256, "refcount": {"$gte": n}}, {"$inc": {"refcount": -n}})
+            for sha256, n in counts.items()
+        ], ordered=False)
+        await db.blobs.update_many(
+            {"sha256": {"$in": list(counts)}, "refcount": 0, "released_at": {"$exists": False}},
+            {"$set": {"released_at": datetime.now(timezone.utc)}}
+        )
+
+    def stats(self) -> dict:
+        return {
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+            "bytes_saved": self.bytes_saved,
+        }
+
+# How long an upload waits for the collector to finish deleting the same
+# content, and the age at which a collector's claim is presumed abandoned.
+# The collector renews its claim before each storage delete, so the stale
+# age only has to outlast a single delete call.
+BLOB_COMMIT_WAIT_SECONDS = float(os.environ.get("BLOB_COMMIT_WAIT_SECONDS", "10"))
+BLOB_REAP_STALE_SECONDS = float(os.environ.get("BLOB_REAP_STALE_SECONDS", "120"))
+
+blob_store = BlobStore(file_storage, UPLOAD_DIR / "tmp")
+
+class BlobCollector:
+    """Deletes the bytes of blobs that have had no references for
+    ``grace_seconds``, a batch at a time.
+
+    A blob is claimed by setting ``reaping`` (with a ``reaping_id`` unique to
+    the sweep) before its bytes are removed. BlobStore.commit skips claimed
+    blobs, so an upload of the same content waits for the delete to finish
+    instead of sharing bytes that are about to disappear. Claims left by a
+    crashed sweep are picked up again by the next sweep, or taken over by an
+    upload once BLOB_REAP_STALE_SECONDS old. The sweep renews its claim
+    before every storage delete and stops as soon as it has lost it, so a
+    slow sweep never deletes bytes an upload has just re-saved.
+    """
+
+    def __init__(self, interval_seconds: float, batch_size: int, grace_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.grace_seconds = grace_seconds
+        self._task = None
+        self.sweeps = 0
+        self.freed = 0
+        self.bytes_freed = 0
+        self.abandoned = 0
+        self.last_sweep_at = None
+
+    async def start(self):
+        if self.interval_seconds > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Blob collection sweep failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def sweep(self) -> dict:
+        now = datetime.now(timezone.utc)
+        reapable = {"$or": [
+            {"refcount": 0, "released_at": {"$lte": now - timedelta(seconds=self.grace_seconds)}},
+            {"reaping": True},
+        ]}
+        freed = bytes_freed = 0
+        while True:
+            candidates = await db.blobs.find(reapable, {"_id": 0, "sha256": 1}).limit(self.batch_size).to_list(self.batch_size)
+            if not candidates:
+                break
+            for candidate in candidates:
+                claim = uuid.uuid4().hex
+                blob = await db.blobs.find_one_and_update(
+                    {"sha256": candidate["sha256"], **reapable},
+                    {"$set": {"reaping": True, "reaping_id": claim, "reaping_at": datetime.now(timezone.utc)}},
+                    projection={"_id": 0, "sha256": 1, "size": 1, "preview_sizes": 1}
+                )
+                if not blob:
+                    continue
+                keys = [preview_key(blob["sha256"], size) for size in blob.get("preview_sizes", [])]
+                keys.append(blob_store.key_for(blob["sha256"]))
+                for key in keys:
+                    if not await self._renew(blob["sha256"], claim):
+                        break
+                    await blob_store.storage.delete(key)
+                else:
+                    result = await db.blobs.delete_one({"sha256": blob["sha256"], "reaping_id": claim})
+                    if result.deleted_count:
+                        freed += 1
+                        bytes_freed += blob.get("size", 0)
+                        continue
+                self.abandoned += 1
+        self.sweeps += 1
+        self.freed += freed
+        self.bytes_freed += bytes_freed
+        self.last_sweep_at = now.isoformat()
+        return {"freed": freed, "bytes_freed": bytes_freed}
+
+    async def _renew(self, sha256: str, claim: str) -> bool:
+        """Refresh ``reaping_at`` on our claim before each delete. False once
+        an upload (or another sweep) has taken the blob over."""
+        result = await db.blobs.update_one(
+            {"sha256": sha256, "reaping_id": claim}, {"$set": {"reaping_at": datetime.now(timezone.utc)}}
+        )
+        return bool(result.matched_count)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "sweeps": self.sweeps,
+            "freed": self.freed,
+            "bytes_freed": self.bytes_freed,
+            "abandoned": self.abandoned,
+            "last_sweep_at": self.last_sweep_at,
+        }
+
+blob_collector = BlobCollector(
+    interval_seconds=float(os.environ.get("BLOB_SWEEP_SECONDS", "300")),
+    batch_size=int(os.environ.get("BLOB_SWEEP_BATCH", "500")),
+    grace_seconds=float(os.environ.get("BLOB_GRACE_SECONDS", "600")),
+)
+
+@asynccontextmanager
+async def file_local_path(file_doc: dict):
+    """Yield a filesystem path holding the file's bytes, fetching them from
+    remote storage for the duration if needed."""
+    if file_doc.get("storage") == "blob":
+        async with blob_store.storage.local_copy(blob_store.key_for(file_doc["sha256"])) as path:
+            yield path
+    else:
+        yield Path(file_doc["file_path"])
+
+async def release_file_storage(file_docs: list):
+    """Drop deleted file documents' hold on their bytes (blob references or,
+    for uploads stored before the blob store, the files themselves)."""
+    await blob_store.release([f["sha256"] for f in file_docs if f.get("storage") == "blob"])
+    for file_doc in file_docs:
+        if file_doc.get("storage") != "blob" and file_doc.get("file_path"):
+            Path(file_doc["file_path"]).unlink(missing_ok=True)
+
+async def migrate_files_to_blobs() -> dict:
+    """Move uploads stored as ``{id}{ext}`` into the blob store."""
+    moved = missing = 0
+    async for f in db.files.find(
+        {"storage": {"$ne": "blob"}, "file_path": {"$exists": True}},
+        {"_id": 0, "id": 1, "file_path": 1}
+    ):
+        legacy = Path(f["file_path"])
+        if not legacy.exists():
+            missing += 1
+            continue
+        digest = hashlib.sha256()
+        async with aiofiles.open(legacy, 'rb') as fh:
+            while chunk := await fh.read(UPLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        await blob_store.commit(legacy, sha256, legacy.stat().st_size)
+        await db.files.update_one(
+            {"id": f["id"]},
+            {"$set": {"sha256": sha256, "storage": "blob"}, "$unset": {"file_path": ""}}
+        )
+        moved += 1
+    return {"moved": moved, "missing": missing}
+
+# ==================== PREVIEWS ====================
+
+# Thumbnails belong to the blob, not the file document, so identical uploads
+# share them. Each is a WebP bounded by one of PREVIEW_SIZES, stored beside
+# the blob as previews/<2 hex>/<sha256>/<size>.webp.
+PREVIEW_SIZES = (128, 256, 512)
+PREVIEW_QUALITY = 80
+
+def preview_key(sha256: str, size: int) -> str:
+    return f"previews/{sha256[:2]}/{sha256}/{size}.webp"
+
+def preview_kind_for(filename: str, content_type: Optional[str]) -> Optional[str]:
+    if Path(filename).suffix.lower() == ".pdf":
+        return "pdf"
+    if (content_type or "").startswith("image/") and content_type != "image/svg+xml":
+        return "image"
+    return None
+
+def render_previews(path: str, kind: str, sizes: tuple, quality: int) -> dict:
+    """WebP thumbnails of an image, or of the largest image embedded in a
+    PDF's first page, keyed by size. Runs in a preview worker process."""
+    if kind == "pdf":
+        reader = PdfReader(path)
+        source = None
+        try:
+            embedded = reader.pages[0].images if reader.pages else []
+        except KeyError:
+            embedded = []
+        for candidate in embedded:
+            try:
+                image = Image.open(io.BytesIO(candidate.data))
+                image.load()
+            except Exception:
+                continue
+            if source is None or image.width * image.height > source.width * source.height:
+                source = image
+        if source is None:
+            return {}
+    else:
+        source = Image.open(path)
+        source.draft("RGB", (max(sizes), max(sizes)))
+        source = ImageOps.exif_transpose(source)
+    source = source.convert("RGBA" if source.mode in ("RGBA", "LA", "P") else "RGB")
+    renders = {}
+    for size in sizes:
+        thumb = source.copy()
+        thumb.thumbnail((size, size), Image.LANCZOS)
+        out = io.BytesIO()
+        thumb.save(out, "WEBP", quality=quality, method=4)
+        renders[size] = out.getvalue()
+    return renders
+
+class PreviewGenerator:
+    """Renders thumbnails for image and PDF blobs off the request path.
+
+    Status lives on the blobs document: preview_status moves from pending to
+    processing to ready (with preview_sizes), none (nothing to render) or
+    failed. Rendering runs on a process pool, like document ingestion.
+    """
+
+    def __init__(self, workers: int, concurrency: int, stale_after: float):
+        self.workers = workers
+        self.concurrency = concurrency
+        self.stale_after = stale_after
+        self._executor = None
+        self._queue = None
+        self._tasks = []
+        self.active = 0
+        self.completed = 0
+        self.empty = 0
+        self.failed = 0
+
+    async def start(self):
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+        await self.recover()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def recover(self):
+        """Requeue pending blobs and blobs whose worker died mid-render."""
+        stale = (datetime.now(timezone.utc) - timedelta(seconds=self.stale_after)).isoformat()
+        await db.blobs.update_many(
+            {"preview_status": "processing", "preview_started_at": {"$lt": stale}},
+            {"$set": {"preview_status": "pending"}}
+        )
+        async for doc in db.blobs.find({"preview_status": "pending"}, {"_id": 0, "sha256": 1}):
+            self.submit(doc["sha256"])
+
+    async def drain(self):
+        """Render everything pending. Outside the app (management commands)
+        the generator is started for the duration."""
+        if self._queue is not None:
+            await self._queue.join()
+            return
+        await self.start()
+        try:
+            await self._queue.join()
+        finally:
+            await self.stop()
+
+    def submit(self, sha256: str):
+        self._queue.put_nowait(sha256)
+
+    async def request(self, sha256: str, kind: str):
+        """Queue previews for a blob unless it already has (or had) them."""
+        result = await db.blobs.update_one(
+            {"sha256": sha256, "preview_status": {"$exists": False}},
+            {"$set": {"preview_status": "pending", "preview_kind": kind}}
+        )
+        if result.modified_count and self._queue is not None:
+            self.submit(sha256)
+        return bool(result.modified_count)
+
+    async def _run(self):
+        while True:
+            sha256 = await self._queue.get()
+            self.active += 1
+            try:
+                await self._process(sha256)
+            except Exception as e:
+                logger.error(f"Preview generation failed for {sha256}: {e}")
+            finally:
+                self.active -= 1
+                self._queue.task_done()
+
+    async def _process(self, sha256: str):
+        blob = await db.blobs.find_one_and_update(
+            {"sha256": sha256, "preview_status": "pending", "reaping": {"$ne": True}},
+            {"$set": {"preview_status": "processing", "preview_started_at": datetime.now(timezone.utc).isoformat()}},
+            projection={"_id": 0, "preview_kind": 1}
+        )
+        if not blob:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            async with blob_store.storage.local_copy(blob_store.key_for(sha256)) as path:
+                renders = await loop.run_in_executor(
+                    self._executor, render_previews, str(path), blob["preview_kind"], PREVIEW_SIZES, PREVIEW_QUALITY
+                )
+            for size, data in renders.items():
+                temp = blob_store.temp_path()
+                async with aiofiles.open(temp, 'wb') as f:
+                    await f.write(data)
+                await blob_store.storage.save(preview_key(sha256, size), temp)
+            result = await db.blobs.update_one(
+                {"sha256": sha256, "reaping": {"$ne": True}},
+                {"$set": {"preview_status": "ready" if renders else "none", "preview_sizes": sorted(renders)}}
+            )
+            if not result.matched_count:
+                # The blob was collected while rendering
+                for size in renders:
+                    await blob_store.storage.delete(preview_key(sha256, size))
+            if renders:
+                self.completed += 1
+            else:
+                self.empty += 1
+        except Exception as e:
+            logger.error(f"Preview rendering error: {e}")
+            await db.blobs.update_one(
+                {"sha256": sha256},
+                {"$set": {"preview_status": "failed", "preview_error": str(e)[:500]}}
+            )
+            self.failed += 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "concurrency": self.concurrency,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "active": self.active,
+            "completed": self.completed,
+            "empty": self.empty,
+            "failed": self.failed,
+        }
+
+preview_generator = PreviewGenerator(
+    workers=int(os.environ.get("PREVIEW_WORKERS", "1")),
+    concurrency=int(os.environ.get("PREVIEW_CONCURRENCY", "2")),
+    stale_after=float(os.environ.get("PREVIEW_STALE_SECONDS", "300")),
+)
+
+async def backfill_previews() -> dict:
+    """Queue previews for existing image and PDF uploads and render them."""
+    requested = 0
+    async for f in db.files.find(
+        {"storage": "blob"}, {"_id": 0, "filename": 1, "file_type": 1, "sha256": 1}
+    ):
+        kind = preview_kind_for(f["filename"], f.get("file_type"))
+        if kind and await preview_generator.request(f["sha256"], kind):
+            requested += 1
+    await preview_generator.drain()
+    return {"requested": requested, **preview_generator.stats()}
+
+# ==================== FILE ROUTES ====================
+
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_TOKEN_MINUTES = 5
+# When set (e.g. "/protected-uploads/"), downloads are handed to the reverse
+# proxy with X-Accel-Redirect; the path below it mirrors UPLOAD_DIR
+DOWNLOAD_ACCEL_PREFIX = os.environ.get("DOWNLOAD_ACCEL_PREFIX")
+
+# Multipart boundaries and the small form fields sent beside the file
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+UPLOAD_PATHS = {"/api/files/upload"}
+
+class UploadSizeLimit:
+    """ASGI middleware that caps the request body of upload routes.
+
+    FastAPI spools the whole multipart body before the handler runs, so the
+    handler's own check comes after the disk is used. Here a Content-Length
+    over the limit is refused before any body is read, and a chunked body is
+    cut off with 413 as soon as it crosses the limit.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in UPLOAD_PATHS:
+            return await self.app(scope, receive, send)
+        limit = MAX_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD
+        detail = f"File exceeds the {MAX_UPLOAD_BYTES} byte upload limit"
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            response = JSONResponse({"detail": detail}, status_code=413, headers={"Connection": "close"})
+            return await response(scope, receive, send)
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside body parsing, which FastAPI turns into the response
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+async def stream_upload_to_disk(file: UploadFile, destination: Path) -> tuple:
+    """Copy an upload to ``destination`` one chunk at a time.
+
+    Returns ``(size, sha256 hex digest)``. Files larger than MAX_UPLOAD_BYTES
+    are aborted with 413 and the partial file is removed; UploadSizeLimit has
+    already refused request bodies far over the limit.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(destination, 'wb') as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"File exceeds the {MAX_UPLOAD_BYTES} byte upload limit")
+                digest.update(chunk)
+                await f.write(chunk)
+    except BaseException:
+        destination.unlink(missing_ok=True)
+        raise
+    return size, digest.hexdigest()
+
+class FileRangeResponse(Response):
+    """Sends bytes ``start..end`` (inclusive) of a file.
+
+    Uses the ASGI zero-copy send extension when the server offers it, and
+    otherwise streams the range in DOWNLOAD_CHUNK_SIZE reads.
+    """
+
+    def __init__(self, path: Path, start: int, end: int, status_code: int, headers: dict, media_type: str):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.length = end - start + 1
+        self.headers["content-length"] = str(self.length)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            return
+        remaining = self.length
+        async with aiofiles.open(self.path, "rb") as f:
+            await f.seek(self.start)
+            while remaining > 0:
+                chunk = await f.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+def parse_byte_range(header: str, size: int) -> Optional[tuple]:
+    """Parse a single ``bytes=`` range into inclusive ``(start, end)``.
+
+    Returns None for a missing, malformed or multi-range header (which is
+    answered with the whole file) and raises 416 when it is unsatisfiable.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            start, end = max(0, size - int(last)), size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+async def can_read_file(user: dict, file_doc: dict) -> bool:
+    if file_doc["owner_id"] == user["id"]:
+        return True
+    if file_doc.get("class_id"):
+        member = await db.classes.find_one(
+            {"id": file_doc["class_id"], "$or": [{"teacher_id": user["id"]}, {"students": user["id"]}]},
+            {"_id": 1}
+        )
+        if member:
+            return True
+    # Teachers can open files attached to submissions in their classes
+    if user["role"] == "teacher":
+        submission = await db.submissions.find_one({"file_ids": file_doc["id"]}, {"_id": 0, "class_id": 1})
+        if submission and await db.classes.find_one(
+            {"id": submission.get("class_id"), "teacher_id": user["id"]}, {"_id": 1}
+        ):
+            return True
+    return False
+
+@api_router.post("/files/upload")
+async def upload_file(
+    file: UploadFile = File(...),
+    folder_id: Optional[str] = Form(None),
+    class_id: Optional[str] = Form(None),
+    current_user: dict = Depends(get_current_user)
+):
+    file_id = str(uuid.uuid4())
+    file_ext = Path(file.filename).suffix
+    
+    # Bytes land in a local temp file and are then deduplicated into the blob store
+    temp_path = blob_store.temp_path()
+    file_size, sha256 = await stream_upload_to_disk(file, temp_path)
+    await blob_store.commit(temp_path, sha256, file_size)
+    
+    # PDFs are queued for background text extraction
+    is_pdf = file_ext.lower() == '.pdf'
+    
+    file_doc = {
+        "id": file_id,
+        "filename": file.filename,
+        "file_type": file.content_type,
+        "file_size": file_size,
+        "sha256": sha256,
+        "storage": "blob",
+        "folder_id": folder_id,
+        "class_id": class_id,
+        "owner_id": current_user["id"],
+        "ingest_status": "pending" if is_pdf else None,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.files.insert_one(file_doc)
+    await index_for_search("file", file_id, file.filename, class_id=class_id, owner_id=current_user["id"])
+    if is_pdf:
+        document_ingestion.submit(file_id)
+    preview_kind = preview_kind_for(file.filename, file.content_type)
+    if preview_kind:
+        await preview_generator.request(sha256, preview_kind)
+    return {k: v for k, v in file_doc.items() if k != "_id"}
+
+@api_router.get("/files")
+async def get_files(
+    response: Response,
+    folder_id: Optional[str] = None,
+    class_id: Optional[str] = None,
+    limit: int = page_limit(100),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    query = {}
+    if folder_id:
+        query["folder_id"] = folder_id
+    if class_id:
+        query["class_id"] = class_id
+    else:
+        query["owner_id"] = current_user["id"]
+    
+    files = await keyset_page(
+        db.files, query, {"_id": 0, "text_content": 0}, [("created_at", 1), ("id", 1)], limit, cursor, response
+    )
+    return files
+
+@api_router.get("/files/{file_id}")
+async def get_file(file_id: str, current_user: dict = Depends(get_current_user)):
+    file_doc = await db.files.find_one({"id": file_id}, {"_id": 0, "text_content": 0})
+    if not file_doc:
+        raise HTTPException(status_code=404, detail="File not found")
+    return file_doc
+
+@api_router.get("/files/{file_id}/download-url")
+async def get_download_url(file_id: str, current_user: dict = Depends(get_current_user)):
+    file_doc = await db.files.find_one(
+        {"id": file_id}, {"_id": 0, "id": 1, "owner_id": 1, "class_id": 1, "filename": 1, "file_type": 1, "sha256": 1, "storage": 1}
+    )
+    if not file_doc:
+        raise HTTPException(status_code=404, detail="File not found")
+    if not await can_read_file(current_user, file_doc):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if file_doc.get("storage") == "blob":
+        url = await blob_store.storage.presigned_url(
+            blob_store.key_for(file_doc["sha256"]), file_doc["filename"], file_doc.get("file_type") or "application/octet-stream"
+        )
+        if url:
+            return {"url": url}
+    # Links and <video> tags cannot send headers, so the URL carries a
+    # short-lived token valid for this file only
+    token = jwt.encode({
+        "file_id": file_id,
+        "scope": "download",
+        "exp": datetime.now(timezone.utc) + timedelta(minutes=DOWNLOAD_TOKEN_MINUTES)
+    }, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    return {"path": f"/api/files/{file_id}/download?token={token}"}
+
+@api_router.get("/files/{file_id}/download")
+async def download_file(file_id: str, request: Request, token: Optional[str] = None):
+    if token:
+        try:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        if payload.get("scope") != "download" or payload.get("file_id") != file_id:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        user = None
+    else:
+        credentials = await security(request)
+        user = await user_from_token(credentials.credentials)
+    
+    file_doc = await db.files.find_one(
+        {"id": file_id},
+        {"_id": 0, "id": 1, "owner_id": 1, "class_id": 1, "filename": 1, "file_path": 1, "file_type": 1, "sha256": 1, "storage": 1}
+    )
+    if not file_doc or not (file_doc.get("storage") == "blob" or file_doc.get("file_path")):
+        raise HTTPException(status_code=404, detail="File not found")
+    if user is not None and not await can_read_file(user, file_doc):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    media_type = file_doc.get("file_type") or "application/octet-stream"
+    
+    if file_doc.get("storage") == "blob":
+        key = blob_store.key_for(file_doc["sha256"])
+        # Remote storage serves the bytes (and ranges) itself
+        url = await blob_store.storage.presigned_url(key, file_doc["filename"], media_type)
+        if url:
+            return RedirectResponse(url, status_code=307, headers={"Cache-Control": "no-store"})
+        path = blob_store.storage.local_path(key)
+    else:
+        path = Path(file_doc["file_path"])
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File content missing")
+    
+    # Blob contents never change, so the digest is a strong validator
+    if file_doc.get("sha256"):
+        etag = f'"{file_doc["sha256"]}"'
+    else:
+        etag = f'W/"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=3600",
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(file_doc['filename'])}",
+    }
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    if DOWNLOAD_ACCEL_PREFIX:
+        # The proxy serves the bytes itself (sendfile, ranges) from the internal location
+        headers["X-Accel-Redirect"] = DOWNLOAD_ACCEL_PREFIX.rstrip("/") + "/" + quote(str(path.relative_to(UPLOAD_DIR)))
+        return Response(headers=headers, media_type=media_type)
+    
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if not if_range or if_range.strip() == etag:
+        byte_range = parse_byte_range(request.headers.get("range", ""), stat.st_size)
+    if byte_range is None:
+        return FileRangeResponse(path, 0, stat.st_size - 1, 200, headers, media_type)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    return FileRangeResponse(path, start, end, 206, headers, media_type)
+
+@api_router.get("/files/{file_id}/preview")
+async def get_file_preview(
+    file_id: str,
+    request: Request,
+    size: int = Query(256, ge=1),
+    current_user: dict = Depends(get_current_user)
+):
+    file_doc = await db.files.find_one(
+        {"id": file_id}, {"_id": 0, "id": 1, "owner_id": 1, "class_id": 1, "sha256": 1, "storage": 1}
+    )
+    if not file_doc:
+        raise HTTPException(status_code=404, detail="File not found")
+    if not await can_read_file(current_user, file_doc):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    bucket = next((s for s in PREVIEW_SIZES if s >= size), PREVIEW_SIZES[-1])
+    blob = None
+    if file_doc.get("storage") == "blob":
+        blob = await db.blobs.find_one(
+            {"sha256": file_doc["sha256"]}, {"_id": 0, "preview_status": 1, "preview_sizes": 1}
+        )
+    if not blob or bucket not in blob.get("preview_sizes", []):
+        raise HTTPException(status_code=404, detail="Preview not available", headers={"Cache-Control": "no-store"})
+    
+    # The preview of a given blob and size never changes
+    headers = {
+        "ETag": f'"{file_doc["sha256"]}-{bucket}"',
+        "Cache-Control": "private, max-age=31536000, immutable",
+    }
+    if headers["ETag"] in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    data = await blob_store.storage.read(preview_key(file_doc["sha256"], bucket))
+    return Response(content=data, media_type="image/webp", headers=headers)
+
+@api_router.delete("/files/{file_id}")
+async def delete_file(file_id: str, current_user: dict = Depends(get_current_user)):
+    file_doc = await db.files.find_one({"id": file_id})
+    if not file_doc:
+        raise HTTPException(status_code=404, detail="File not found")
+    if file_doc["owner_id"] != current_user["id"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    result = await db.files.delete_one({"id": file_id})
+    if result.deleted_count:
+        await release_file_storage([file_doc])
+    await remove_from_search("file", [file_id])
+    await db.file_chunks.delete_many({"file_id": file_id})
+    return {"message": "File deleted"}
+
+# ==================== FOLDER ROUTES ====================
+
+# Folders carry the ids of all their ancestors, root first, so a subtree is
+# one indexed query on ``ancestors`` and moving a folder rewrites that prefix
+# on its descendants with a single update_many.
+
+FOLDER_MAX_DEPTH = 32
+FOLDER_TREE_FILE_LIMIT = 1000
+
+async def owned_folder(folder_id: str, user: dict) -> dict:
+    folder = await db.folders.find_one({"id": folder_id}, {"_id": 0})
+    if not folder or folder["owner_id"] != user["id"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return folder
+
+async def subtree_folder_ids(folder_id: str) -> list:
+    return [folder_id] + [f["id"] async for f in db.folders.find({"ancestors": folder_id}, {"_id": 0, "id": 1})]
+
+@api_router.post("/folders")
+async def create_folder(data: FolderCreate, current_user: dict = Depends(get_current_user)):
+    ancestors = []
+    if data.parent_id:
+        parent = await db.folders.find_one({"id": data.parent_id}, {"_id": 0, "id": 1, "owner_id": 1, "ancestors": 1})
+        if not parent or parent["owner_id"] != current_user["id"]:
+            raise HTTPException(status_code=404, detail="Parent folder not found")
+        ancestors = parent.get("ancestors", []) + [parent["id"]]
+        if len(ancestors) >= FOLDER_MAX_DEPTH:
+            raise HTTPException(status_code=400, detail=f"Folders cannot be nested more than {FOLDER_MAX_DEPTH} deep")
+    folder = {
+        "id": str(uuid.uuid4()),
+        "name": data.name,
+        "parent_id": data.parent_id,
+        "ancestors": ancestors,
         "class_id": data.class_id,
         "owner_id": current_user["id"],
         "created_at": datetime.now(timezone.utc).isoformat()
@@ -586,8 +3017,11 @@ async def create_folder(data: FolderCreate, current_user: dict = Depends(get_cur
 
 @api_router.get("/folders")
 async def get_folders(
+    response: Response,
     parent_id: Optional[str] = None,
     class_id: Optional[str] = None,
+    limit: int = page_limit(100),
+    cursor: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
     query = {}
@@ -598,166 +3032,770 @@ async def get_folders(
     else:
         query["owner_id"] = current_user["id"]
     
-    folders = await db.folders.find(query, {"_id": 0}).to_list(100)
+    folders = await keyset_page(
+        db.folders, query, {"_id": 0}, [("created_at", 1), ("id", 1)], limit, cursor, response
+    )
     return folders
 
+@api_router.get("/folders/{folder_id}/tree")
+async def get_folder_tree(folder_id: str, current_user: dict = Depends(get_current_user)):
+    folder = await owned_folder(folder_id, current_user)
+    folders = await db.folders.find({"ancestors": folder_id}, {"_id": 0}).to_list(None)
+    files = await db.files.find(
+        {"folder_id": {"$in": [folder_id] + [f["id"] for f in folders]}}, {"_id": 0, "text_content": 0}
+    ).limit(FOLDER_TREE_FILE_LIMIT + 1).to_list(FOLDER_TREE_FILE_LIMIT + 1)
+    return {
+        "folder": folder,
+        "folders": folders,
+        "files": files[:FOLDER_TREE_FILE_LIMIT],
+        "truncated": len(files) > FOLDER_TREE_FILE_LIMIT,
+    }
+
+@api_router.get("/folders/{folder_id}/size")
+async def get_folder_size(folder_id: str, current_user: dict = Depends(get_current_user)):
+    await owned_folder(folder_id, current_user)
+    folder_ids = await subtree_folder_ids(folder_id)
+    totals = await db.files.aggregate([
+        {"$match": {"folder_id": {"$in": folder_ids}}},
+        {"$group": {"_id": None, "files": {"$sum": 1}, "bytes": {"$sum": "$file_size"}}}
+    ]).to_list(1)
+    return {
+        "folder_id": folder_id,
+        "folders": len(folder_ids) - 1,
+        "files": totals[0]["files"] if totals else 0,
+        "bytes": totals[0]["bytes"] if totals else 0,
+    }
+
+@api_router.put("/folders/{folder_id}/move")
+async def move_folder(folder_id: str, data: FolderMove, current_user: dict = Depends(get_current_user)):
+    folder = await owned_folder(folder_id, current_user)
+    new_ancestors = []
+    if data.parent_id:
+        parent = await owned_folder(data.parent_id, current_user)
+        if parent["id"] == folder_id or folder_id in parent.get("ancestors", []):
+            raise HTTPException(status_code=400, detail="Cannot move a folder into itself")
+        if parent.get("class_id") != folder.get("class_id"):
+            raise HTTPException(status_code=400, detail="Cannot move a folder between classes")
+        new_ancestors = parent.get("ancestors", []) + [parent["id"]]
+    old_ancestors = folder.get("ancestors", [])
+    
+    deepest = await db.folders.aggregate([
+        {"$match": {"ancestors": folder_id}},
+        {"$group": {"_id": None, "depth": {"$max": {"$size": "$ancestors"}}}}
+    ]).to_list(1)
+    depth = deepest[0]["depth"] if deepest else len(old_ancestors)
+    if depth - len(old_ancestors) + len(new_ancestors) >= FOLDER_MAX_DEPTH:
+        raise HTTPException(status_code=400, detail=f"Folders cannot be nested more than {FOLDER_MAX_DEPTH} deep")
+    
+    await db.folders.update_one(
+        {"id": folder_id}, {"$set": {"parent_id": data.parent_id or None, "ancestors": new_ancestors}}
+    )
+    # Descendants keep everything from this folder down and swap the prefix above it
+    await db.folders.update_many({"ancestors": folder_id}, [{"$set": {"ancestors": {"$concatArrays": [
+        new_ancestors, {"$slice": ["$ancestors", len(old_ancestors), FOLDER_MAX_DEPTH]}
+    ]}}}])
+    return {**folder, "parent_id": data.parent_id or None, "ancestors": new_ancestors}
+
 @api_router.delete("/folders/{folder_id}")
 async def delete_folder(folder_id: str, current_user: dict = Depends(get_current_user)):
-    folder = await db.folders.find_one({"id": folder_id})
-    if not folder or folder["owner_id"] != current_user["id"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    await owned_folder(folder_id, current_user)
     
-    await db.folders.delete_one({"id": folder_id})
-    await db.files.delete_many({"folder_id": folder_id})
-    return {"message": "Folder deleted"}
+    folder_ids = await subtree_folder_ids(folder_id)
+    file_ids = [f["id"] async for f in db.files.find({"folder_id": {"$in": folder_ids}}, {"_id": 0, "id": 1})]
+    await db.folders.delete_many({"id": {"$in": folder_ids}})
+    # Release only the documents this call removed, so a repeated delete (or a
+    # delete_file racing with it) cannot drop a shared blob's reference twice
+    removed = []
+    for file_id in file_ids:
+        file_doc = await db.files.find_one_and_delete(
+            {"id": file_id}, projection={"_id": 0, "id": 1, "storage": 1, "sha256": 1, "file_path": 1}
+        )
+        if file_doc is not None:
+            removed.append(file_doc)
+    # Blob bytes are removed later by the collector
+    await release_file_storage(removed)
+    await db.file_chunks.delete_many({"file_id": {"$in": file_ids}})
+    await remove_from_search("file", file_ids)
+    return {"message": "Folder deleted", "folders": len(folder_ids), "files": len(removed)}
+
+async def backfill_folder_ancestors() -> dict:
+    """Fill ``ancestors`` on folders created before it existed, one tree
+    level at a time. Folders whose parent no longer exists are counted."""
+    updated = 0
+    level = [(f["id"], []) async for f in db.folders.find({"parent_id": None}, {"_id": 0, "id": 1})]
+    while level:
+        await db.folders.bulk_write(
+            [UpdateOne({"id": folder_id}, {"$set": {"ancestors": ancestors}}) for folder_id, ancestors in level],
+            ordered=False
+        )
+        updated += len(level)
+        paths = {folder_id: ancestors + [folder_id] for folder_id, ancestors in level}
+        level = [
+            (f["id"], paths[f["parent_id"]])
+            async for f in db.folders.find({"parent_id": {"$in": list(paths)}}, {"_id": 0, "id": 1, "parent_id": 1})
+        ]
+    orphaned = await db.folders.count_documents({}) - updated
+    return {"updated": updated, "orphaned": orphaned}
 
 # ==================== CHAT ROUTES ====================
 
+# Messages are keyed by a canonical conversation id ("dm:<a>:<b>" with the
+# two user ids sorted, or "class:<class_id>") and numbered with a per-
+# conversation sequence allocated from the conversations collection. History
+# is then one range scan on (conversation_id, seq), paged with ?before=<seq>,
+# and unread counts are last_seq minus the reader's read_seq.
+
+def conversation_id_for(user_id: str, receiver_id: Optional[str] = None, class_id: Optional[str] = None) -> str:
+    if class_id:
+        return f"class:{class_id}"
+    return "dm:" + ":".join(sorted([user_id, receiver_id]))
+
 @api_router.post("/chat/messages")
 async def send_message(data: ChatMessage, current_user: dict = Depends(get_current_user)):
+    if not data.class_id and not data.receiver_id:
+        raise HTTPException(status_code=400, detail="receiver_id or class_id is required")
+    conversation_id = conversation_id_for(current_user["id"], data.receiver_id, data.class_id)
+    created_at = datetime.now(timezone.utc).isoformat()
+    conversation = await db.conversations.find_one_and_update(
+        {"id": conversation_id},
+        {
+            "$inc": {"last_seq": 1},
+            "$set": {
+                "last_message": data.content,
+                "last_time": created_at,
+                "last_sender_id": current_user["id"],
+            },
+            "$setOnInsert": {
+                "kind": "class" if data.class_id else "dm",
+                "participants": [] if data.class_id else sorted({current_user["id"], data.receiver_id}),
+            },
+        },
+        projection={"_id": 0, "last_seq": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    seq = conversation["last_seq"]
     message = {
         "id": str(uuid.uuid4()),
+        "conversation_id": conversation_id,
+        "seq": seq,
         "sender_id": current_user["id"],
         "sender_name": current_user["full_name"],
         "receiver_id": data.receiver_id,
         "content": data.content,
         "class_id": data.class_id,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": created_at
     }
     await db.chat_messages.insert_one(message)
-    return {k: v for k, v in message.items() if k != "_id"}
+    # The sender has read everything up to their own message
+    await db.conversations.update_one(
+        {"id": conversation_id},
+        {"$max": {f"read_seq.{current_user['id']}": seq}}
+    )
+    message = {k: v for k, v in message.items() if k != "_id"}
+    
+    recipients = [data.receiver_id, current_user["id"]]
+    if data.class_id:
+        cls = await db.classes.find_one({"id": data.class_id}, {"_id": 0, "teacher_id": 1, "students": 1})
+        if cls:
+            recipients += [cls["teacher_id"], *cls.get("students", [])]
+    await push_hub.publish(recipients, {"type": "chat.message", "message": message})
+    return message
+
+class LegacyChat:
+    """Whether messages from before conversation bucketing are still waiting
+    for backfill-conversations. Nothing writes unnumbered messages any more,
+    so once none are left the answer is kept for the life of the process."""
+
+    def __init__(self):
+        self.migrated = False
+
+    async def pending(self) -> bool:
+        if not self.migrated:
+            self.migrated = await db.chat_messages.find_one({"seq": {"$exists": False}}, {"_id": 1}) is None
+        return not self.migrated
+
+legacy_chat = LegacyChat()
+
+def legacy_message_query(me: str, receiver_id: Optional[str], class_id: Optional[str]) -> dict:
+    """Messages of a conversation stored before conversation bucketing that
+    backfill-conversations has not numbered yet."""
+    if class_id:
+        return {"class_id": class_id, "seq": {"$exists": False}}
+    return {"seq": {"$exists": False}, "$or": [
+        {"sender_id": me, "receiver_id": receiver_id, "class_id": None},
+        {"sender_id": receiver_id, "receiver_id": me, "class_id": None},
+    ]}
 
 @api_router.get("/chat/messages")
 async def get_messages(
+    response: Response,
     receiver_id: Optional[str] = None,
     class_id: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: int = page_limit(100),
     current_user: dict = Depends(get_current_user)
 ):
-    if class_id:
-        # Class group chat
-        messages = await db.chat_messages.find(
-            {"class_id": class_id},
-            {"_id": 0}
-        ).sort("created_at", 1).to_list(100)
-    elif receiver_id:
-        # Direct messages
-        messages = await db.chat_messages.find({
-            "$or": [
-                {"sender_id": current_user["id"], "receiver_id": receiver_id},
-                {"sender_id": receiver_id, "receiver_id": current_user["id"]}
-            ]
-        }, {"_id": 0}).sort("created_at", 1).to_list(100)
+    """Newest ``limit`` messages (oldest first) of a direct or class
+    conversation, or those before ``before`` when paging back. When older
+    messages exist, X-Next-Cursor holds the ``before`` value for the next page.
+
+    Until backfill-conversations has run, unnumbered messages from before
+    conversation bucketing follow the numbered ones; ``before`` is then an
+    opaque (created_at, id) cursor instead of a seq.
+    """
+    if not class_id and not receiver_id:
+        return []
+    conversation_id = conversation_id_for(current_user["id"], receiver_id, class_id)
+    legacy_query = legacy_message_query(current_user["id"], receiver_id, class_id)
+    legacy_pending = await legacy_chat.pending()
+    messages = []
+    if before is None or before.isdigit():
+        query = {"conversation_id": conversation_id}
+        if before is not None:
+            if int(before) < 1:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            query["seq"] = {"$lt": int(before)}
+        messages = await db.chat_messages.find(query, {"_id": 0}).sort("seq", -1).limit(limit + 1).to_list(limit + 1)
     else:
-        messages = []
+        created_at, message_id = decode_cursor(before, 2)
+        legacy_query = {"$and": [legacy_query, {"$or": [
+            {"created_at": {"$lt": created_at}}, {"created_at": created_at, "id": {"$lt": message_id}}
+        ]}]}
     
+    newest_seq = messages[0]["seq"] if messages and before is None else None
+    room = limit - len(messages)
+    if room < 0:
+        messages = messages[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = str(messages[-1]["seq"])
+    elif room == 0:
+        # The page is full; legacy history, if any, starts on the next one
+        if legacy_pending and await db.chat_messages.find_one(legacy_query, {"_id": 1}):
+            response.headers[NEXT_CURSOR_HEADER] = str(messages[-1]["seq"])
+    elif legacy_pending:
+        legacy = await db.chat_messages.find(legacy_query, {"_id": 0}).sort(
+            [("created_at", -1), ("id", -1)]
+        ).limit(room + 1).to_list(room + 1)
+        if len(legacy) > room:
+            legacy = legacy[:room]
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor([legacy[-1]["created_at"], legacy[-1]["id"]])
+        if not class_id and any(m["receiver_id"] == current_user["id"] and m.get("read") is False for m in legacy):
+            await db.chat_messages.update_many(
+                {"sender_id": receiver_id, "receiver_id": current_user["id"], "read": False},
+                {"$set": {"read": True}}
+            )
+        messages += legacy
+    messages.reverse()
+    
+    if newest_seq is not None:
+        await db.conversations.update_one(
+            {"id": conversation_id},
+            {"$max": {f"read_seq.{current_user['id']}": newest_seq}}
+        )
     return messages
 
-@api_router.get("/chat/conversations")
-async def get_conversations(current_user: dict = Depends(get_current_user)):
-    # Get unique conversation partners
-    pipeline = [
-        {"$match": {"$or": [{"sender_id": current_user["id"]}, {"receiver_id": current_user["id"]}]}},
+CONVERSATION_LIST_LIMIT = 50
+
+async def legacy_conversations(me: str) -> list:
+    """Direct conversations built from messages stored before conversation
+    bucketing that backfill-conversations has not numbered yet."""
+    return await db.chat_messages.aggregate([
+        {"$match": {"$or": [{"sender_id": me}, {"receiver_id": me}], "class_id": None, "seq": {"$exists": False}}},
         {"$sort": {"created_at": -1}},
         {"$group": {
-            "_id": {"$cond": [{"$eq": ["$sender_id", current_user["id"]]}, "$receiver_id", "$sender_id"]},
+            "_id": {"$cond": [{"$eq": ["$sender_id", me]}, "$receiver_id", "$sender_id"]},
             "last_message": {"$first": "$content"},
-            "last_time": {"$first": "$created_at"}
-        }}
-    ]
-    results = await db.chat_messages.aggregate(pipeline).to_list(50)
-    
-    conversations = []
-    for r in results:
-        user = await db.users.find_one({"id": r["_id"]}, {"_id": 0, "password": 0})
-        if user:
-            conversations.append({
-                "user": user,
-                "last_message": r["last_message"],
-                "last_time": r["last_time"]
-            })
+            "last_time": {"$first": "$created_at"},
+            "unread": {"$sum": {"$cond": [
+                {"$and": [{"$eq": ["$receiver_id", me]}, {"$eq": ["$read", False]}]}, 1, 0
+            ]}}
+        }},
+        {"$sort": {"last_time": -1}},
+        {"$limit": CONVERSATION_LIST_LIMIT},
+        {"$lookup": {"from": "users", "localField": "_id", "foreignField": "id", "as": "user"}},
+        {"$unwind": "$user"},
+        {"$project": {"_id": 0, "user._id": 0, "user.password": 0}}
+    ]).to_list(CONVERSATION_LIST_LIMIT)
+
+@api_router.get("/chat/conversations")
+async def get_conversations(current_user: dict = Depends(get_current_user)):
+    """Direct conversations (with the partner's profile) and the user's class
+    conversations (with the class), most recent first."""
+    me = current_user["id"]
+    classes = {c["id"]: c for c in await user_classes(current_user, {"id": 1, "name": 1})}
+    fields = {"_id": 0, "id": 1, "kind": 1, "participants": 1, "last_seq": 1, "last_message": 1, "last_time": 1, f"read_seq.{me}": 1}
+    direct, class_conversations = await asyncio.gather(
+        db.conversations.find({"participants": me}, fields).sort("last_time", -1).to_list(CONVERSATION_LIST_LIMIT),
+        db.conversations.find(
+            {"id": {"$in": [conversation_id_for(me, class_id=class_id) for class_id in classes]}}, fields
+        ).sort("last_time", -1).to_list(CONVERSATION_LIST_LIMIT),
+    )
+    
+    partner_ids = [next((p for p in c["participants"] if p != me), me) for c in direct]
+    users = await db.users.find(
+        {"id": {"$in": partner_ids}}, {"_id": 0, "password": 0}
+    ).to_list(len(partner_ids)) if partner_ids else []
+    users_by_id = {u["id"]: u for u in users}
+    by_partner = {partner_id: {
+        "user": users_by_id[partner_id],
+        "last_message": c["last_message"],
+        "last_time": c["last_time"],
+        "unread": max(0, c["last_seq"] - c.get("read_seq", {}).get(me, 0)),
+    } for c, partner_id in zip(direct, partner_ids) if partner_id in users_by_id}
+    # Until backfill-conversations has run, partners may also (or only) have
+    # unnumbered history; numbered messages are always the newer ones
+    if await legacy_chat.pending():
+        for legacy in await legacy_conversations(me):
+            entry = by_partner.get(legacy["user"]["id"])
+            if entry is None:
+                by_partner[legacy["user"]["id"]] = legacy
+            else:
+                entry["unread"] += legacy["unread"]
+    entries = list(by_partner.values())
+    entries += [{
+        "class": classes[c["id"][len("class:"):]],
+        "last_message": c["last_message"],
+        "last_time": c["last_time"],
+        "unread": max(0, c["last_seq"] - c.get("read_seq", {}).get(me, 0)),
+    } for c in class_conversations]
+    entries.sort(key=lambda e: e["last_time"], reverse=True)
+    return entries[:CONVERSATION_LIST_LIMIT]
+
+async def backfill_conversations() -> dict:
+    """Assign conversation ids and sequence numbers to messages stored before
+    conversation bucketing, and build their conversations documents.
+
+    Affected conversations are renumbered in (created_at, id) order. Legacy
+    messages marked ``read: False`` keep their recipient's read marker just
+    before the first unread one; other legacy messages count as read, and
+    every member of a class starts with its whole history read. Run it while
+    chat writes are stopped.
+    """
+    pending = set()
+    async for m in db.chat_messages.find(
+        {"seq": {"$exists": False}}, {"_id": 0, "sender_id": 1, "receiver_id": 1, "class_id": 1}
+    ):
+        pending.add(conversation_id_for(m["sender_id"], m["receiver_id"], m.get("class_id")))
+    
+    messages_updated = 0
+    for conversation_id in pending:
+        if conversation_id.startswith("class:"):
+            class_id = conversation_id[len("class:"):]
+            query = {"$or": [{"conversation_id": conversation_id}, {"class_id": class_id}]}
+            participants = []
+            # Class history had no per-member read state; members start caught up
+            cls = await db.classes.find_one({"id": class_id}, {"_id": 0, "teacher_id": 1, "students": 1}) or {}
+            members = {cls.get("teacher_id"), *cls.get("students", [])} - {None}
+        else:
+            a, b = conversation_id[len("dm:"):].split(":")
+            query = {"$or": [
+                {"conversation_id": conversation_id},
+                {"sender_id": a, "receiver_id": b, "class_id": None},
+                {"sender_id": b, "receiver_id": a, "class_id": None},
+            ]}
+            participants = sorted({a, b})
+            members = set(participants)
+        
+        ops, seq, last, first_unread = [], 0, None, {}
+        async for m in db.chat_messages.find(query, {"_id": 0}).sort([("created_at", 1), ("id", 1)]):
+            seq += 1
+            last = m
+            if m.get("read") is False and m.get("receiver_id"):
+                first_unread.setdefault(m["receiver_id"], seq)
+            ops.append(UpdateOne(
+                {"id": m["id"]},
+                {"$set": {"conversation_id": conversation_id, "seq": seq}, "$unset": {"read": ""}}
+            ))
+        # Renumbering can swap seqs between messages; clear them first so the
+        # unique (conversation_id, seq) index is never violated mid-way
+        await db.chat_messages.update_many(query, {"$unset": {"seq": ""}})
+        for i in range(0, len(ops), 1000):
+            await db.chat_messages.bulk_write(ops[i:i + 1000], ordered=False)
+        messages_updated += len(ops)
+        
+        readers = members | {last["sender_id"]} | set(first_unread)
+        await db.conversations.replace_one({"id": conversation_id}, {
+            "id": conversation_id,
+            "kind": "class" if conversation_id.startswith("class:") else "dm",
+            "participants": participants,
+            "last_seq": seq,
+            "last_message": last["content"],
+            "last_time": last["created_at"],
+            "last_sender_id": last["sender_id"],
+            "read_seq": {uid: first_unread.get(uid, seq + 1) - 1 for uid in readers},
+        }, upsert=True)
+    return {"conversations": len(pending), "messages": messages_updated}
+
+# ==================== PUSH ROUTES ====================
+
+@api_router.websocket("/ws")
+async def push_socket(websocket: WebSocket, token: str = Query(...)):
+    # Browsers cannot set headers on a WebSocket, so the JWT comes as ?token=
+    try:
+        user = await user_from_token(token)
+    except HTTPException as e:
+        await websocket.close(code=4401, reason=e.detail)
+        return
+    conn = push_hub.connect(user["id"])
+    if conn is None:
+        await websocket.close(code=1013, reason="Too many connections")
+        return
+    
+    async def send_events():
+        while not conn.overflowed:
+            try:
+                event = await asyncio.wait_for(conn.queue.get(), PUSH_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                event = {"type": "ping"}
+            await websocket.send_json(event)
+        await websocket.close(code=1013, reason="Client too slow")
     
-    return conversations
+    async def receive():
+        # Clients send nothing meaningful; reading detects the disconnect
+        while True:
+            await websocket.receive_text()
+    
+    tasks = []
+    try:
+        await websocket.accept()
+        await websocket.send_json({"type": "ready", "user_id": user["id"]})
+        tasks = [asyncio.create_task(send_events()), asyncio.create_task(receive())]
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        push_hub.disconnect(conn)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 # ==================== NOTIFICATION ROUTES ====================
 
 @api_router.get("/notifications")
-async def get_notifications(current_user: dict = Depends(get_current_user)):
-    notifications = await db.notifications.find(
-        {"user_id": current_user["id"]},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(50)
-    return notifications
+async def get_notifications(
+    response: Response,
+    limit: int = page_limit(50),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    counter = await get_notification_counter(current_user["id"])
+    notifications = await keyset_page(
+        db.notifications, {"user_id": current_user["id"]},
+        {"_id": 0, "id": 1, "title": 1, "content": 1, "type": 1, "read": 1, "created_at": 1},
+        [("created_at", -1), ("id", -1)], limit, cursor, response
+    )
+    return [compact_notification(n, counter["read_all_at"]) for n in notifications]
+
+@api_router.get("/notifications/unread-count")
+async def get_unread_count(current_user: dict = Depends(get_current_user)):
+    counter = await get_notification_counter(current_user["id"])
+    return {"unread": counter["unread"]}
 
 @api_router.put("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str, current_user: dict = Depends(get_current_user)):
-    await db.notifications.update_one(
-        {"id": notification_id, "user_id": current_user["id"]},
-        {"$set": {"read": True}}
+    previous = await db.notifications.find_one_and_update(
+        {"id": notification_id, "user_id": current_user["id"], "read": False},
+        {"$set": {"read": True}},
+        projection={"_id": 0, "created_at": 1}
     )
+    if previous:
+        # Only a notification newer than the read-all mark was still counted
+        await db.notification_counters.update_one(
+            {"user_id": current_user["id"], "read_all_at": {"$lt": previous["created_at"]}, "unread": {"$gt": 0}},
+            {"$inc": {"unread": -1}}
+        )
     return {"message": "Marked as read"}
 
 @api_router.put("/notifications/read-all")
 async def mark_all_read(current_user: dict = Depends(get_current_user)):
-    await db.notifications.update_many(
+    await db.notification_counters.update_one(
         {"user_id": current_user["id"]},
-        {"$set": {"read": True}}
+        {"$set": {"unread": 0, "read_all_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
     )
     return {"message": "All marked as read"}
 
 # ==================== AI ROUTES ====================
-from groq import Groq
+import httpx
+from fastapi.responses import StreamingResponse
+from groq import AsyncGroq, DefaultAsyncHttpxClient
 
-# Create Groq client (top of file — after imports)
-groq_client = Groq(api_key=os.environ["GROQ_API_KEY"])
+GROQ_MODEL = os.environ.get("GROQ_MODEL", "llama-3.1-70b-versatile")
 
+class LLMClient:
+    """Async Groq client with a pooled connection set and a concurrency cap.
 
-@api_router.post("/ai/chat")
-async def ai_chat(data: AIRequest, current_user: dict = Depends(get_current_user)):
+    Retries with exponential backoff (connection errors, 408/409/429/5xx)
+    and per-request timeouts are delegated to the SDK. Point GROQ_BASE_URL
+    at a local OpenAI-compatible server to run against a fake LLM.
+    """
+
+    def __init__(self, api_key: str, base_url: Optional[str], timeout: float,
+                 max_retries: int, max_concurrency: int, max_connections: int):
+        self._client = AsyncGroq(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            max_retries=max_retries,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            ),
+        )
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.failures = 0
+        self.total_latency = 0.0
 
-    api_key = os.environ.get("GROQ_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="Groq API key missing")
+    async def _acquire(self):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.requests += 1
 
+    def _release(self, started: float, failed: bool):
+        self.in_flight -= 1
+        self.total_latency += time.monotonic() - started
+        if failed:
+            self.failures += 1
+        self._semaphore.release()
+
+    async def complete(self, messages: list, model: str = GROQ_MODEL) -> str:
+        await self._acquire()
+        started, failed = time.monotonic(), True
+        try:
+            completion = await self._client.chat.completions.create(model=model, messages=messages)
+            failed = False
+            return completion.choices[0].message.content
+        finally:
+            self._release(started, failed)
+
+    async def stream(self, messages: list, model: str = GROQ_MODEL):
+        """Yield completion text deltas as they arrive."""
+        await self._acquire()
+        started, failed = time.monotonic(), True
+        try:
+            response = await self._client.chat.completions.create(model=model, messages=messages, stream=True)
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            failed = False
+        finally:
+            self._release(started, failed)
+
+    async def close(self):
+        await self._client.close()
+
+    def stats(self) -> dict:
+        return {
+            "model": GROQ_MODEL,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "requests": self.requests,
+            "failures": self.failures,
+            "avg_latency_ms": round(self.total_latency / self.requests * 1000, 1) if self.requests else 0.0,
+        }
+
+llm_client = LLMClient(
+    api_key=os.environ["GROQ_API_KEY"],
+    base_url=os.environ.get("GROQ_BASE_URL") or None,
+    timeout=float(os.environ.get("LLM_TIMEOUT_SECONDS", "60")),
+    max_retries=int(os.environ.get("LLM_MAX_RETRIES", "3")),
+    max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", "16")),
+    max_connections=int(os.environ.get("LLM_MAX_CONNECTIONS", "32")),
+)
+
+class AIRequestContext:
+    """Resolved prompt context plus the cache scope it may be shared within."""
+
+    def __init__(self, text: str, scope: str):
+        self.text = text
+        self.scope = scope
+
+async def build_ai_context(data: AIRequest, current_user: dict) -> AIRequestContext:
     # Build context if file text exists
     context = data.context or ""
+    scope = f"user:{current_user['id']}"
     if data.file_id:
-        file_doc = await db.files.find_one({"id": data.file_id})
-        if file_doc and file_doc.get("text_content"):
-            context += "\n\n" + file_doc["text_content"][:8000]
+        file_doc = await db.files.find_one(
+            {"id": data.file_id},
+            {"_id": 0, "id": 1, "text_content": 1, "class_id": 1, "ingest_status": 1, "chunk_count": 1}
+        )
+        if file_doc and file_doc.get("ingest_status") in ("pending", "processing"):
+            raise HTTPException(status_code=409, detail="Document is still being processed")
+        if file_doc and (file_doc.get("chunk_count") or file_doc.get("text_content")):
+            context += "\n\n" + await select_document_context(
+                file_doc, data.prompt, AI_CONTEXT_TOKEN_BUDGET * CHARS_PER_TOKEN
+            )
+        if file_doc and file_doc.get("class_id"):
+            scope = f"class:{file_doc['class_id']}"
+    return AIRequestContext(context, scope)
 
+def build_ai_messages(data: AIRequest, current_user: dict, context: AIRequestContext) -> list:
+    # Class-scoped replies are cached for every classmate, so they must not
+    # be addressed to the student who happened to ask first
+    name = "" if context.scope.startswith("class:") else f"User Name: {current_user['full_name']}\n"
     # Create full user prompt
     prompt = f"""
 You are PRODIGY AI — a helpful learning tutor.
 
 User Role: {current_user['role']}
-User Name: {current_user['full_name']}
-
+{name}
 Context (if any):
-{context}
+{context.text}
 
 User Question:
 {data.prompt}
 """
+    return [
+        {"role": "system", "content": "You are a helpful tutor assistant."},
+        {"role": "user", "content": prompt}
+    ]
 
-    try:
-        completion = groq_client.chat.completions.create(
-            model="llama-3.1-70b-versatile",
-            messages=[
-                {"role": "system", "content": "You are a helpful tutor assistant."},
-                {"role": "user", "content": prompt}
-            ]
-        )
+# ==================== AI RESPONSE CACHE ====================
+
+def normalize_prompt(prompt: str) -> str:
+    """Casefold and collapse whitespace; punctuation and non-ASCII text are kept."""
+    return " ".join(prompt.casefold().split())
+
+class AIResponseCache:
+    """Caches LLM replies per scope (class or user), role, model and context.
+
+    The exact tier is keyed by a hash of the normalised prompt. When
+    ``similarity_threshold`` is set, a second tier compares hashed
+    embeddings of prompts asked against the same context and returns the
+    closest cached reply above the threshold. Embeddings are dropped once
+    their entry has expired or been evicted. Replies in a class scope are
+    shared by classmates, so build_ai_messages leaves the student's name out
+    of those prompts.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, similarity_threshold: float, max_neighbours: int = 256):
+        self._entries = TTLCache(maxsize, ttl)
+        self.similarity_threshold = similarity_threshold
+        self.max_neighbours = max_neighbours
+        self._neighbours = {}
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _bucket(scope: str, role: str, model: str, context: str) -> str:
+        context_hash = hashlib.sha256(context.encode()).hexdigest()
+        return f"{scope}|{role}|{model}|{context_hash}"
+
+    @staticmethod
+    def _key(bucket: str, normalized: str) -> str:
+        return hashlib.sha256(f"{bucket}|{normalized}".encode()).hexdigest()
+
+    def get(self, scope: str, role: str, model: str, context: str, prompt: str) -> Optional[str]:
+        normalized = normalize_prompt(prompt)
+        if not normalized:
+            self.misses += 1
+            return None
+        bucket = self._bucket(scope, role, model, context)
+        reply = self._entries.get(self._key(bucket, normalized))
+        if reply is not None:
+            self.exact_hits += 1
+            return reply
+        if self.similarity_threshold > 0:
+            self._prune(bucket)
+        if self._neighbours.get(bucket):
+            keys, vectors = zip(*self._neighbours[bucket].items())
+            scores = np.stack(vectors) @ hashed_embedding(normalized)
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity_threshold:
+                reply = self._entries.get(keys[best])
+                if reply is not None:
+                    self.similar_hits += 1
+                    return reply
+                del self._neighbours[bucket][keys[best]]
+        self.misses += 1
+        return None
+
+    def set(self, scope: str, role: str, model: str, context: str, prompt: str, reply: str):
+        normalized = normalize_prompt(prompt)
+        if not normalized:
+            return
+        bucket = self._bucket(scope, role, model, context)
+        key = self._key(bucket, normalized)
+        self._entries.set(key, reply)
+        if self.similarity_threshold > 0:
+            # Sets follow an LLM call, so sweeping every bucket here is cheap
+            for other in list(self._neighbours):
+                self._prune(other)
+            neighbours = self._neighbours.setdefault(bucket, OrderedDict())
+            neighbours[key] = hashed_embedding(normalized)
+            neighbours.move_to_end(key)
+            while len(neighbours) > self.max_neighbours:
+                neighbours.popitem(last=False)
+
+    def _prune(self, bucket: str):
+        """Drop embeddings of ``bucket`` whose cache entry is gone."""
+        neighbours = self._neighbours.get(bucket)
+        if neighbours is None:
+            return
+        for key in [k for k in neighbours if k not in self._entries]:
+            del neighbours[key]
+        if not neighbours:
+            del self._neighbours[bucket]
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        entries = self._entries.stats()
+        return {
+            "size": entries["size"],
+            "maxsize": entries["maxsize"],
+            "ttl_seconds": entries["ttl_seconds"],
+            "evictions": entries["evictions"],
+            "similarity_threshold": self.similarity_threshold,
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.similar_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+ai_cache = AIResponseCache(
+    maxsize=int(os.environ.get("AI_CACHE_SIZE", "2048")),
+    ttl=float(os.environ.get("AI_CACHE_TTL_SECONDS", "86400")),
+    similarity_threshold=float(os.environ.get("AI_CACHE_SIMILARITY", "0")),
+)
 
-        reply = completion.choices[0].message.content
+async def save_ai_chat(current_user: dict, prompt: str, reply: str):
+    await db.ai_chats.insert_one({
+        "id": str(uuid.uuid4()),
+        "user_id": current_user["id"],
+        "prompt": prompt,
+        "response": reply,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    })
+
+def sse_event(payload: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload)}\n\n"
+
+
+@api_router.post("/ai/chat")
+async def ai_chat(data: AIRequest, current_user: dict = Depends(get_current_user)):
+    context = await build_ai_context(data, current_user)
+    cache_args = (context.scope, current_user["role"], GROQ_MODEL, context.text, data.prompt)
+    cached = ai_cache.get(*cache_args)
+    if cached is not None:
+        await save_ai_chat(current_user, data.prompt, cached)
+        return {"response": cached, "cached": True}
+
+    try:
+        reply = await llm_client.complete(build_ai_messages(data, current_user, context))
+        ai_cache.set(*cache_args, reply)
 
         # Save AI chat history
-        await db.ai_chats.insert_one({
-            "id": str(uuid.uuid4()),
-            "user_id": current_user["id"],
-            "prompt": data.prompt,
-            "response": reply,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        await save_ai_chat(current_user, data.prompt, reply)
 
         return {"response": reply}
 
@@ -766,6 +3804,45 @@ User Question:
         raise HTTPException(status_code=500, detail="AI request failed")
 
 
+@api_router.post("/ai/chat/stream")
+async def ai_chat_stream(data: AIRequest, current_user: dict = Depends(get_current_user)):
+    """Same as /ai/chat, but streams the reply as server-sent events.
+
+    Each delta is sent as ``data: {"token": ...}``; the stream ends with an
+    ``event: done`` carrying the full response, or ``event: error``.
+    """
+    context = await build_ai_context(data, current_user)
+    cache_args = (context.scope, current_user["role"], GROQ_MODEL, context.text, data.prompt)
+    cached = ai_cache.get(*cache_args)
+
+    async def event_stream():
+        if cached is not None:
+            await save_ai_chat(current_user, data.prompt, cached)
+            yield sse_event({"token": cached})
+            yield sse_event({"response": cached, "cached": True}, event="done")
+            return
+        messages = build_ai_messages(data, current_user, context)
+        parts = []
+        try:
+            async for token in llm_client.stream(messages):
+                parts.append(token)
+                yield sse_event({"token": token})
+        except Exception as e:
+            logger.error(f"AI Error: {e}")
+            yield sse_event({"detail": "AI request failed"}, event="error")
+            return
+        reply = "".join(parts)
+        ai_cache.set(*cache_args, reply)
+        await save_ai_chat(current_user, data.prompt, reply)
+        yield sse_event({"response": reply}, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @api_router.post("/ai/summarize")
 async def summarize_content(data: AIRequest, current_user: dict = Depends(get_current_user)):
     return {"response": "Summarization will be enabled later 🚀"}
@@ -773,123 +3850,648 @@ async def summarize_content(data: AIRequest, current_user: dict = Depends(get_cu
 
 # ==================== ANALYTICS ROUTES ====================
 
-@api_router.get("/analytics/student/{student_id}")
-async def get_student_analytics(student_id: str, current_user: dict = Depends(get_current_user)):
-    # Get student's submissions and grades
-    submissions = await db.submissions.find({"student_id": student_id}, {"_id": 0}).to_list(100)
-    
-    total_assignments = len(submissions)
-    graded = [s for s in submissions if s.get("grade") is not None]
-    total_points = sum(s["grade"] for s in graded)
-    max_possible = len(graded) * 100
-    
-    # Get classes
-    classes = await db.classes.find({"students": student_id}, {"_id": 0}).to_list(100)
-    
+# Percentage bands reported in per-assignment grade distributions
+GRADE_BANDS = [("0-59", 0, 60), ("60-69", 60, 70), ("70-79", 70, 80), ("80-89", 80, 90), ("90-100", 90, None)]
+
+def _percentage_expr(grade: str, max_points: str) -> dict:
+    return {"$multiply": [{"$divide": [grade, {"$max": [{"$ifNull": [max_points, 100]}, 1]}]}, 100]}
+
+def _band_counters(percentage: str) -> dict:
+    counters = {}
+    for label, low, high in GRADE_BANDS:
+        bounds = [{"$gte": [percentage, low]}]
+        if high is not None:
+            bounds.append({"$lt": [percentage, high]})
+        counters[label] = {"$sum": {"$cond": [{"$and": [{"$ne": [percentage, None]}] + bounds}, 1, 0]}}
+    return counters
+
+async def summarize_student(student_id: str) -> dict:
+    """Submission totals and grade average for a student, with grades
+    normalised against each assignment's max_points, plus the 10 most
+    recent submissions."""
+    pipeline = [
+        {"$match": {"student_id": student_id}},
+        {"$lookup": {
+            "from": "assignments", "localField": "assignment_id", "foreignField": "id",
+            "pipeline": [{"$project": {"_id": 0, "max_points": 1}}],
+            "as": "assignment",
+        }},
+        {"$set": {"max_points": {"$ifNull": [{"$first": "$assignment.max_points"}, 100]}}},
+        {"$facet": {
+            "totals": [{"$group": {
+                "_id": None,
+                "total": {"$sum": 1},
+                "graded": {"$sum": {"$cond": [{"$ne": [{"$ifNull": ["$grade", None]}, None]}, 1, 0]}},
+                "points": {"$sum": {"$ifNull": ["$grade", 0]}},
+                "highest": {"$max": "$grade"},
+                "top_grades": {"$sum": {"$cond": [{"$gte": ["$grade", 90]}, 1, 0]}},
+                "max_possible": {"$sum": {"$cond": [{"$ne": [{"$ifNull": ["$grade", None]}, None]}, "$max_points", 0]}},
+            }}],
+            "recent": [
+                {"$sort": {"submitted_at": -1}},
+                {"$limit": 10},
+                {"$project": {"_id": 0, "assignment": 0}},
+            ],
+        }},
+    ]
+    result = (await db.submissions.aggregate(pipeline).to_list(1))[0]
+    totals = result["totals"][0] if result["totals"] else {"total": 0, "graded": 0, "points": 0, "highest": None, "top_grades": 0, "max_possible": 0}
+    max_possible = totals["max_possible"]
     return {
-        "total_assignments": total_assignments,
-        "completed_assignments": len(graded),
-        "average_grade": round(total_points / max_possible * 100, 1) if max_possible > 0 else 0,
-        "total_classes": len(classes),
-        "submissions": submissions[:10]
+        "total_assignments": totals["total"],
+        "completed_assignments": totals["graded"],
+        "total_points": totals["points"],
+        "max_possible_points": max_possible,
+        "highest_grade": totals["highest"] or 0,
+        "top_grades": totals["top_grades"],
+        "average_grade": round(totals["points"] / max_possible * 100, 1) if max_possible > 0 else 0,
+        "submissions": result["recent"]
     }
 
+@api_router.get("/analytics/student/{student_id}")
+async def get_student_analytics(student_id: str, current_user: dict = Depends(get_current_user)):
+    summary, total_classes = await asyncio.gather(
+        summarize_student(student_id),
+        db.classes.count_documents({"students": student_id})
+    )
+    return {**summary, "total_classes": total_classes}
+
 @api_router.get("/analytics/class/{class_id}")
 async def get_class_analytics(class_id: str, current_user: dict = Depends(get_current_user)):
-    class_doc = await db.classes.find_one({"id": class_id}, {"_id": 0})
+    class_doc = await db.classes.find_one({"id": class_id}, {"_id": 0, "students": 1})
     if not class_doc:
         raise HTTPException(status_code=404, detail="Class not found")
     
-    # Get assignments for this class
-    assignments = await db.assignments.find({"class_id": class_id}, {"_id": 0}).to_list(100)
-    assignment_ids = [a["id"] for a in assignments]
-    
-    # Get all submissions
-    submissions = await db.submissions.find({"assignment_id": {"$in": assignment_ids}}, {"_id": 0}).to_list(500)
+    # One row per (assignment, submission); assignments without submissions keep a null row
+    percentage = "$percentage"
+    pipeline = [
+        {"$match": {"class_id": class_id}},
+        {"$lookup": {
+            "from": "submissions", "localField": "id", "foreignField": "assignment_id",
+            "pipeline": [{"$project": {"_id": 0, "student_id": 1, "grade": 1}}],
+            "as": "submission",
+        }},
+        {"$unwind": {"path": "$submission", "preserveNullAndEmptyArrays": True}},
+        {"$project": {
+            "_id": 0,
+            "assignment_id": "$id",
+            "title": 1,
+            "max_points": {"$ifNull": ["$max_points", 100]},
+            "student_id": "$submission.student_id",
+            "grade": {"$ifNull": ["$submission.grade", None]},
+        }},
+        {"$set": {"percentage": {"$cond": [{"$ne": ["$grade", None]}, _percentage_expr("$grade", "$max_points"), None]}}},
+        {"$facet": {
+            "students": [
+                {"$match": {"student_id": {"$exists": True}}},
+                {"$group": {
+                    "_id": "$student_id",
+                    "total": {"$sum": 1},
+                    "graded": {"$sum": {"$cond": [{"$ne": ["$grade", None]}, 1, 0]}},
+                    "points": {"$sum": {"$ifNull": ["$grade", 0]}},
+                    "max_points": {"$sum": {"$cond": [{"$ne": ["$grade", None]}, "$max_points", 0]}},
+                }},
+            ],
+            "assignments": [
+                {"$group": {
+                    "_id": "$assignment_id",
+                    "title": {"$first": "$title"},
+                    "max_points": {"$first": "$max_points"},
+                    "submissions": {"$sum": {"$cond": [{"$ifNull": ["$student_id", False]}, 1, 0]}},
+                    "graded": {"$sum": {"$cond": [{"$ne": ["$grade", None]}, 1, 0]}},
+                    "average_percentage": {"$avg": percentage},
+                    "min_percentage": {"$min": percentage},
+                    "max_percentage": {"$max": percentage},
+                    **_band_counters(percentage),
+                }},
+                {"$sort": {"_id": 1}},
+            ],
+        }},
+    ]
+    result = (await db.assignments.aggregate(pipeline).to_list(1))[0]
     
-    # Calculate stats per student
     student_stats = {}
-    for s in submissions:
-        if s["student_id"] not in student_stats:
-            student_stats[s["student_id"]] = {"total": 0, "graded": 0, "points": 0}
-        student_stats[s["student_id"]]["total"] += 1
-        if s.get("grade") is not None:
-            student_stats[s["student_id"]]["graded"] += 1
-            student_stats[s["student_id"]]["points"] += s["grade"]
+    for s in result["students"]:
+        student_stats[s["_id"]] = {
+            "total": s["total"],
+            "graded": s["graded"],
+            "points": s["points"],
+            "max_points": s["max_points"],
+            "percentage": round(s["points"] / s["max_points"] * 100, 1) if s["max_points"] else 0,
+        }
+    
+    assignments = []
+    for a in result["assignments"]:
+        assignments.append({
+            "assignment_id": a["_id"],
+            "title": a["title"],
+            "max_points": a["max_points"],
+            "submissions": a["submissions"],
+            "graded": a["graded"],
+            "average_percentage": round(a["average_percentage"], 1) if a["average_percentage"] is not None else None,
+            "min_percentage": round(a["min_percentage"], 1) if a["min_percentage"] is not None else None,
+            "max_percentage": round(a["max_percentage"], 1) if a["max_percentage"] is not None else None,
+            "distribution": {label: a[label] for label, _, _ in GRADE_BANDS},
+        })
     
     return {
         "total_students": len(class_doc.get("students", [])),
         "total_assignments": len(assignments),
-        "total_submissions": len(submissions),
-        "student_stats": student_stats
+        "total_submissions": sum(a["submissions"] for a in assignments),
+        "student_stats": student_stats,
+        "assignments": assignments
+    }
+
+# ==================== DASHBOARD ====================
+
+# Composite page payloads. Class membership is resolved once per request,
+# the independent sub-queries run concurrently, and each returns only the
+# fields its page renders.
+
+DASHBOARD_RECENT_ITEMS = 5
+DASHBOARD_RECENT_GRADES = 10
+
+async def teacher_dashboard(user: dict) -> dict:
+    classes = await db.classes.aggregate([
+        {"$match": {"teacher_id": user["id"]}},
+        {"$project": {"_id": 0, "id": 1, "name": 1, "subject": 1, "student_count": {"$size": {"$ifNull": ["$students", []]}}}},
+    ]).to_list(None)
+    class_ids = [c["id"] for c in classes]
+    in_classes = {"class_id": {"$in": class_ids}}
+    
+    assignment_ids, recent, announcement_count = await asyncio.gather(
+        db.assignments.distinct("id", in_classes),
+        db.assignments.find(
+            in_classes, {"_id": 0, "id": 1, "title": 1, "class_id": 1, "class_name": 1, "due_date": 1}
+        ).sort([("due_date", 1), ("id", 1)]).to_list(DASHBOARD_RECENT_ITEMS),
+        db.announcements.count_documents(in_classes),
+    )
+    pending, per_assignment = await asyncio.gather(
+        db.submissions.count_documents({"assignment_id": {"$in": assignment_ids}, "grade": None}),
+        db.submissions.aggregate([
+            {"$match": {"assignment_id": {"$in": [a["id"] for a in recent]}}},
+            {"$group": {"_id": "$assignment_id", "count": {"$sum": 1}}},
+        ]).to_list(None),
+    )
+    submission_counts = {row["_id"]: row["count"] for row in per_assignment}
+    student_counts = {c["id"]: c["student_count"] for c in classes}
+    return {
+        "role": "teacher",
+        "stats": {
+            "total_classes": len(classes),
+            "total_students": sum(student_counts.values()),
+            "pending_submissions": pending,
+            "announcements": announcement_count,
+        },
+        "classes": classes,
+        "assignments": [{
+            **a,
+            "submission_count": submission_counts.get(a["id"], 0),
+            "student_count": student_counts.get(a["class_id"], 0),
+        } for a in recent],
+    }
+
+async def student_dashboard(user: dict) -> dict:
+    classes = await user_classes(user, {"id": 1, "name": 1, "subject": 1, "teacher_name": 1})
+    in_classes = {"class_id": {"$in": [c["id"] for c in classes]}}
+    
+    # Upcoming assignments the student has not submitted yet: the count for
+    # the stats card and the first few for the list
+    pending_pipeline = [
+        {"$match": {**in_classes, "due_at": {"$gt": datetime.now(timezone.utc)}}},
+        {"$lookup": {
+            "from": "submissions",
+            "let": {"assignment_id": "$id"},
+            "pipeline": [
+                {"$match": {"student_id": user["id"], "$expr": {"$eq": ["$assignment_id", "$$assignment_id"]}}},
+                {"$limit": 1},
+                {"$project": {"_id": 1}},
+            ],
+            "as": "submitted",
+        }},
+        {"$match": {"submitted": []}},
+        {"$facet": {
+            "count": [{"$count": "n"}],
+            "items": [
+                {"$sort": {"due_at": 1, "id": 1}},
+                {"$limit": DASHBOARD_RECENT_ITEMS},
+                {"$project": {"_id": 0, "id": 1, "title": 1, "class_name": 1, "due_date": 1}},
+            ],
+        }},
+    ]
+    pending, graded, announcements, summary = await asyncio.gather(
+        db.assignments.aggregate(pending_pipeline).to_list(1),
+        db.submissions.find(
+            {"student_id": user["id"], "grade": {"$ne": None}},
+            {"_id": 0, "id": 1, "assignment_id": 1, "grade": 1, "submitted_at": 1}
+        ).sort([("submitted_at", -1), ("id", -1)]).to_list(DASHBOARD_RECENT_GRADES),
+        db.announcements.find(
+            in_classes, {"_id": 0, "id": 1, "title": 1, "content": 1, "class_name": 1, "created_at": 1}
+        ).sort([("created_at", -1), ("id", -1)]).to_list(DASHBOARD_RECENT_ITEMS),
+        summarize_student(user["id"]),
+    )
+    pending = pending[0]
+    return {
+        "role": "student",
+        "stats": {
+            "total_classes": len(classes),
+            "pending_assignments": pending["count"][0]["n"] if pending["count"] else 0,
+            "average_grade": summary["average_grade"],
+            "completed_assignments": summary["completed_assignments"],
+            "total_submissions": summary["total_assignments"],
+            "highest_grade": summary["highest_grade"],
+            "top_grades": summary["top_grades"],
+        },
+        "classes": classes,
+        "upcoming": pending["items"],
+        "announcements": announcements,
+        "submissions": graded,
+    }
+
+@api_router.get("/dashboard")
+async def get_dashboard(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] == "teacher":
+        return await teacher_dashboard(current_user)
+    return await student_dashboard(current_user)
+
+@api_router.get("/grading-overview")
+async def get_grading_overview(
+    response: Response,
+    limit: int = page_limit(100),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Classes, assignments and grading counts plus one page of submissions,
+    newest first; X-Next-Cursor pages through the rest."""
+    if current_user["role"] != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can grade")
+    
+    classes = await user_classes(current_user, {"id": 1, "name": 1})
+    assignments = await db.assignments.find(
+        {"class_id": {"$in": [c["id"] for c in classes]}},
+        {"_id": 0, "id": 1, "title": 1, "class_id": 1, "class_name": 1, "max_points": 1}
+    ).to_list(None)
+    in_assignments = {"assignment_id": {"$in": [a["id"] for a in assignments]}}
+    
+    submissions, pending, graded = await asyncio.gather(
+        keyset_page(
+            db.submissions, in_assignments,
+            {"_id": 0, "id": 1, "assignment_id": 1, "student_name": 1, "content": 1, "grade": 1, "remarks": 1, "submitted_at": 1},
+            [("submitted_at", -1), ("id", -1)], limit, cursor, response
+        ),
+        db.submissions.count_documents({**in_assignments, "grade": None}),
+        db.submissions.count_documents({**in_assignments, "grade": {"$ne": None}}),
+    )
+    return {
+        "classes": classes,
+        "assignments": assignments,
+        "submissions": submissions,
+        "counts": {"pending": pending, "graded": graded},
     }
 
 # ==================== LEADERBOARD ====================
 
+# The leaderboard collection holds running totals per (scope, student), where
+# scope is a class id or GLOBAL_SCOPE. grade_submission applies deltas to it;
+# rebuild_leaderboard recomputes it from the submissions collection, and
+# runs at startup when the collection is empty.
+GLOBAL_SCOPE = "global"
+
+async def apply_leaderboard_delta(scope: str, student_id: str, student_name: str, points_delta: int, count_delta: int):
+    await db.leaderboard.update_one(
+        {"scope": scope, "student_id": student_id},
+        [
+            {"$set": {
+                "student_name": student_name,
+                "updated_at": datetime.now(timezone.utc),
+                "total_points": {"$add": [{"$ifNull": ["$total_points", 0]}, points_delta]},
+                "graded_count": {"$add": [{"$ifNull": ["$graded_count", 0]}, count_delta]},
+            }},
+            {"$set": {
+                "average_score": {"$cond": [
+                    {"$gt": ["$graded_count", 0]},
+                    {"$divide": ["$total_points", "$graded_count"]},
+                    0
+                ]}
+            }},
+        ],
+        upsert=True
+    )
+
+async def record_grade_in_leaderboard(submission: dict, previous_grade: Optional[int]):
+    points_delta = submission["grade"] - (previous_grade or 0)
+    count_delta = 0 if previous_grade is not None else 1
+    if points_delta == 0 and count_delta == 0:
+        return
+    class_id = submission.get("class_id")
+    if not class_id:
+        assignment = await db.assignments.find_one({"id": submission["assignment_id"]}, {"_id": 0, "class_id": 1})
+        class_id = assignment["class_id"] if assignment else None
+    for scope in filter(None, [class_id, GLOBAL_SCOPE]):
+        await apply_leaderboard_delta(scope, submission["student_id"], submission["student_name"], points_delta, count_delta)
+
+async def write_rebuilt_leaderboard(batch: list) -> int:
+    """Apply a batch of rebuilt rows, returning how many were skipped
+    because grade_submission touched them after the rebuild started."""
+    try:
+        await db.leaderboard.bulk_write(batch, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errors):
+            raise
+        return len(errors)
+    return 0
+
+async def rebuild_leaderboard() -> dict:
+    """Recompute every leaderboard entry from graded submissions.
+
+    A row is only replaced if grade_submission has not updated it since the
+    rebuild started; otherwise the replace would overwrite that increment
+    with a total computed from an older snapshot. The guarded upsert then
+    collides with the unique (scope, student_id) index and the row is kept.
+    """
+    run_id = str(uuid.uuid4())
+    started = datetime.now(timezone.utc)
+    graded = [
+        {"$match": {"grade": {"$ne": None}}},
+        {"$lookup": {"from": "assignments", "localField": "assignment_id", "foreignField": "id", "as": "assignment"}},
+        {"$unwind": "$assignment"},
+    ]
+    entry = {
+        "_id": 0,
+        "scope": 1,
+        "student_id": "$_id.student_id",
+        "student_name": 1,
+        "total_points": 1,
+        "graded_count": 1,
+        "average_score": {"$divide": ["$total_points", "$graded_count"]},
+        "rebuild_id": run_id,
+    }
+    kept = 0
+    for scope in ["$assignment.class_id", GLOBAL_SCOPE]:
+        cursor = db.submissions.aggregate(graded + [
+            {"$group": {
+                "_id": {"scope": scope, "student_id": "$student_id"},
+                "student_name": {"$last": "$student_name"},
+                "total_points": {"$sum": "$grade"},
+                "graded_count": {"$sum": 1},
+            }},
+            {"$project": {**entry, "scope": "$_id.scope"}},
+        ])
+        batch = []
+        async for doc in cursor:
+            doc["updated_at"] = datetime.now(timezone.utc)
+            batch.append(ReplaceOne({
+                "scope": doc["scope"],
+                "student_id": doc["student_id"],
+                "$or": [{"updated_at": {"$lt": started}}, {"updated_at": {"$exists": False}}],
+            }, doc, upsert=True))
+            if len(batch) >= 1000:
+                kept += await write_rebuilt_leaderboard(batch)
+                batch = []
+        if batch:
+            kept += await write_rebuilt_leaderboard(batch)
+    # Rows that grade_submission created or updated while the rebuild ran are
+    # newer than it, not stale
+    stale = await db.leaderboard.delete_many({
+        "rebuild_id": {"$ne": run_id},
+        "$or": [{"updated_at": {"$lt": started}}, {"updated_at": {"$exists": False}}],
+    })
+    entries = await db.leaderboard.count_documents({})
+    return {"entries": entries, "removed": stale.deleted_count, "kept": kept}
+
 @api_router.get("/leaderboard")
 async def get_leaderboard(class_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
-    # Get all graded submissions
-    query = {}
-    if class_id:
-        assignments = await db.assignments.find({"class_id": class_id}, {"id": 1}).to_list(100)
-        assignment_ids = [a["id"] for a in assignments]
-        query["assignment_id"] = {"$in": assignment_ids}
-    
-    submissions = await db.submissions.find(query, {"_id": 0}).to_list(500)
-    
-    # Aggregate by student
-    student_scores = {}
-    for s in submissions:
-        if s.get("grade") is not None:
-            if s["student_id"] not in student_scores:
-                student_scores[s["student_id"]] = {"total": 0, "count": 0, "name": s["student_name"]}
-            student_scores[s["student_id"]]["total"] += s["grade"]
-            student_scores[s["student_id"]]["count"] += 1
-    
-    # Calculate averages and sort
-    leaderboard = []
-    for student_id, data in student_scores.items():
-        avg = round(data["total"] / data["count"], 1) if data["count"] > 0 else 0
-        leaderboard.append({
-            "student_id": student_id,
-            "student_name": data["name"],
-            "average_score": avg,
-            "assignments_completed": data["count"]
-        })
-    
-    leaderboard.sort(key=lambda x: x["average_score"], reverse=True)
-    return leaderboard[:20]
+    entries = await db.leaderboard.find(
+        {"scope": class_id or GLOBAL_SCOPE},
+        {"_id": 0, "student_id": 1, "student_name": 1, "average_score": 1, "graded_count": 1}
+    ).sort([("average_score", -1), ("graded_count", -1)]).to_list(20)
+    return [{
+        "student_id": e["student_id"],
+        "student_name": e["student_name"],
+        "average_score": round(e["average_score"], 1),
+        "assignments_completed": e["graded_count"]
+    } for e in entries]
 
 # ==================== CALENDAR ====================
 
+CALENDAR_MAX_EVENTS = 1000
+CALENDAR_EVENT_FIELDS = {"_id": 0, "id": 1, "title": 1, "due_at": 1, "class_name": 1}
+# The iCalendar feed covers recent and upcoming deadlines
+CALENDAR_FEED_PAST_DAYS = 30
+CALENDAR_FEED_FUTURE_DAYS = 365
+
+calendar_feed_cache = TTLCache(maxsize=1000, ttl=float(os.environ.get("CALENDAR_FEED_CACHE_SECONDS", "300")))
+
+async def find_calendar_events(user: dict, start: Optional[datetime], end: Optional[datetime]) -> List[dict]:
+    query = {"class_id": {"$in": [c["id"] for c in await user_classes(user, {"id": 1})]}}
+    due = {}
+    if start is not None:
+        due["$gte"] = start
+    if end is not None:
+        due["$lt"] = end
+    query["due_at"] = due or {"$ne": None}
+    return await db.assignments.find(query, CALENDAR_EVENT_FIELDS).sort("due_at", 1).to_list(CALENDAR_MAX_EVENTS)
+
+def _range_bound(value: Optional[str], name: str) -> Optional[datetime]:
+    if value is None:
+        return None
+    parsed = parse_due_date(value)
+    if parsed is None:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}")
+    return parsed
+
 @api_router.get("/calendar")
-async def get_calendar_events(current_user: dict = Depends(get_current_user)):
-    events = []
-    
-    if current_user["role"] == "student":
-        classes = await db.classes.find({"students": current_user["id"]}, {"id": 1}).to_list(100)
-    else:
-        classes = await db.classes.find({"teacher_id": current_user["id"]}, {"id": 1}).to_list(100)
-    
-    class_ids = [c["id"] for c in classes]
+async def get_calendar_events(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Assignment deadlines with ``start <= due < end`` (either bound optional)."""
+    assignments = await find_calendar_events(
+        current_user, _range_bound(start, "start"), _range_bound(end, "end")
+    )
+    return [{
+        "id": a["id"],
+        "title": a["title"],
+        "date": a["due_at"].isoformat(),
+        "type": "assignment",
+        "class_name": a["class_name"]
+    } for a in assignments]
+
+def create_feed_token(user: dict) -> str:
+    # Long-lived and limited to the calendar feed, since calendar apps poll a
+    # fixed URL and cannot refresh a session token. Bumping the user's
+    # feed_version revokes every link issued before.
+    return jwt.encode(
+        {"user_id": user["id"], "scope": "calendar", "v": user.get("feed_version", 0)},
+        JWT_SECRET, algorithm=JWT_ALGORITHM
+    )
+
+def _ics_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def render_ics(events: List[dict], generated_at: datetime) -> str:
+    stamp = generated_at.strftime("%Y%m%dT%H%M%SZ")
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//PRODIGY AI//Calendar//EN",
+        "CALSCALE:GREGORIAN",
+        "X-WR-CALNAME:PRODIGY AI deadlines",
+    ]
+    for e in events:
+        due = e["due_at"].astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:assignment-{e['id']}@prodigy-ai",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{due}",
+            f"DTEND:{due}",
+            f"SUMMARY:{_ics_escape(e['title'])}",
+            f"DESCRIPTION:{_ics_escape(e.get('class_name', ''))}",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines) + "\r\n"
+
+@api_router.get("/calendar/feed-url")
+async def get_calendar_feed_url(current_user: dict = Depends(get_current_user)):
+    return {"path": f"/api/calendar/feed.ics?token={create_feed_token(current_user)}"}
+
+@api_router.post("/calendar/feed-url")
+async def regenerate_calendar_feed_url(current_user: dict = Depends(get_current_user)):
+    """Issue a new feed link; links handed out before stop working."""
+    user = await db.users.find_one_and_update(
+        {"id": current_user["id"]},
+        {"$inc": {"feed_version": 1}},
+        projection={"_id": 0, "id": 1, "feed_version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    invalidate_cached_user(current_user["id"])
+    calendar_feed_cache.invalidate(current_user["id"])
+    return {"path": f"/api/calendar/feed.ics?token={create_feed_token(user)}"}
+
+@api_router.get("/calendar/feed.ics")
+async def calendar_feed(request: Request, token: str = Query(...)):
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("scope") != "calendar":
+        raise HTTPException(status_code=401, detail="Invalid token")
+    user = await cached_user(payload["user_id"])
+    if payload.get("v", 0) != user.get("feed_version", 0):
+        raise HTTPException(status_code=401, detail="Feed link has been revoked")
     
-    # Get assignments as events
-    assignments = await db.assignments.find({"class_id": {"$in": class_ids}}, {"_id": 0}).to_list(100)
-    for a in assignments:
-        events.append({
-            "id": a["id"],
-            "title": a["title"],
-            "date": a["due_date"],
-            "type": "assignment",
-            "class_name": a["class_name"]
-        })
+    # Rendered feeds are cached briefly, so polling clients cost one lookup
+    cached = calendar_feed_cache.get(payload["user_id"])
+    if cached is None:
+        now = datetime.now(timezone.utc)
+        events = await find_calendar_events(
+            user, now - timedelta(days=CALENDAR_FEED_PAST_DAYS), now + timedelta(days=CALENDAR_FEED_FUTURE_DAYS)
+        )
+        # The tag covers event content only, not the DTSTAMP generation time
+        fingerprint = json.dumps([[e["id"], e["title"], e["due_at"].isoformat(), e.get("class_name")] for e in events])
+        etag = '"' + hashlib.sha256(fingerprint.encode()).hexdigest()[:32] + '"'
+        cached = (render_ics(events, now), etag)
+        calendar_feed_cache.set(payload["user_id"], cached)
+    body, etag = cached
     
-    return events
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=300"}
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="text/calendar; charset=utf-8", headers=headers)
+
+async def backfill_due_dates() -> dict:
+    """Set due_at on assignments created before due dates were normalised."""
+    ops, invalid = [], []
+    async for a in db.assignments.find({"due_at": {"$exists": False}}, {"_id": 0, "id": 1, "due_date": 1}):
+        due_at = parse_due_date(a.get("due_date", ""))
+        if due_at is None:
+            invalid.append(a["id"])
+            continue
+        ops.append(UpdateOne({"id": a["id"]}, {"$set": {"due_at": due_at}}))
+    for i in range(0, len(ops), 1000):
+        await db.assignments.bulk_write(ops[i:i + 1000], ordered=False)
+    if invalid:
+        logger.warning(f"{len(invalid)} assignments have unparseable due dates: {', '.join(invalid[:20])}")
+    return {"updated": len(ops), "invalid": invalid}
 
 # ==================== SEARCH ====================
 
+# search_docs is an inverted index kept up to date on writes: one entry per
+# searchable class, assignment, announcement or file, holding its unique
+# title and body terms in a multikey-indexed ``tokens`` array. Exact terms
+# use $all and the last (possibly partial) term an anchored regex, both of
+# which are index range scans. Matches are scored in the aggregation, title
+# matches weighted above body matches, and the top results of each kind are
+# taken in a stable (score, ref_id) order.
+SEARCH_KINDS = {
+    "class": ("classes", "classes"),
+    "assignment": ("assignments", "assignments"),
+    "announcement": ("announcements", "announcements"),
+    "file": ("files", "files"),
+}
+SEARCH_MAX_BODY_TERMS = 2000
+SEARCH_RESULTS_PER_KIND = 10
+SEARCH_TITLE_WEIGHT = 3
+
+search_stats = {"queries": 0, "total_ms": 0.0, "last_ms": 0.0}
+
+async def index_for_search(kind: str, ref_id: str, title: str, body: str = "",
+                           class_id: Optional[str] = None, owner_id: Optional[str] = None):
+    title_tokens = sorted(set(tokenize(title or "")))
+    await db.search_docs.update_one(
+        {"kind": kind, "ref_id": ref_id},
+        {"$set": {
+            "class_id": class_id,
+            "owner_id": owner_id,
+            "title_tokens": title_tokens,
+            "tokens": sorted(set(title_tokens) | set(tokenize(body or ""))),
+        }},
+        upsert=True
+    )
+
+async def index_file_body_for_search(file_id: str):
+    """Add the most frequent terms of a file's extracted text to its entry."""
+    counts = Counter()
+    async for chunk in db.file_chunks.find({"file_id": file_id}, {"_id": 0, "terms": 1}):
+        counts.update(chunk.get("terms", {}))
+    body_terms = [term for term, _ in counts.most_common(SEARCH_MAX_BODY_TERMS)]
+    entry = await db.search_docs.find_one({"kind": "file", "ref_id": file_id}, {"_id": 0, "title_tokens": 1})
+    if entry is not None:
+        await db.search_docs.update_one(
+            {"kind": "file", "ref_id": file_id},
+            {"$set": {"tokens": sorted(set(entry["title_tokens"]) | set(body_terms))}}
+        )
+
+async def remove_from_search(kind: str, ref_ids: List[str]):
+    if ref_ids:
+        await db.search_docs.delete_many({"kind": kind, "ref_id": {"$in": ref_ids}})
+
+async def rebuild_search_index() -> dict:
+    """Re-create every search entry from the source collections."""
+    counts = {}
+    async for c in db.classes.find({}, {"_id": 0, "id": 1, "name": 1, "subject": 1, "description": 1}):
+        await index_for_search("class", c["id"], c["name"], f"{c.get('subject', '')} {c.get('description', '')}", class_id=c["id"])
+        counts["class"] = counts.get("class", 0) + 1
+    async for a in db.assignments.find({}, {"_id": 0, "id": 1, "title": 1, "description": 1, "class_id": 1}):
+        await index_for_search("assignment", a["id"], a["title"], a.get("description", ""), class_id=a["class_id"])
+        counts["assignment"] = counts.get("assignment", 0) + 1
+    async for a in db.announcements.find({}, {"_id": 0, "id": 1, "title": 1, "content": 1, "class_id": 1}):
+        await index_for_search("announcement", a["id"], a["title"], a.get("content", ""), class_id=a["class_id"])
+        counts["announcement"] = counts.get("announcement", 0) + 1
+    async for f in db.files.find({}, {"_id": 0, "id": 1, "filename": 1, "class_id": 1, "owner_id": 1, "chunk_count": 1}):
+        await index_for_search("file", f["id"], f["filename"], class_id=f.get("class_id"), owner_id=f["owner_id"])
+        if f.get("chunk_count"):
+            await index_file_body_for_search(f["id"])
+        counts["file"] = counts.get("file", 0) + 1
+    return counts
+
 @api_router.get("/search")
 async def search(q: str = Query(..., min_length=1), current_user: dict = Depends(get_current_user)):
+    started = time.monotonic()
     results = {
         "classes": [],
         "assignments": [],
@@ -897,54 +4499,153 @@ async def search(q: str = Query(..., min_length=1), current_user: dict = Depends
         "announcements": []
     }
     
-    # Search classes
-    if current_user["role"] == "teacher":
-        classes = await db.classes.find({
-            "teacher_id": current_user["id"],
-            "$or": [
-                {"name": {"$regex": q, "$options": "i"}},
-                {"subject": {"$regex": q, "$options": "i"}}
-            ]
-        }, {"_id": 0}).to_list(10)
-    else:
-        classes = await db.classes.find({
-            "students": current_user["id"],
-            "$or": [
-                {"name": {"$regex": q, "$options": "i"}},
-                {"subject": {"$regex": q, "$options": "i"}}
-            ]
-        }, {"_id": 0}).to_list(10)
-    results["classes"] = classes
-    
-    # Search assignments
-    class_ids = [c["id"] for c in classes] if classes else []
-    if class_ids:
-        assignments = await db.assignments.find({
-            "class_id": {"$in": class_ids},
-            "title": {"$regex": q, "$options": "i"}
-        }, {"_id": 0}).to_list(10)
-        results["assignments"] = assignments
-    
-    # Search files
-    files = await db.files.find({
-        "owner_id": current_user["id"],
-        "filename": {"$regex": q, "$options": "i"}
-    }, {"_id": 0, "text_content": 0}).to_list(10)
-    results["files"] = files
+    words = _WORD_RE.findall(q.lower())
+    if words:
+        if current_user["role"] == "teacher":
+            classes = await db.classes.find({"teacher_id": current_user["id"]}, {"id": 1}).to_list(None)
+        else:
+            classes = await db.classes.find({"students": current_user["id"]}, {"id": 1}).to_list(None)
+        class_ids = [c["id"] for c in classes]
+        
+        # Every complete word must match; the last one may be a prefix (type-ahead).
+        # Stopwords are not indexed, so they never become the prefix unless
+        # the query has nothing else.
+        kept = [w for w in words if w not in STOPWORDS] or words[-1:]
+        terms, prefix = kept[:-1], kept[-1]
+        conditions = [{"tokens": {"$regex": f"^{re.escape(prefix)}"}}]
+        if terms:
+            conditions.append({"tokens": {"$all": terms}})
+        conditions.append({"$or": [
+            {"kind": {"$in": ["class", "assignment", "announcement"]}, "class_id": {"$in": class_ids}},
+            {"kind": "file", "owner_id": current_user["id"]},
+            {"kind": "file", "class_id": {"$in": class_ids}},
+        ]})
+        # Each term scores SEARCH_TITLE_WEIGHT in the title and 1 in the body;
+        # the prefix scores one more again when it is a whole title word.
+        title = {"$ifNull": ["$title_tokens", []]}
+        score = {"$add": [
+            len(terms),
+            {"$multiply": [SEARCH_TITLE_WEIGHT - 1, {"$size": {"$filter": {
+                "input": {"$literal": terms}, "as": "t", "cond": {"$in": ["$$t", title]}
+            }}}]},
+            {"$cond": [{"$in": [prefix, title]}, SEARCH_TITLE_WEIGHT + 1, {"$cond": [
+                {"$gt": [{"$size": {"$filter": {"input": title, "as": "t", "cond": {
+                    "$eq": [{"$substr": ["$$t", 0, len(prefix)]}, prefix]
+                }}}}, 0]},
+                SEARCH_TITLE_WEIGHT, 1
+            ]}]},
+        ]}
+        facets = await db.search_docs.aggregate([
+            {"$match": {"$and": conditions}},
+            {"$project": {"_id": 0, "kind": 1, "ref_id": 1, "score": score}},
+            {"$facet": {kind: [
+                {"$match": {"kind": kind}},
+                {"$sort": {"score": -1, "ref_id": 1}},
+                {"$limit": SEARCH_RESULTS_PER_KIND},
+            ] for kind in SEARCH_KINDS}},
+        ]).to_list(1)
+        ranked = {kind: [e["ref_id"] for e in entries] for kind, entries in facets[0].items() if entries}
+        
+        for kind, ids in ranked.items():
+            collection, key = SEARCH_KINDS[kind]
+            docs = await db[collection].find({"id": {"$in": ids}}, {"_id": 0, "text_content": 0}).to_list(len(ids))
+            by_id = {d["id"]: d for d in docs}
+            results[key] = [by_id[i] for i in ids if i in by_id]
     
+    took_ms = round((time.monotonic() - started) * 1000, 2)
+    search_stats["queries"] += 1
+    search_stats["total_ms"] += took_ms
+    search_stats["last_ms"] = took_ms
+    results["took_ms"] = took_ms
     return results
 
+# ==================== SYSTEM ====================
+
+@api_router.get("/system/indexes")
+async def get_index_report(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can view index status")
+    report = getattr(app.state, "index_report", None)
+    if report is None:
+        report = await ensure_indexes()
+        app.state.index_report = report
+    return report
+
+@api_router.get("/system/metrics")
+async def get_metrics(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can view system metrics")
+    return {
+        "user_cache": user_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "llm": llm_client.stats(),
+        "ai_cache": ai_cache.stats(),
+        "notification_fanout": notification_fanout.stats(),
+        "notification_retention": notification_retention.stats(),
+        "push": push_hub.stats(),
+        "document_ingestion": document_ingestion.stats(),
+        "document_index_cache": document_index_cache.stats(),
+        "blob_store": blob_store.stats(),
+        "blob_collector": blob_collector.stats(),
+        "previews": preview_generator.stats(),
+        "denormalized_fields": denormalized_fields.stats(),
+        "file_storage": file_storage.stats(),
+        "search": {
+            "queries": search_stats["queries"],
+            "last_ms": search_stats["last_ms"],
+            "avg_ms": round(search_stats["total_ms"] / search_stats["queries"], 2) if search_stats["queries"] else 0.0,
+        },
+    }
+
 # Include router and setup CORS
 app.include_router(api_router)
 
+# Added first so that CORS headers also reach its 413 responses
+app.add_middleware(UploadSizeLimit)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+@app.on_event("startup")
+async def startup_workers():
+    await notification_fanout.start()
+    await document_ingestion.start()
+    await push_hub.start()
+    await notification_retention.start()
+    await blob_collector.start()
+    await preview_generator.start()
+    await denormalized_fields.start()
+
+@app.on_event("startup")
+async def startup_indexes():
+    app.state.index_report = await ensure_indexes()
+    for row in app.state.index_report:
+        if row["status"] != "ok":
+            logger.info(f"Index {row['collection']}.{row['index']}: {row['status']} (serves: {', '.join(row['serves']) or '-'})")
+
+@app.on_event("startup")
+async def startup_leaderboard():
+    # A fresh deployment (or one upgraded from before the leaderboard was
+    # materialised) has graded submissions but no leaderboard rows
+    if await db.leaderboard.find_one({}, {"_id": 1}) is None and \
+            await db.submissions.find_one({"grade": {"$ne": None}}, {"_id": 1}) is not None:
+        result = await rebuild_leaderboard()
+        logger.info(f"Built leaderboard: {result['entries']} entries")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await notification_fanout.stop()
+    await document_ingestion.stop()
+    await push_hub.stop()
+    await notification_retention.stop()
+    await blob_collector.stop()
+    await preview_generator.stop()
+    await denormalized_fields.stop()
     client.close()
+    password_hasher.shutdown()
+    await llm_client.close()
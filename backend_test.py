@@ -349,6 +349,34 @@ class ProdigyAITester:
         )
         return success
 
+    def test_ai_chat_stream(self):
+        """Test streaming AI chat (server-sent events)"""
+        self.tests_run += 1
+        self.log("🔍 Testing AI Chat Stream...")
+        try:
+            response = requests.post(
+                f"{self.api_url}/ai/chat/stream",
+                json={"prompt": "Explain the concept of photosynthesis"},
+                headers={'Authorization': f'Bearer {self.student_token}'},
+                stream=True
+            )
+            body = response.text
+            if response.status_code == 200 and "event: done" in body:
+                self.tests_passed += 1
+                self.log(f"✅ AI Chat Stream - Status: {response.status_code}")
+                return True
+            self.log(f"❌ AI Chat Stream - Status: {response.status_code}")
+            self.failed_tests.append({
+                "test": "AI Chat Stream",
+                "expected": 200,
+                "actual": response.status_code,
+                "endpoint": "ai/chat/stream"
+            })
+        except Exception as e:
+            self.log(f"❌ AI Chat Stream - Error: {str(e)}")
+            self.failed_tests.append({"test": "AI Chat Stream", "error": str(e), "endpoint": "ai/chat/stream"})
+        return False
+
     def test_file_upload(self):
         """Test file upload functionality"""
         # Create a simple test file
@@ -412,6 +440,17 @@ class ProdigyAITester:
         )
         return success
 
+    def test_index_report(self):
+        """Test index bootstrap report"""
+        success, response = self.run_test(
+            "Index Report",
+            "GET",
+            "system/indexes",
+            200,
+            token=self.teacher_token
+        )
+        return success and all(row.get('status') != 'failed' for row in response)
+
     def run_all_tests(self):
         """Run all tests in sequence"""
         self.log("🚀 Starting PRODIGY AI Backend Tests")
@@ -457,6 +496,7 @@ class ProdigyAITester:
         # AI and File Tests
         self.log("\n📋 AI and File Tests")
         self.test_ai_chat()
+        self.test_ai_chat_stream()
         self.test_file_upload()
         
         # Other Features
@@ -465,6 +505,7 @@ class ProdigyAITester:
         self.test_get_calendar()
         self.test_get_leaderboard()
         self.test_search()
+        self.test_index_report()
         
         return True
 
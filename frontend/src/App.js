@@ -73,6 +73,105 @@ api.interceptors.response.use(
   }
 );
 
+// Stream an AI reply from /ai/chat/stream, calling onToken for every delta.
+// Resolves with the full response text.
+export const streamAIChat = async (body, onToken) => {
+  const token = localStorage.getItem("token");
+  const res = await fetch(`${API}/ai/chat/stream`, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+      ...(token ? { Authorization: `Bearer ${token}` } : {}),
+    },
+    body: JSON.stringify(body),
+  });
+  if (!res.ok || !res.body) {
+    throw new Error(`AI request failed (${res.status})`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let full = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split("\n\n");
+    buffer = events.pop();
+    for (const raw of events) {
+      const lines = raw.split("\n");
+      const event = lines.find((l) => l.startsWith("event: "))?.slice(7);
+      const data = lines.find((l) => l.startsWith("data: "))?.slice(6);
+      if (!data) continue;
+      const payload = JSON.parse(data);
+      if (event === "error") throw new Error(payload.detail);
+      if (event === "done") return payload.response;
+      full += payload.token;
+      onToken(payload.token);
+    }
+  }
+  return full;
+};
+
+// Subscribe to server push events (chat messages, notifications, grades)
+// over /api/ws. All subscribers share one socket, which reconnects with
+// backoff and closes when the last subscriber unsubscribes. Returns the
+// unsubscribe function.
+const pushListeners = new Set();
+let pushSocket = null;
+let pushRetry = 0;
+let pushTimer = null;
+
+const connectPush = () => {
+  pushTimer = null;
+  const token = localStorage.getItem("token");
+  if (!token || pushListeners.size === 0) return;
+  const socket = new WebSocket(
+    `${API.replace(/^http/, "ws")}/ws?token=${encodeURIComponent(token)}`
+  );
+  pushSocket = socket;
+  socket.onopen = () => {
+    pushRetry = 0;
+  };
+  socket.onmessage = (msg) => {
+    const event = JSON.parse(msg.data);
+    if (event.type === "ping" || event.type === "ready") return;
+    pushListeners.forEach((listener) => listener(event));
+  };
+  socket.onclose = (e) => {
+    if (pushSocket !== socket) return;
+    pushSocket = null;
+    if (e.code === 4401 || pushListeners.size === 0) return;
+    pushTimer = setTimeout(connectPush, Math.min(30000, 1000 * 2 ** pushRetry++));
+  };
+};
+
+export const openPushChannel = (onEvent) => {
+  pushListeners.add(onEvent);
+  if (!pushSocket && !pushTimer) connectPush();
+  return () => {
+    pushListeners.delete(onEvent);
+    if (pushListeners.size === 0) {
+      clearTimeout(pushTimer);
+      pushTimer = null;
+      if (pushSocket) {
+        const socket = pushSocket;
+        pushSocket = null;
+        socket.close();
+      }
+    }
+  };
+};
+
+// Downloads go through a short-lived link so the browser can stream the
+// file (and resume it with Range requests) without the Authorization header.
+// With object storage the link points straight at the bucket.
+export const downloadFile = async (fileId) => {
+  const res = await api.get(`/files/${fileId}/download-url`);
+  window.location.assign(res.data.url || `${BACKEND_URL}${res.data.path}`);
+};
+
 // Auth Provider
 const AuthProvider = ({ children }) => {
   const [user, setUser] = useState(null);
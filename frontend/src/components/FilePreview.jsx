@@ -0,0 +1,35 @@
+import { useState, useEffect } from "react";
+import { api } from "@/App";
+import { cn } from "@/lib/utils";
+
+const isPreviewable = (file) =>
+  file.storage === "blob" &&
+  ((file.file_type || "").startsWith("image/") || (file.filename || "").toLowerCase().endsWith(".pdf"));
+
+// Shows the server-rendered WebP thumbnail of a file, or `fallback` while it
+// loads and when the file has none. Thumbnails are a few KB and cached by the
+// browser, so grids never fetch the original just to draw a preview.
+export default function FilePreview({ file, size = 256, className, fallback }) {
+  const [src, setSrc] = useState(null);
+
+  useEffect(() => {
+    if (!isPreviewable(file)) return;
+    let objectUrl = null;
+    let cancelled = false;
+    api
+      .get(`/files/${file.id}/preview?size=${size}`, { responseType: "blob" })
+      .then((res) => {
+        if (cancelled) return;
+        objectUrl = URL.createObjectURL(res.data);
+        setSrc(objectUrl);
+      })
+      .catch(() => {});
+    return () => {
+      cancelled = true;
+      if (objectUrl) URL.revokeObjectURL(objectUrl);
+    };
+  }, [file.id, size]);
+
+  if (!src) return fallback;
+  return <img src={src} alt={file.filename} className={cn("object-cover", className)} />;
+}
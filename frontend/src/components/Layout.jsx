@@ -1,6 +1,6 @@
-import { useState } from "react";
+import { useState, useEffect } from "react";
 import { Link, useLocation, useNavigate } from "react-router-dom";
-import { useAuth } from "@/App";
+import { api, useAuth, openPushChannel } from "@/App";
 import { cn } from "@/lib/utils";
 import { Button } from "@/components/ui/button";
 import { ScrollArea } from "@/components/ui/scroll-area";
@@ -66,6 +66,31 @@ export default function Layout({ children }) {
   const navigate = useNavigate();
   const [sidebarOpen, setSidebarOpen] = useState(false);
   const [darkMode, setDarkMode] = useState(true);
+  const [unreadCount, setUnreadCount] = useState(0);
+
+  const fetchUnreadCount = async () => {
+    try {
+      const res = await api.get("/notifications/unread-count");
+      setUnreadCount(res.data.unread);
+    } catch (error) {
+      // The badge is decorative; keep the last known count
+    }
+  };
+
+  useEffect(() => {
+    fetchUnreadCount();
+  }, [location.pathname]);
+
+  useEffect(() => {
+    window.addEventListener("notifications:changed", fetchUnreadCount);
+    const unsubscribe = openPushChannel((event) => {
+      if (event.type === "notification") setUnreadCount((n) => n + 1);
+    });
+    return () => {
+      window.removeEventListener("notifications:changed", fetchUnreadCount);
+      unsubscribe();
+    };
+  }, []);
 
   const navItems = user?.role === "teacher" ? teacherNavItems : studentNavItems;
 
@@ -190,7 +215,14 @@ export default function Layout({ children }) {
               <Link to="/notifications">
                 <Button variant="ghost" size="icon" className="rounded-full relative">
                   <Bell className="w-5 h-5" />
-                  <span className="absolute top-1 right-1 w-2 h-2 bg-destructive rounded-full" />
+                  {unreadCount > 0 && (
+                    <span
+                      className="absolute -top-0.5 -right-0.5 min-w-4 h-4 px-1 bg-destructive rounded-full text-[10px] leading-4 text-white"
+                      data-testid="unread-notifications-count"
+                    >
+                      {unreadCount > 99 ? "99+" : unreadCount}
+                    </span>
+                  )}
                 </Button>
               </Link>
 
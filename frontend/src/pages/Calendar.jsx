@@ -1,24 +1,33 @@
 import { useState, useEffect } from "react";
 import Layout from "@/components/Layout";
-import { api } from "@/App";
+import { api, API } from "@/App";
 import { Card, CardContent, CardHeader, CardTitle, CardDescription } from "@/components/ui/card";
 import { Badge } from "@/components/ui/badge";
 import { Calendar as CalendarComponent } from "@/components/ui/calendar";
-import { FileText, Clock } from "lucide-react";
+import { Button } from "@/components/ui/button";
+import { FileText, Clock, CalendarPlus, RefreshCw } from "lucide-react";
 import { toast } from "sonner";
 
 export default function Calendar() {
   const [events, setEvents] = useState([]);
   const [selectedDate, setSelectedDate] = useState(new Date());
+  const [month, setMonth] = useState(
+    new Date(new Date().getFullYear(), new Date().getMonth(), 1)
+  );
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
     fetchEvents();
-  }, []);
+  }, [month]);
 
+  // Load the displayed month plus the next, so upcoming deadlines are covered
   const fetchEvents = async () => {
     try {
-      const res = await api.get("/calendar");
+      const start = new Date(month.getFullYear(), month.getMonth(), 1);
+      const end = new Date(month.getFullYear(), month.getMonth() + 2, 1);
+      const res = await api.get("/calendar", {
+        params: { start: start.toISOString(), end: end.toISOString() },
+      });
       setEvents(res.data);
     } catch (error) {
       toast.error("Failed to load calendar events");
@@ -27,6 +36,27 @@ export default function Calendar() {
     }
   };
 
+  const copyFeedUrl = async () => {
+    try {
+      const res = await api.get("/calendar/feed-url");
+      await navigator.clipboard.writeText(`${API.replace(/\/api$/, "")}${res.data.path}`);
+      toast.success("Calendar feed URL copied. Add it to your calendar app.");
+    } catch (error) {
+      toast.error("Failed to get calendar feed URL");
+    }
+  };
+
+  // Revokes every previously shared feed URL and copies the new one
+  const resetFeedUrl = async () => {
+    try {
+      const res = await api.post("/calendar/feed-url");
+      await navigator.clipboard.writeText(`${API.replace(/\/api$/, "")}${res.data.path}`);
+      toast.success("New calendar feed URL copied. Old links no longer work.");
+    } catch (error) {
+      toast.error("Failed to reset calendar feed URL");
+    }
+  };
+
   const getEventsForDate = (date) => {
     return events.filter((e) => {
       const eventDate = new Date(e.date);
@@ -57,9 +87,21 @@ export default function Calendar() {
   return (
     <Layout>
       <div className="space-y-6" data-testid="calendar-page">
-        <div>
-          <h1 className="text-3xl font-bold">Calendar</h1>
-          <p className="text-muted-foreground mt-1">View deadlines and important dates</p>
+        <div className="flex items-start justify-between gap-4">
+          <div>
+            <h1 className="text-3xl font-bold">Calendar</h1>
+            <p className="text-muted-foreground mt-1">View deadlines and important dates</p>
+          </div>
+          <div className="flex gap-2">
+            <Button variant="outline" onClick={copyFeedUrl} data-testid="calendar-feed-button">
+              <CalendarPlus className="w-4 h-4 mr-2" />
+              Subscribe
+            </Button>
+            <Button variant="ghost" onClick={resetFeedUrl} data-testid="calendar-feed-reset-button">
+              <RefreshCw className="w-4 h-4 mr-2" />
+              Reset link
+            </Button>
+          </div>
         </div>
 
         <div className="grid grid-cols-1 lg:grid-cols-3 gap-6">
@@ -70,6 +112,8 @@ export default function Calendar() {
                 mode="single"
                 selected={selectedDate}
                 onSelect={(date) => date && setSelectedDate(date)}
+                month={month}
+                onMonthChange={setMonth}
                 className="rounded-xl border-0"
                 modifiers={{
                   hasEvent: eventDates,
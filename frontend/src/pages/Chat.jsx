@@ -1,6 +1,6 @@
 import { useState, useEffect, useRef } from "react";
 import Layout from "@/components/Layout";
-import { api, useAuth } from "@/App";
+import { api, useAuth, openPushChannel } from "@/App";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
@@ -19,22 +19,31 @@ export default function Chat() {
   const { user } = useAuth();
   const [conversations, setConversations] = useState([]);
   const [messages, setMessages] = useState([]);
-  const [selectedUser, setSelectedUser] = useState(null);
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [selected, setSelected] = useState(null);
   const [input, setInput] = useState("");
   const [loading, setLoading] = useState(true);
   const [searchQuery, setSearchQuery] = useState("");
   const [classes, setClasses] = useState([]);
   const scrollRef = useRef(null);
+  const selectedRef = useRef(null);
 
   useEffect(() => {
     fetchData();
+    return openPushChannel((event) => {
+      if (event.type === "chat.message") handleIncoming(event.message);
+    });
   }, []);
 
   useEffect(() => {
-    if (selectedUser) {
+    selectedRef.current = selected;
+  }, [selected]);
+
+  useEffect(() => {
+    if (selected) {
       fetchMessages();
     }
-  }, [selectedUser]);
+  }, [selected]);
 
   useEffect(() => {
     if (scrollRef.current) {
@@ -57,23 +66,82 @@ export default function Chat() {
     }
   };
 
+  // A thread is either a direct conversation or a class conversation
+  const threadFor = (conv) =>
+    conv.class
+      ? { key: `class:${conv.class.id}`, params: { class_id: conv.class.id }, name: conv.class.name, subtitle: "class" }
+      : { key: conv.user.id, params: { receiver_id: conv.user.id }, name: conv.user.full_name, subtitle: conv.user.role };
+
+  const threadKeyOf = (message) =>
+    message.class_id ? `class:${message.class_id}` : message.sender_id;
+
   const fetchMessages = async () => {
     try {
-      const res = await api.get(`/chat/messages?receiver_id=${selectedUser.id}`);
+      const res = await api.get("/chat/messages", { params: selected.params });
       setMessages(res.data);
+      setOlderCursor(res.headers["x-next-cursor"] || null);
+    } catch (error) {
+      toast.error("Failed to load messages");
+    }
+  };
+
+  const fetchOlderMessages = async () => {
+    try {
+      const res = await api.get("/chat/messages", {
+        params: { ...selected.params, before: olderCursor },
+      });
+      setMessages((prev) => [...res.data, ...prev]);
+      setOlderCursor(res.headers["x-next-cursor"] || null);
     } catch (error) {
       toast.error("Failed to load messages");
     }
   };
 
+  const handleIncoming = (message) => {
+    // Our own sends come back too; the optimistic copy is already shown
+    if (message.sender_id === user.id) return;
+    const key = threadKeyOf(message);
+    const open = selectedRef.current?.key === key;
+    if (open) {
+      // Refetching the open thread also marks the new message read
+      api
+        .get("/chat/messages", { params: selectedRef.current.params })
+        .then((res) => setMessages(res.data))
+        .catch(() => setMessages((prev) => [...prev, message]));
+    }
+    setConversations((prev) => {
+      const existing = prev.find((c) => threadFor(c).key === key);
+      if (!existing) {
+        fetchData();
+        return prev;
+      }
+      const updated = {
+        ...existing,
+        last_message: message.content,
+        last_time: message.created_at,
+        unread: open ? 0 : (existing.unread || 0) + 1,
+      };
+      return [updated, ...prev.filter((c) => c !== existing)];
+    });
+  };
+
+  const selectConversation = (conv) => {
+    const thread = threadFor(conv);
+    setSelected(thread);
+    // Opening the thread marks it read on the server; mirror that locally
+    setConversations((prev) =>
+      prev.map((c) => (threadFor(c).key === thread.key ? { ...c, unread: 0 } : c))
+    );
+  };
+
   const handleSend = async () => {
-    if (!input.trim() || !selectedUser) return;
+    if (!input.trim() || !selected) return;
 
     const newMessage = {
       id: Date.now().toString(),
       sender_id: user.id,
       sender_name: user.full_name,
-      receiver_id: selectedUser.id,
+      ...selected.params,
       content: input,
       created_at: new Date().toISOString(),
     };
@@ -83,7 +151,7 @@ export default function Chat() {
 
     try {
       await api.post("/chat/messages", {
-        receiver_id: selectedUser.id,
+        ...selected.params,
         content: input,
       });
     } catch (error) {
@@ -92,7 +160,7 @@ export default function Chat() {
   };
 
   const filteredConversations = conversations.filter((c) =>
-    c.user?.full_name?.toLowerCase().includes(searchQuery.toLowerCase())
+    threadFor(c).name?.toLowerCase().includes(searchQuery.toLowerCase())
   );
 
   if (loading) {
@@ -140,33 +208,42 @@ export default function Chat() {
                   </div>
                 ) : (
                   <div className="space-y-1 p-2">
-                    {filteredConversations.map((conv) => (
-                      <button
-                        key={conv.user?.id}
-                        onClick={() => setSelectedUser(conv.user)}
-                        className={`w-full flex items-center gap-3 p-3 rounded-xl transition-all text-left ${
-                          selectedUser?.id === conv.user?.id
-                            ? "bg-primary/20 border border-primary/30"
-                            : "hover:bg-white/5"
-                        }`}
-                        data-testid={`conversation-${conv.user?.id}`}
-                      >
-                        <Avatar>
-                          <AvatarFallback className="bg-primary/20 text-primary">
-                            {conv.user?.full_name?.charAt(0) || "U"}
-                          </AvatarFallback>
-                        </Avatar>
-                        <div className="flex-1 min-w-0">
-                          <p className="font-medium truncate">{conv.user?.full_name}</p>
-                          <p className="text-sm text-muted-foreground truncate">
-                            {conv.last_message}
-                          </p>
-                        </div>
-                        <Badge variant="outline" className="text-xs capitalize">
-                          {conv.user?.role}
-                        </Badge>
-                      </button>
-                    ))}
+                    {filteredConversations.map((conv) => {
+                      const thread = threadFor(conv);
+                      return (
+                        <button
+                          key={thread.key}
+                          onClick={() => selectConversation(conv)}
+                          className={`w-full flex items-center gap-3 p-3 rounded-xl transition-all text-left ${
+                            selected?.key === thread.key
+                              ? "bg-primary/20 border border-primary/30"
+                              : "hover:bg-white/5"
+                          }`}
+                          data-testid={`conversation-${thread.key}`}
+                        >
+                          <Avatar>
+                            <AvatarFallback className="bg-primary/20 text-primary">
+                              {conv.class ? <Users className="w-4 h-4" /> : thread.name?.charAt(0) || "U"}
+                            </AvatarFallback>
+                          </Avatar>
+                          <div className="flex-1 min-w-0">
+                            <p className="font-medium truncate">{thread.name}</p>
+                            <p className="text-sm text-muted-foreground truncate">
+                              {conv.last_message}
+                            </p>
+                          </div>
+                          {conv.unread > 0 ? (
+                            <Badge className="text-xs" data-testid={`unread-${thread.key}`}>
+                              {conv.unread}
+                            </Badge>
+                          ) : (
+                            <Badge variant="outline" className="text-xs capitalize">
+                              {thread.subtitle}
+                            </Badge>
+                          )}
+                        </button>
+                      );
+                    })}
                   </div>
                 )}
 
@@ -190,24 +267,36 @@ export default function Chat() {
 
           {/* Chat Area */}
           <Card className="lg:col-span-2 glass border-white/10 flex flex-col">
-            {selectedUser ? (
+            {selected ? (
               <>
                 <CardHeader className="border-b border-white/10">
                   <div className="flex items-center gap-3">
                     <Avatar>
                       <AvatarFallback className="bg-primary/20 text-primary">
-                        {selectedUser.full_name?.charAt(0) || "U"}
+                        {selected.params.class_id ? <Users className="w-4 h-4" /> : selected.name?.charAt(0) || "U"}
                       </AvatarFallback>
                     </Avatar>
                     <div>
-                      <CardTitle className="text-lg">{selectedUser.full_name}</CardTitle>
-                      <p className="text-sm text-muted-foreground capitalize">{selectedUser.role}</p>
+                      <CardTitle className="text-lg">{selected.name}</CardTitle>
+                      <p className="text-sm text-muted-foreground capitalize">{selected.subtitle}</p>
                     </div>
                   </div>
                 </CardHeader>
                 <CardContent className="flex-1 p-0 flex flex-col">
                   <ScrollArea className="flex-1 p-4" ref={scrollRef}>
                     <div className="space-y-4">
+                      {olderCursor && (
+                        <div className="flex justify-center">
+                          <Button
+                            variant="ghost"
+                            size="sm"
+                            onClick={fetchOlderMessages}
+                            data-testid="load-older-messages"
+                          >
+                            Load older messages
+                          </Button>
+                        </div>
+                      )}
                       {messages.map((msg) => (
                         <div
                           key={msg.id}
@@ -220,6 +309,9 @@ export default function Chat() {
                                 : "bg-white/5"
                             }`}
                           >
+                            {selected.params.class_id && msg.sender_id !== user.id && (
+                              <p className="text-xs font-medium text-primary mb-1">{msg.sender_name}</p>
+                            )}
                             <p className="text-sm">{msg.content}</p>
                             <p className="text-xs text-muted-foreground mt-1">
                               {new Date(msg.created_at).toLocaleTimeString([], {
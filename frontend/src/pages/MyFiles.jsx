@@ -1,6 +1,7 @@
 import { useState, useEffect } from "react";
 import Layout from "@/components/Layout";
-import { api, useAuth } from "@/App";
+import FilePreview from "@/components/FilePreview";
+import { api, useAuth, downloadFile } from "@/App";
 import { Card, CardContent } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
@@ -31,6 +32,7 @@ import {
   Plus,
   Upload,
   Trash2,
+  Download,
   Search,
   ChevronRight,
   ArrowLeft,
@@ -53,6 +55,7 @@ export default function MyFiles() {
   const [deleteDialogOpen, setDeleteDialogOpen] = useState(false);
   const [itemToDelete, setItemToDelete] = useState(null);
   const [deleteType, setDeleteType] = useState(null); // 'file' or 'folder'
+  const [folderSize, setFolderSize] = useState(null);
 
   useEffect(() => {
     fetchData();
@@ -138,10 +141,19 @@ export default function MyFiles() {
     }
   };
 
-  const openDeleteDialog = (item, type) => {
+  const openDeleteDialog = async (item, type) => {
     setItemToDelete(item);
     setDeleteType(type);
+    setFolderSize(null);
     setDeleteDialogOpen(true);
+    if (type === 'folder') {
+      try {
+        const res = await api.get(`/folders/${item.id}/size`);
+        setFolderSize(res.data);
+      } catch (error) {
+        // The dialog still works without the totals
+      }
+    }
   };
 
   const navigateToFolder = (folder) => {
@@ -158,6 +170,14 @@ export default function MyFiles() {
     setLoading(true);
   };
 
+  const handleDownload = async (file) => {
+    try {
+      await downloadFile(file.id);
+    } catch (error) {
+      toast.error("Failed to download file");
+    }
+  };
+
   const getFileIcon = (fileType) => {
     if (fileType?.includes("image")) return Image;
     if (fileType?.includes("video")) return Video;
@@ -324,17 +344,35 @@ export default function MyFiles() {
                 <Card key={file.id} className="glass border-white/10 card-interactive" data-testid={`file-${file.id}`}>
                   <CardContent className="p-4">
                     <div className="flex items-start justify-between">
-                      <div className="w-12 h-12 rounded-lg bg-secondary/20 flex items-center justify-center">
-                        <FileIcon className="w-6 h-6 text-secondary" />
+                      <FilePreview
+                        file={file}
+                        size={128}
+                        className="w-12 h-12 rounded-lg"
+                        fallback={
+                          <div className="w-12 h-12 rounded-lg bg-secondary/20 flex items-center justify-center">
+                            <FileIcon className="w-6 h-6 text-secondary" />
+                          </div>
+                        }
+                      />
+                      <div className="flex gap-1">
+                        <Button
+                          variant="ghost"
+                          size="icon"
+                          className="h-8 w-8"
+                          onClick={() => handleDownload(file)}
+                          data-testid={`download-${file.id}`}
+                        >
+                          <Download className="w-4 h-4" />
+                        </Button>
+                        <Button 
+                          variant="ghost" 
+                          size="icon" 
+                          className="h-8 w-8 text-destructive hover:text-destructive hover:bg-destructive/10"
+                          onClick={() => openDeleteDialog(file, 'file')}
+                        >
+                          <Trash2 className="w-4 h-4" />
+                        </Button>
                       </div>
-                      <Button 
-                        variant="ghost" 
-                        size="icon" 
-                        className="h-8 w-8 text-destructive hover:text-destructive hover:bg-destructive/10"
-                        onClick={() => openDeleteDialog(file, 'file')}
-                      >
-                        <Trash2 className="w-4 h-4" />
-                      </Button>
                     </div>
                     <p className="font-medium mt-3 truncate">{file.filename}</p>
                     <p className="text-sm text-muted-foreground">
@@ -354,7 +392,9 @@ export default function MyFiles() {
               <AlertDialogTitle>Delete {deleteType === 'folder' ? 'Folder' : 'File'}?</AlertDialogTitle>
               <AlertDialogDescription>
                 {deleteType === 'folder' 
-                  ? `This will delete the folder "${itemToDelete?.name}" and all its contents.`
+                  ? `This will delete the folder "${itemToDelete?.name}" and all its contents${
+                      folderSize ? ` (${folderSize.folders} subfolders, ${folderSize.files} files, ${Math.round(folderSize.bytes / 1024)} KB)` : ""
+                    }.`
                   : `This will delete the file "${itemToDelete?.filename}".`
                 }
                 This action cannot be undone.
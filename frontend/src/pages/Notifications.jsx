@@ -1,6 +1,6 @@
 import { useState, useEffect } from "react";
 import Layout from "@/components/Layout";
-import { api } from "@/App";
+import { api, openPushChannel } from "@/App";
 import { Card, CardContent, CardHeader, CardTitle, CardDescription } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { Badge } from "@/components/ui/badge";
@@ -14,6 +14,15 @@ export default function Notifications() {
 
   useEffect(() => {
     fetchNotifications();
+    return openPushChannel((event) => {
+      if (event.type === "notification") {
+        setNotifications((prev) =>
+          prev.some((n) => n.id === event.notification.id)
+            ? prev
+            : [event.notification, ...prev]
+        );
+      }
+    });
   }, []);
 
   const fetchNotifications = async () => {
@@ -33,6 +42,7 @@ export default function Notifications() {
       setNotifications(
         notifications.map((n) => (n.id === id ? { ...n, read: true } : n))
       );
+      window.dispatchEvent(new Event("notifications:changed"));
     } catch (error) {
       toast.error("Failed to mark as read");
     }
@@ -42,6 +52,7 @@ export default function Notifications() {
     try {
       await api.put("/notifications/read-all");
       setNotifications(notifications.map((n) => ({ ...n, read: true })));
+      window.dispatchEvent(new Event("notifications:changed"));
       toast.success("All notifications marked as read");
     } catch (error) {
       toast.error("Failed to mark all as read");
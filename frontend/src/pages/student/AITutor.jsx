@@ -1,6 +1,6 @@
 import { useState, useRef, useEffect } from "react";
 import Layout from "@/components/Layout";
-import { api, useAuth } from "@/App";
+import { api, streamAIChat, useAuth } from "@/App";
 import { Card, CardContent, CardHeader, CardTitle, CardDescription } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
@@ -81,22 +81,25 @@ export default function StudentAITutor() {
     setInput("");
     setLoading(true);
 
-    try {
-      const res = await api.post("/ai/chat", {
-        prompt: input,
-        file_id: selectedFile || null,
+    // Render the reply token by token into a placeholder assistant message
+    const appendToReply = (text, replace = false) =>
+      setMessages((prev) => {
+        const last = prev[prev.length - 1];
+        return [...prev.slice(0, -1), { ...last, content: replace ? text : last.content + text }];
       });
+    setMessages((prev) => [...prev, { role: "assistant", content: "" }]);
 
-      setMessages((prev) => [
-        ...prev,
-        { role: "assistant", content: res.data.response },
-      ]);
+    try {
+      await streamAIChat(
+        {
+          prompt: input,
+          file_id: selectedFile || null,
+        },
+        (token) => appendToReply(token)
+      );
     } catch (error) {
       toast.error("Failed to get AI response");
-      setMessages((prev) => [
-        ...prev,
-        { role: "assistant", content: "Sorry, I encountered an error. Please try again." },
-      ]);
+      appendToReply("Sorry, I encountered an error. Please try again.", true);
     } finally {
       setLoading(false);
     }
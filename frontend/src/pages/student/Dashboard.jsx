@@ -23,11 +23,9 @@ import { toast } from "sonner";
 
 export default function StudentDashboard() {
   const { user } = useAuth();
-  const [classes, setClasses] = useState([]);
-  const [assignments, setAssignments] = useState([]);
-  const [submissions, setSubmissions] = useState([]);
+  const [stats, setStats] = useState(null);
+  const [upcoming, setUpcoming] = useState([]);
   const [announcements, setAnnouncements] = useState([]);
-  const [analytics, setAnalytics] = useState(null);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
@@ -36,19 +34,10 @@ export default function StudentDashboard() {
 
   const fetchDashboardData = async () => {
     try {
-      const [classesRes, assignmentsRes, submissionsRes, announcementsRes, analyticsRes] = await Promise.all([
-        api.get("/classes"),
-        api.get("/assignments"),
-        api.get("/submissions"),
-        api.get("/announcements"),
-        api.get(`/analytics/student/${user.id}`),
-      ]);
-
-      setClasses(classesRes.data);
-      setAssignments(assignmentsRes.data);
-      setSubmissions(submissionsRes.data);
-      setAnnouncements(announcementsRes.data);
-      setAnalytics(analyticsRes.data);
+      const res = await api.get("/dashboard");
+      setStats(res.data.stats);
+      setUpcoming(res.data.upcoming);
+      setAnnouncements(res.data.announcements);
     } catch (error) {
       toast.error("Failed to load dashboard data");
     } finally {
@@ -56,16 +45,6 @@ export default function StudentDashboard() {
     }
   };
 
-  const getPendingAssignments = () => {
-    const submittedIds = new Set(submissions.map((s) => s.assignment_id));
-    return assignments.filter((a) => !submittedIds.has(a.id) && new Date(a.due_date) > new Date());
-  };
-
-  const getUpcomingDeadlines = () => {
-    const pending = getPendingAssignments();
-    return pending.sort((a, b) => new Date(a.due_date) - new Date(b.due_date)).slice(0, 5);
-  };
-
   if (loading) {
     return (
       <Layout>
@@ -111,7 +90,7 @@ export default function StudentDashboard() {
                 </div>
               </div>
               <div className="mt-4">
-                <p className="text-3xl font-bold">{classes.length}</p>
+                <p className="text-3xl font-bold">{stats?.total_classes || 0}</p>
                 <p className="text-sm text-muted-foreground mt-1">Enrolled Classes</p>
               </div>
             </CardContent>
@@ -123,14 +102,14 @@ export default function StudentDashboard() {
                 <div className="w-12 h-12 rounded-xl bg-accent/20 flex items-center justify-center">
                   <Clock className="w-6 h-6 text-accent" />
                 </div>
-                {getPendingAssignments().length > 0 && (
+                {(stats?.pending_assignments || 0) > 0 && (
                   <Badge variant="destructive" className="animate-pulse">
-                    {getPendingAssignments().length}
+                    {(stats?.pending_assignments || 0)}
                   </Badge>
                 )}
               </div>
               <div className="mt-4">
-                <p className="text-3xl font-bold">{getPendingAssignments().length}</p>
+                <p className="text-3xl font-bold">{(stats?.pending_assignments || 0)}</p>
                 <p className="text-sm text-muted-foreground mt-1">Pending Assignments</p>
               </div>
             </CardContent>
@@ -148,7 +127,7 @@ export default function StudentDashboard() {
                 </Badge>
               </div>
               <div className="mt-4">
-                <p className="text-3xl font-bold">{analytics?.average_grade || 0}%</p>
+                <p className="text-3xl font-bold">{stats?.average_grade || 0}%</p>
                 <p className="text-sm text-muted-foreground mt-1">Average Grade</p>
               </div>
             </CardContent>
@@ -162,7 +141,7 @@ export default function StudentDashboard() {
                 </div>
               </div>
               <div className="mt-4">
-                <p className="text-3xl font-bold">{analytics?.completed_assignments || 0}</p>
+                <p className="text-3xl font-bold">{stats?.completed_assignments || 0}</p>
                 <p className="text-sm text-muted-foreground mt-1">Completed Assignments</p>
               </div>
             </CardContent>
@@ -185,14 +164,14 @@ export default function StudentDashboard() {
               </Link>
             </CardHeader>
             <CardContent>
-              {getUpcomingDeadlines().length === 0 ? (
+              {upcoming.length === 0 ? (
                 <div className="text-center py-8">
                   <CheckCircle2 className="w-12 h-12 mx-auto text-secondary mb-4" />
                   <p className="text-muted-foreground">All caught up! No pending assignments.</p>
                 </div>
               ) : (
                 <div className="space-y-3">
-                  {getUpcomingDeadlines().map((assignment) => {
+                  {upcoming.map((assignment) => {
                     const dueDate = new Date(assignment.due_date);
                     const daysLeft = Math.ceil((dueDate - new Date()) / (1000 * 60 * 60 * 24));
                     const isUrgent = daysLeft <= 2;
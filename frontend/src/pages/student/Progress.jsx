@@ -1,6 +1,6 @@
 import { useState, useEffect } from "react";
 import Layout from "@/components/Layout";
-import { api, useAuth } from "@/App";
+import { api } from "@/App";
 import { Card, CardContent, CardHeader, CardTitle, CardDescription } from "@/components/ui/card";
 import { Badge } from "@/components/ui/badge";
 import { Progress } from "@/components/ui/progress";
@@ -16,7 +16,6 @@ import {
 import { toast } from "sonner";
 
 export default function StudentProgress() {
-  const { user } = useAuth();
   const [analytics, setAnalytics] = useState(null);
   const [submissions, setSubmissions] = useState([]);
   const [classes, setClasses] = useState([]);
@@ -28,14 +27,10 @@ export default function StudentProgress() {
 
   const fetchData = async () => {
     try {
-      const [analyticsRes, submissionsRes, classesRes] = await Promise.all([
-        api.get(`/analytics/student/${user.id}`),
-        api.get("/submissions"),
-        api.get("/classes"),
-      ]);
-      setAnalytics(analyticsRes.data);
-      setSubmissions(submissionsRes.data);
-      setClasses(classesRes.data);
+      const res = await api.get("/dashboard");
+      setAnalytics(res.data.stats);
+      setSubmissions(res.data.submissions);
+      setClasses(res.data.classes);
     } catch (error) {
       toast.error("Failed to load progress data");
     } finally {
@@ -133,7 +128,7 @@ export default function StudentProgress() {
                 <Trophy className="w-6 h-6 text-yellow-500" />
               </div>
               <div className="mt-4">
-                <p className="text-4xl font-bold">{gradedSubmissions.filter((s) => s.grade >= 90).length}</p>
+                <p className="text-4xl font-bold">{analytics?.top_grades || 0}</p>
                 <p className="text-sm text-muted-foreground mt-1">A+ Grades</p>
               </div>
             </CardContent>
@@ -163,7 +158,7 @@ export default function StudentProgress() {
                     <span className="text-sm font-medium">Top Performance</span>
                   </div>
                   <p className="text-2xl font-bold">
-                    {Math.max(...gradedSubmissions.map((s) => s.grade || 0), 0)}%
+                    {analytics?.highest_grade || 0}%
                   </p>
                   <p className="text-xs text-muted-foreground">Highest grade achieved</p>
                 </div>
@@ -173,7 +168,7 @@ export default function StudentProgress() {
                     <FileText className="w-4 h-4 text-primary" />
                     <span className="text-sm font-medium">Submissions</span>
                   </div>
-                  <p className="text-2xl font-bold">{submissions.length}</p>
+                  <p className="text-2xl font-bold">{analytics?.total_submissions || 0}</p>
                   <p className="text-xs text-muted-foreground">Total submissions</p>
                 </div>
 
@@ -182,7 +177,7 @@ export default function StudentProgress() {
                     <TrendingUp className="w-4 h-4 text-secondary" />
                     <span className="text-sm font-medium">Graded</span>
                   </div>
-                  <p className="text-2xl font-bold">{gradedSubmissions.length}</p>
+                  <p className="text-2xl font-bold">{analytics?.completed_assignments || 0}</p>
                   <p className="text-xs text-muted-foreground">Assignments graded</p>
                 </div>
               </div>
@@ -79,7 +79,11 @@ export default function TeacherAssignments() {
     }
 
     try {
-      const res = await api.post("/assignments", formData);
+      const res = await api.post("/assignments", {
+        ...formData,
+        // datetime-local values have no offset; send the user's local time as UTC
+        due_date: new Date(formData.due_date).toISOString(),
+      });
       setAssignments([res.data, ...assignments]);
       setDialogOpen(false);
       setFormData({ class_id: "", title: "", description: "", due_date: "", max_points: 100 });
@@ -1,7 +1,8 @@
 import { useState, useEffect } from "react";
 import { useParams, Link } from "react-router-dom";
 import Layout from "@/components/Layout";
-import { api } from "@/App";
+import FilePreview from "@/components/FilePreview";
+import { api, downloadFile } from "@/App";
 import { Card, CardContent, CardHeader, CardTitle, CardDescription } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
@@ -44,6 +45,7 @@ import {
   Video,
   File,
   Image,
+  Download,
 } from "lucide-react";
 import { toast } from "sonner";
 
@@ -134,6 +136,8 @@ export default function TeacherClassDetail() {
     try {
       const res = await api.post("/assignments", {
         ...assignmentForm,
+        // datetime-local values have no offset; send the user's local time as UTC
+        due_date: new Date(assignmentForm.due_date).toISOString(),
         class_id: classId,
       });
       setAssignments([res.data, ...assignments]);
@@ -175,6 +179,14 @@ export default function TeacherClassDetail() {
     }
   };
 
+  const handleDownload = async (file) => {
+    try {
+      await downloadFile(file.id);
+    } catch (error) {
+      toast.error("Failed to download file");
+    }
+  };
+
   const getFileIcon = (fileType) => {
     if (fileType?.includes("image")) return Image;
     if (fileType?.includes("video")) return Video;
@@ -342,11 +354,31 @@ export default function TeacherClassDetail() {
                             />
                           </div>
                         ) : (
-                          <div className="w-12 h-12 rounded-lg bg-primary/20 flex items-center justify-center mb-3">
-                            <FileIcon className="w-6 h-6 text-primary" />
-                          </div>
+                          <FilePreview
+                            file={file}
+                            size={128}
+                            className="w-12 h-12 rounded-lg mb-3"
+                            fallback={
+                              <div className="w-12 h-12 rounded-lg bg-primary/20 flex items-center justify-center mb-3">
+                                <FileIcon className="w-6 h-6 text-primary" />
+                              </div>
+                            }
+                          />
                         )}
-                        <p className="font-medium truncate">{file.filename}</p>
+                        <div className="flex items-center justify-between gap-2">
+                          <p className="font-medium truncate">{file.filename}</p>
+                          {file.file_type !== "video/youtube" && (
+                            <Button
+                              variant="ghost"
+                              size="icon"
+                              className="h-8 w-8 shrink-0"
+                              onClick={() => handleDownload(file)}
+                              data-testid={`download-${file.id}`}
+                            >
+                              <Download className="w-4 h-4" />
+                            </Button>
+                          )}
+                        </div>
                         <p className="text-sm text-muted-foreground">
                           {file.file_size ? `${Math.round(file.file_size / 1024)} KB` : "Video"}
                         </p>
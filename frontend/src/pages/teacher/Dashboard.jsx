@@ -31,7 +31,6 @@ export default function TeacherDashboard() {
   });
   const [classes, setClasses] = useState([]);
   const [assignments, setAssignments] = useState([]);
-  const [submissions, setSubmissions] = useState([]);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
@@ -40,25 +39,16 @@ export default function TeacherDashboard() {
 
   const fetchDashboardData = async () => {
     try {
-      const [classesRes, assignmentsRes, submissionsRes, announcementsRes] = await Promise.all([
-        api.get("/classes"),
-        api.get("/assignments"),
-        api.get("/submissions"),
-        api.get("/announcements"),
-      ]);
-
-      setClasses(classesRes.data);
-      setAssignments(assignmentsRes.data);
-      setSubmissions(submissionsRes.data);
-
-      const totalStudents = classesRes.data.reduce((acc, c) => acc + (c.students?.length || 0), 0);
-      const pendingSubmissions = submissionsRes.data.filter((s) => s.grade === null).length;
+      const res = await api.get("/dashboard");
+      const { stats, classes, assignments } = res.data;
 
+      setClasses(classes);
+      setAssignments(assignments);
       setStats({
-        totalClasses: classesRes.data.length,
-        totalStudents,
-        pendingSubmissions,
-        recentAnnouncements: announcementsRes.data.length,
+        totalClasses: stats.total_classes,
+        totalStudents: stats.total_students,
+        pendingSubmissions: stats.pending_submissions,
+        recentAnnouncements: stats.announcements,
       });
     } catch (error) {
       toast.error("Failed to load dashboard data");
@@ -175,7 +165,7 @@ export default function TeacherDashboard() {
                         <div className="flex items-center gap-4">
                           <Badge variant="outline">
                             <Users className="w-3 h-3 mr-1" />
-                            {cls.students?.length || 0}
+                            {cls.student_count}
                           </Badge>
                           <ArrowRight className="w-4 h-4 text-muted-foreground group-hover:text-primary transition-colors" />
                         </div>
@@ -256,13 +246,9 @@ export default function TeacherDashboard() {
             ) : (
               <div className="space-y-4">
                 {assignments.slice(0, 5).map((assignment) => {
-                  const assignmentSubmissions = submissions.filter(
-                    (s) => s.assignment_id === assignment.id
-                  );
-                  const classData = classes.find((c) => c.id === assignment.class_id);
-                  const totalStudents = classData?.students?.length || 0;
+                  const totalStudents = assignment.student_count;
                   const progress = totalStudents > 0 
-                    ? Math.round((assignmentSubmissions.length / totalStudents) * 100) 
+                    ? Math.round((assignment.submission_count / totalStudents) * 100) 
                     : 0;
                   
                   return (
@@ -280,7 +266,7 @@ export default function TeacherDashboard() {
                       <div className="space-y-2">
                         <div className="flex justify-between text-sm">
                           <span className="text-muted-foreground">Submissions</span>
-                          <span>{assignmentSubmissions.length}/{totalStudents}</span>
+                          <span>{assignment.submission_count}/{totalStudents}</span>
                         </div>
                         <Progress value={progress} className="h-2" />
                       </div>
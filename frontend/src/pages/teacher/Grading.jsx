@@ -43,6 +43,7 @@ export default function TeacherGrading() {
   const [filter, setFilter] = useState("pending");
   const [selectedClass, setSelectedClass] = useState("all");
   const [searchQuery, setSearchQuery] = useState("");
+  const [nextCursor, setNextCursor] = useState(null);
 
   useEffect(() => {
     fetchData();
@@ -50,14 +51,11 @@ export default function TeacherGrading() {
 
   const fetchData = async () => {
     try {
-      const [submissionsRes, assignmentsRes, classesRes] = await Promise.all([
-        api.get("/submissions"),
-        api.get("/assignments"),
-        api.get("/classes"),
-      ]);
-      setSubmissions(submissionsRes.data);
-      setAssignments(assignmentsRes.data);
-      setClasses(classesRes.data);
+      const res = await api.get("/grading-overview");
+      setSubmissions(res.data.submissions);
+      setAssignments(res.data.assignments);
+      setClasses(res.data.classes);
+      setNextCursor(res.headers["x-next-cursor"] || null);
     } catch (error) {
       toast.error("Failed to load data");
     } finally {
@@ -65,6 +63,16 @@ export default function TeacherGrading() {
     }
   };
 
+  const fetchMoreSubmissions = async () => {
+    try {
+      const res = await api.get("/grading-overview", { params: { cursor: nextCursor } });
+      setSubmissions((prev) => [...prev, ...res.data.submissions]);
+      setNextCursor(res.headers["x-next-cursor"] || null);
+    } catch (error) {
+      toast.error("Failed to load submissions");
+    }
+  };
+
   const handleGrade = async () => {
     if (!gradeForm.grade) {
       toast.error("Please enter a grade");
@@ -314,6 +322,19 @@ export default function TeacherGrading() {
           </div>
         )}
 
+        {nextCursor && (
+          <div className="flex justify-center">
+            <Button
+              variant="ghost"
+              size="sm"
+              onClick={fetchMoreSubmissions}
+              data-testid="load-more-submissions"
+            >
+              Load more submissions
+            </Button>
+          </div>
+        )}
+
         {/* Grade Dialog */}
         <Dialog open={!!selectedSubmission} onOpenChange={() => setSelectedSubmission(null)}>
           <DialogContent className="glass border-white/10">
@@ -0,0 +1,74 @@
+import server
+from server import AIRequest, AIRequestContext, AIResponseCache, build_ai_messages, normalize_prompt
+
+
+def make_cache():
+    return AIResponseCache(maxsize=16, ttl=60, similarity_threshold=0)
+
+
+def test_normalize_prompt_casefolds_and_collapses_whitespace():
+    assert normalize_prompt("  What IS\tphotosynthesis?\n") == "what is photosynthesis?"
+    assert normalize_prompt("STRASSE") == normalize_prompt("straße")
+
+
+def test_normalize_prompt_keeps_operators_and_non_ascii():
+    assert normalize_prompt("2+3") != normalize_prompt("2-3")
+    assert normalize_prompt("¿Qué es la fotosíntesis?") == "¿qué es la fotosíntesis?"
+    assert normalize_prompt("光合作用是什么") != ""
+
+
+def test_cache_distinguishes_prompts_that_differ_only_in_symbols():
+    cache = make_cache()
+    cache.set("class:1", "student", "m", "ctx", "2+3", "5")
+    assert cache.get("class:1", "student", "m", "ctx", "2 + 3") is None
+    assert cache.get("class:1", "student", "m", "ctx", "2-3") is None
+    assert cache.get("class:1", "student", "m", "ctx", " 2+3 ") == "5"
+
+
+def test_cache_distinguishes_non_ascii_prompts():
+    cache = make_cache()
+    cache.set("class:1", "student", "m", "ctx", "光合作用是什么", "a")
+    assert cache.get("class:1", "student", "m", "ctx", "细胞是什么") is None
+
+
+def test_cache_is_keyed_on_model_and_context():
+    cache = make_cache()
+    cache.set("class:1", "student", "m1", "ctx", "hello", "a")
+    assert cache.get("class:1", "student", "m2", "ctx", "hello") is None
+    assert cache.get("class:1", "student", "m1", "other", "hello") is None
+
+
+def test_cache_never_stores_or_serves_empty_prompts():
+    cache = make_cache()
+    cache.set("class:1", "student", "m", "ctx", "   ", "a")
+    assert cache.stats()["size"] == 0
+    assert cache.get("class:1", "student", "m", "ctx", "") is None
+
+
+def test_class_scoped_prompts_leave_out_the_student_name():
+    user = {"id": "u1", "role": "student", "full_name": "Ada Lovelace"}
+    shared = build_ai_messages(AIRequest(prompt="q"), user, AIRequestContext("ctx", "class:1"))
+    personal = build_ai_messages(AIRequest(prompt="q"), user, AIRequestContext("ctx", "user:u1"))
+    assert "Ada Lovelace" not in shared[-1]["content"]
+    assert "Ada Lovelace" in personal[-1]["content"]
+
+
+def test_similarity_tier_drops_embeddings_of_expired_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    cache = AIResponseCache(maxsize=16, ttl=60, similarity_threshold=0.5)
+    cache.set("class:1", "student", "m", "ctx", "what is photosynthesis", "a")
+    cache.set("class:2", "student", "m", "ctx", "what is osmosis", "b")
+    now[0] += 120
+    assert cache.get("class:1", "student", "m", "ctx", "what is photosynthesis?") is None
+    assert len(cache._neighbours) == 1
+    cache.set("class:3", "student", "m", "ctx", "what is mitosis", "c")
+    assert list(cache._neighbours) == [cache._bucket("class:3", "student", "m", "ctx")]
+
+
+def test_similarity_tier_follows_evictions():
+    cache = AIResponseCache(maxsize=2, ttl=60, similarity_threshold=0.5)
+    for n in range(10):
+        cache.set(f"class:{n}", "student", "m", "ctx", f"question number {n}", str(n))
+    assert sum(len(v) for v in cache._neighbours.values()) == 2
+    assert cache.get("class:9", "student", "m", "ctx", "question number 9?") == "9"
@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from server import BlobCollector, blob_store, preview_key
+
+SHA = "cd" + "1" * 62
+KEY = blob_store.key_for(SHA)
+
+
+class MemoryStorage:
+    """Object storage kept in a dict. Deletes can be held at ``gate`` to
+    play a collector whose storage calls are slow."""
+
+    def __init__(self):
+        self.objects = {}
+        self.gate = None
+        self.deleting = asyncio.Event()
+
+    async def save(self, key, source):
+        self.objects[key] = source.read_bytes()
+        source.unlink()
+
+    async def exists(self, key):
+        return key in self.objects
+
+    async def delete(self, key):
+        self.deleting.set()
+        if self.gate is not None:
+            await self.gate.wait()
+        self.objects.pop(key, None)
+
+    async def read(self, key):
+        return self.objects[key]
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["test_blobs"]
+    monkeypatch.setattr(server, "db", database)
+    storage = MemoryStorage()
+    monkeypatch.setattr(blob_store, "storage", storage)
+    asyncio.run(database.blobs.create_index("sha256", unique=True))
+    return storage
+
+
+def collector():
+    return BlobCollector(interval_seconds=0, batch_size=10, grace_seconds=0)
+
+
+def upload(tmp_path, data=b"content"):
+    temp = tmp_path / "upload.tmp"
+    temp.write_bytes(data)
+    return blob_store.commit(temp, SHA, len(data))
+
+
+async def released_blob(storage):
+    storage.objects[KEY] = b"content"
+    storage.objects[preview_key(SHA, 128)] = b"preview"
+    await server.db.blobs.insert_one({
+        "sha256": SHA, "refcount": 0, "size": 7, "preview_sizes": [128],
+        "released_at": server.datetime.now(server.timezone.utc) - server.timedelta(hours=1),
+    })
+
+
+def test_collector_frees_unreferenced_blobs(storage):
+    async def scenario():
+        await released_blob(storage)
+        result = await collector().sweep()
+        return result, await server.db.blobs.find_one({"sha256": SHA})
+
+    result, blob = asyncio.run(scenario())
+    assert result == {"freed": 1, "bytes_freed": 7}
+    assert blob is None
+    assert storage.objects == {}
+
+
+def test_upload_waits_for_the_collector_then_stores_fresh_bytes(storage, tmp_path):
+    async def scenario():
+        await released_blob(storage)
+        storage.gate = asyncio.Event()
+        sweep = asyncio.create_task(collector().sweep())
+        await storage.deleting.wait()
+        commit = asyncio.create_task(upload(tmp_path))
+        await asyncio.sleep(0.1)
+        assert not commit.done()
+        storage.gate.set()
+        await asyncio.gather(sweep, commit)
+        return await server.db.blobs.find_one({"sha256": SHA})
+
+    blob = asyncio.run(scenario())
+    assert blob["refcount"] == 1
+    assert storage.objects == {KEY: b"content"}
+
+
+def test_upload_gives_up_with_503_while_a_fresh_claim_is_held(storage, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "BLOB_COMMIT_WAIT_SECONDS", 0.2)
+
+    async def scenario():
+        await released_blob(storage)
+        storage.gate = asyncio.Event()
+        sweep = asyncio.create_task(collector().sweep())
+        await storage.deleting.wait()
+        with pytest.raises(server.HTTPException) as exc:
+            await upload(tmp_path)
+        storage.gate.set()
+        await sweep
+        return exc.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert not (tmp_path / "upload.tmp").exists()
+
+
+def test_slow_collector_does_not_delete_bytes_an_upload_took_over(storage, tmp_path, monkeypatch):
+    # Any claim counts as abandoned, so the upload takes the blob over
+    # while the collector is stuck deleting the preview
+    monkeypatch.setattr(server, "BLOB_REAP_STALE_SECONDS", 0)
+    slow = collector()
+
+    async def scenario():
+        await released_blob(storage)
+        storage.gate = asyncio.Event()
+        sweep = asyncio.create_task(slow.sweep())
+        await storage.deleting.wait()
+        await upload(tmp_path, b"content")
+        assert storage.objects[KEY] == b"content"
+        storage.gate.set()
+        result = await sweep
+        return result, await server.db.blobs.find_one({"sha256": SHA})
+
+    result, blob = asyncio.run(scenario())
+    assert result["freed"] == 0
+    assert slow.stats()["abandoned"] == 1
+    assert storage.objects == {KEY: b"content"}
+    assert blob["refcount"] == 1
+    assert "reaping" not in blob and "preview_sizes" not in blob
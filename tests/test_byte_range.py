@@ -0,0 +1,40 @@
+import pytest
+from fastapi import HTTPException
+
+from server import parse_byte_range
+
+
+def test_closed_range_is_inclusive():
+    assert parse_byte_range("bytes=0-99", 1000) == (0, 99)
+    assert parse_byte_range("bytes=500-500", 1000) == (500, 500)
+
+
+def test_open_ended_range_runs_to_the_last_byte():
+    assert parse_byte_range("bytes=900-", 1000) == (900, 999)
+
+
+def test_suffix_range_counts_from_the_end():
+    assert parse_byte_range("bytes=-100", 1000) == (900, 999)
+    assert parse_byte_range("bytes=-5000", 1000) == (0, 999)
+
+
+def test_end_past_the_file_is_clamped():
+    assert parse_byte_range("bytes=990-2000", 1000) == (990, 999)
+
+
+@pytest.mark.parametrize("header", [None, "", "items=0-1", "bytes=0-1,5-9", "bytes=a-b", "bytes=-", "bytes=1-x"])
+def test_missing_malformed_or_multi_range_serves_the_whole_file(header):
+    assert parse_byte_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=2000-3000", "bytes=50-10", "bytes=-0"])
+def test_unsatisfiable_range_is_416(header):
+    with pytest.raises(HTTPException) as exc:
+        parse_byte_range(header, 1000)
+    assert exc.value.status_code == 416
+    assert exc.value.headers["Content-Range"] == "bytes */1000"
+
+
+def test_any_range_on_an_empty_file_is_416():
+    with pytest.raises(HTTPException):
+        parse_byte_range("bytes=0-", 0)
@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta, timezone
+
+import jwt
+
+from server import JWT_ALGORITHM, JWT_SECRET, create_feed_token, parse_due_date, render_ics
+
+
+def test_parse_due_date_bare_date_is_end_of_day_utc():
+    assert parse_due_date("2026-11-01") == datetime(2026, 11, 1, 23, 59, 59, tzinfo=timezone.utc)
+
+
+def test_parse_due_date_naive_datetime_is_utc():
+    assert parse_due_date("2026-11-01T10:00:00") == datetime(2026, 11, 1, 10, tzinfo=timezone.utc)
+
+
+def test_parse_due_date_converts_offsets_to_utc():
+    assert parse_due_date("2026-11-01T10:00:00+02:00") == datetime(2026, 11, 1, 8, tzinfo=timezone.utc)
+    assert parse_due_date("2026-11-01T10:00:00Z") == datetime(2026, 11, 1, 10, tzinfo=timezone.utc)
+
+
+def test_parse_due_date_rejects_garbage():
+    assert parse_due_date("") is None
+    assert parse_due_date(None) is None
+    assert parse_due_date("next tuesday") is None
+    assert parse_due_date("2026-13-01") is None
+
+
+def test_feed_token_carries_feed_version():
+    token = create_feed_token({"id": "u1", "feed_version": 3})
+    payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    assert payload == {"user_id": "u1", "scope": "calendar", "v": 3}
+    legacy = jwt.decode(create_feed_token({"id": "u1"}), JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    assert legacy["v"] == 0
+
+
+def test_render_ics_escapes_text_and_uses_crlf():
+    due = datetime(2026, 11, 1, 10, tzinfo=timezone.utc)
+    body = render_ics(
+        [{"id": "a1", "title": "Essay; part 1, draft", "due_at": due, "class_name": "Bio"}],
+        due - timedelta(days=1),
+    )
+    assert body.endswith("END:VCALENDAR\r\n")
+    assert r"SUMMARY:Essay\; part 1\, draft" + "\r\n" in body
+    assert "DTSTART:20261101T100000Z\r\n" in body
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from fastapi import Response
+
+import server
+from server import (
+    ChatMessage, LegacyChat, backfill_conversations, get_conversations, get_messages, send_message,
+)
+
+ANA = {"id": "ana", "role": "student", "full_name": "Ana"}
+BEN = {"id": "ben", "role": "student", "full_name": "Ben"}
+CAL = {"id": "cal", "role": "student", "full_name": "Cal"}
+TEACHER = {"id": "tina", "role": "teacher", "full_name": "Tina"}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["test_chat"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "legacy_chat", LegacyChat())
+
+    async def publish(user_ids, event):
+        pass
+
+    monkeypatch.setattr(server.push_hub, "publish", publish)
+
+    async def seed():
+        await database.users.insert_many([dict(u) for u in (ANA, BEN, CAL, TEACHER)])
+        await database.classes.insert_one({"id": "c1", "name": "Biology", "teacher_id": TEACHER["id"], "students": ["ana", "ben"]})
+
+    asyncio.run(seed())
+    return database
+
+
+def legacy_dm(n, sender, receiver, read=True):
+    return {
+        "id": f"old{n}", "sender_id": sender["id"], "receiver_id": receiver["id"], "class_id": None,
+        "content": f"old {n}", "created_at": f"2025-01-0{n}T00:00:00+00:00", "read": read,
+    }
+
+
+def read_all(user, limit, **params):
+    """Every message of a conversation, paging back through X-Next-Cursor."""
+    async def scenario():
+        pages, before = [], None
+        while True:
+            response = Response()
+            page = await get_messages(response, before=before, limit=limit, current_user=user, **params)
+            pages.insert(0, [m["content"] for m in page])
+            before = response.headers.get(server.NEXT_CURSOR_HEADER)
+            if not before:
+                return sum(pages, [])
+
+    return asyncio.run(scenario())
+
+
+def test_unmigrated_dm_history_stays_visible_after_new_messages(db):
+    asyncio.run(db.chat_messages.insert_many([legacy_dm(n, ANA, BEN) for n in range(1, 4)]))
+    for text in ("new 1", "new 2"):
+        asyncio.run(send_message(ChatMessage(receiver_id=BEN["id"], content=text), ANA))
+    expected = ["old 1", "old 2", "old 3", "new 1", "new 2"]
+    for limit in (1, 2, 3, 10):
+        assert read_all(BEN, limit, receiver_id=ANA["id"]) == expected
+
+
+def test_backfilled_history_reads_the_same(db):
+    asyncio.run(db.chat_messages.insert_many([legacy_dm(n, ANA, BEN) for n in range(1, 3)]))
+    asyncio.run(send_message(ChatMessage(receiver_id=BEN["id"], content="new 1"), ANA))
+    asyncio.run(backfill_conversations())
+    server.legacy_chat = LegacyChat()
+    assert read_all(BEN, 2, receiver_id=ANA["id"]) == ["old 1", "old 2", "new 1"]
+
+
+def test_sidebar_lists_migrated_and_unmigrated_partners(db):
+    asyncio.run(db.chat_messages.insert_many([
+        legacy_dm(1, BEN, ANA, read=False),
+        legacy_dm(2, CAL, ANA, read=False),
+        legacy_dm(3, CAL, ANA, read=False),
+    ]))
+    asyncio.run(send_message(ChatMessage(receiver_id=ANA["id"], content="hi again"), BEN))
+    entries = asyncio.run(get_conversations(ANA))
+    by_partner = {e["user"]["id"]: e for e in entries if "user" in e}
+    assert set(by_partner) == {"ben", "cal"}
+    assert by_partner["ben"]["last_message"] == "hi again"
+    assert by_partner["ben"]["unread"] == 2
+    assert by_partner["cal"]["unread"] == 2
+
+
+def test_backfill_marks_class_history_read_for_every_member(db):
+    asyncio.run(db.chat_messages.insert_many([
+        {"id": f"c{n}", "sender_id": TEACHER["id"], "receiver_id": None, "class_id": "c1",
+         "content": f"class {n}", "created_at": f"2025-01-0{n}T00:00:00+00:00"}
+        for n in range(1, 4)
+    ]))
+    asyncio.run(backfill_conversations())
+    conversation = asyncio.run(db.conversations.find_one({"id": "class:c1"}))
+    assert conversation["last_seq"] == 3
+    assert conversation["read_seq"] == {"tina": 3, "ana": 3, "ben": 3}
+    classes = [e for e in asyncio.run(get_conversations(BEN)) if "class" in e]
+    assert [(e["class"]["id"], e["unread"]) for e in classes] == [("c1", 0)]
@@ -0,0 +1,155 @@
+import asyncio
+
+import mongomock.aggregate
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from server import DenormalizedFieldPropagator, reconcile_denormalized_fields
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["test_denormalized"]
+    monkeypatch.setattr(server, "db", database)
+
+    async def seed():
+        await database.users.insert_many([
+            {"id": "t1", "full_name": "Tina New"},
+            {"id": "s1", "full_name": "Sam"},
+        ])
+        await database.classes.insert_one({"id": "c1", "name": "Biology II", "teacher_id": "t1", "teacher_name": "Tina Old"})
+        await database.assignments.insert_many([
+            {"id": f"a{n}", "class_id": "c1", "class_name": "Biology"} for n in range(3)
+        ])
+        await database.announcements.insert_one(
+            {"id": "n1", "class_id": "c1", "class_name": "Biology", "author_id": "t1", "author_name": "Tina Old"}
+        )
+        await database.submissions.insert_one({"id": "x1", "student_id": "s1", "student_name": "Sam"})
+
+    asyncio.run(seed())
+    return database
+
+
+def propagator(**overrides):
+    options = dict(batch_size=2, batch_pause=0, settle_seconds=0, stale_after=60, max_attempts=3, retry_seconds=0.01)
+    return DenormalizedFieldPropagator(**{**options, **overrides})
+
+
+async def copies(db):
+    cls = await db.classes.find_one({"id": "c1"})
+    announcement = await db.announcements.find_one({"id": "n1"})
+    assignments = {a["class_name"] async for a in db.assignments.find()}
+    return cls["teacher_name"], announcement["author_name"], announcement["class_name"], assignments
+
+
+async def wait_for_job(db, job_id, status):
+    for _ in range(200):
+        job = await db.propagation_jobs.find_one({"id": job_id})
+        if job["status"] == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} stuck in {job['status']}")
+
+
+def test_rename_rewrites_every_copy(db):
+    worker = propagator()
+
+    async def scenario():
+        [user_job] = await worker.changed("users", "t1", {"full_name": "Tina New"})
+        [class_job] = await worker.changed("classes", "c1", {"name": "Biology II", "subject": "ignored"})
+        await worker.run_job(user_job)
+        await worker.run_job(class_job)
+        return await copies(db), await db.propagation_jobs.find_one({"id": class_job})
+
+    result, job = asyncio.run(scenario())
+    assert result == ("Tina New", "Tina New", "Biology II", {"Biology II"})
+    assert job["status"] == "done"
+    assert job["updated"] == 4
+    assert worker.stats()["jobs_completed"] == 2
+
+
+def test_failed_job_is_retried_and_finishes(db):
+    worker = propagator()
+    real_propagate = worker.propagate
+    calls = []
+
+    async def flaky(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("primary stepped down")
+        return await real_propagate(*args, **kwargs)
+
+    worker.propagate = flaky
+
+    async def scenario():
+        await worker.start()
+        try:
+            [job_id] = await worker.changed("classes", "c1", {"name": "Biology II"})
+            job = await wait_for_job(db, job_id, "done")
+        finally:
+            await worker.stop()
+        return job, await copies(db)
+
+    job, result = asyncio.run(scenario())
+    assert job["attempts"] == 1
+    assert job["error"] == "primary stepped down"
+    assert result[2:] == ("Biology II", {"Biology II"})
+    assert worker.stats()["jobs_retried"] == 1
+    assert worker.stats()["jobs_failed"] == 0
+
+
+def test_job_is_marked_failed_after_max_attempts(db):
+    worker = propagator(max_attempts=2)
+
+    async def broken(*args, **kwargs):
+        raise RuntimeError("still down")
+
+    worker.propagate = broken
+
+    async def scenario():
+        await worker.start()
+        try:
+            [job_id] = await worker.changed("users", "t1", {"full_name": "Tina New"})
+            return await wait_for_job(db, job_id, "failed")
+        finally:
+            await worker.stop()
+
+    job = asyncio.run(scenario())
+    assert job["attempts"] == 2
+    assert worker.stats()["jobs_retried"] == 1
+    assert worker.stats()["jobs_failed"] == 1
+
+
+def lookup_with_pipeline(in_collection, database, options):
+    """mongomock implements $lookup only with localField/foreignField; this
+    adds the let/pipeline form reconcile_denormalized_fields uses."""
+    def bind(value, variables):
+        if isinstance(value, str) and value.startswith("$$"):
+            return variables[value[2:]]
+        if isinstance(value, dict):
+            return {k: bind(v, variables) for k, v in value.items()}
+        if isinstance(value, list):
+            return [bind(v, variables) for v in value]
+        return value
+
+    foreign = database.get_collection(options["from"])
+    for doc in in_collection:
+        variables = {name: doc.get(expr[1:]) for name, expr in options["let"].items()}
+        pipeline = [{"$match": {options["foreignField"]: doc.get(options["localField"])}}]
+        doc[options["as"]] = list(foreign.aggregate(pipeline + bind(options["pipeline"], variables)))
+    return in_collection
+
+
+def test_reconcile_rewrites_copies_that_drifted(db, monkeypatch):
+    monkeypatch.setitem(mongomock.aggregate._PIPELINE_HANDLERS, "$lookup", lookup_with_pipeline)
+    result = asyncio.run(reconcile_denormalized_fields())
+    assert result["updated"] == {
+        "classes.teacher_name": 1,
+        "announcements.author_name": 1,
+        "assignments.class_name": 3,
+        "announcements.class_name": 1,
+    }
+    assert asyncio.run(copies(db)) == ("Tina New", "Tina New", "Biology II", {"Biology II"})
+    assert asyncio.run(reconcile_denormalized_fields())["updated"] == {}
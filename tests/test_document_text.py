@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+import server
+from server import load_document_context, split_page, store_document_text
+
+
+def test_short_text_is_one_section():
+    assert split_page("a short page", 50) == ["a short page"]
+
+
+def test_empty_page_has_no_sections():
+    assert split_page("", 50) == []
+
+
+def test_splits_on_the_last_space_before_the_limit():
+    assert split_page("aaaa bbbb cccc dddd", 10) == ["aaaa bbbb", "cccc dddd"]
+
+
+def test_sections_never_exceed_the_limit():
+    text = " ".join(f"word{n}" for n in range(500))
+    sections = split_page(text, 64)
+    assert all(0 < len(s) <= 64 for s in sections)
+    assert " ".join(sections) == text
+
+
+def test_unbroken_text_is_cut_hard():
+    assert split_page("x" * 25, 10) == ["x" * 10, "x" * 10, "x" * 5]
+
+
+@pytest.fixture
+def db(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    database = mongomock_motor.AsyncMongoMockClient()["test_document_text"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+def test_stored_chunks_are_read_back_in_order(db):
+    long_page = " ".join(f"word{n}" for n in range(server.CHUNK_MAX_CHARS // 4))
+    pages = [long_page, "", "page three"]
+
+    async def scenario():
+        await db.files.insert_one({"id": "f1", "text_content": "legacy"})
+        await store_document_text("f1", pages)
+        file_doc = await db.files.find_one({"id": "f1"}, {"_id": 0})
+        chunks = await db.file_chunks.find({"file_id": "f1"}, {"_id": 0}).sort("seq", 1).to_list(None)
+        return file_doc, chunks, await load_document_context(file_doc, 1000)
+
+    file_doc, chunks, context = asyncio.run(scenario())
+    assert "text_content" not in file_doc
+    assert file_doc["chunk_count"] == len(chunks)
+    assert [c["page"] for c in chunks] == [1, 1, 3]
+    assert all(c["length"] <= server.CHUNK_MAX_CHARS for c in chunks)
+    assert " ".join(c["text"] for c in chunks) == long_page + " page three"
+    assert context == long_page[:1000]
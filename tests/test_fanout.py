@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from server import GradeSubmission, NotificationFanout, grade_submission
+
+TEACHER = {"id": "t1", "role": "teacher"}
+
+
+@pytest.fixture
+def pushed(monkeypatch):
+    pushed = []
+
+    async def publish_many(items):
+        pushed.extend(items)
+
+    async def publish(user_ids, event):
+        pushed.append((user_ids, event))
+
+    monkeypatch.setattr(server.push_hub, "publish_many", publish_many)
+    monkeypatch.setattr(server.push_hub, "publish", publish)
+    return pushed
+
+
+@pytest.fixture
+def db(monkeypatch, pushed):
+    database = mongomock_motor.AsyncMongoMockClient()["test_fanout"]
+    monkeypatch.setattr(server, "db", database)
+    asyncio.run(database.notifications.create_index("id", unique=True))
+    return database
+
+
+def unread(db, user_id):
+    counter = asyncio.run(db.notification_counters.find_one({"user_id": user_id}))
+    return counter["unread"] if counter else 0
+
+
+def test_replayed_fanout_delivers_once(db, pushed):
+    fanout = NotificationFanout(batch_size=2, background=False)
+    job = (["u1", "u2", "u3", "u1"], "New assignment", "Cells", "assignment", "assignment:a1")
+
+    asyncio.run(fanout.publish(*job))
+    asyncio.run(fanout.publish(*job))
+
+    assert asyncio.run(db.notifications.count_documents({})) == 3
+    assert [unread(db, u) for u in ("u1", "u2", "u3")] == [1, 1, 1]
+    assert fanout.stats()["delivered"] == 3
+    assert fanout.stats()["duplicates"] == 3
+    notifications = [item for item in pushed if item[1]["type"] == "notification"]
+    assert len(notifications) == 3
+
+
+def test_every_grading_notifies_even_with_the_same_grade(db):
+    asyncio.run(db.submissions.insert_one(
+        {"id": "s1", "assignment_id": "a1", "class_id": "c1", "student_id": "stu", "student_name": "Stu", "grade": None}
+    ))
+    for grade in (80, 90, 80):
+        asyncio.run(grade_submission(GradeSubmission(submission_id="s1", grade=grade, remarks=""), TEACHER))
+
+    notifications = asyncio.run(db.notifications.find({"user_id": "stu"}).to_list(None))
+    assert len({n["id"] for n in notifications}) == 3
+    assert sorted(n["content"] for n in notifications) == [
+        "You received 80 points", "You received 80 points", "You received 90 points",
+    ]
+    assert unread(db, "stu") == 3
+    assert asyncio.run(db.submissions.find_one({"id": "s1"}))["graded_version"] == 3
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from server import FolderCreate, FolderMove, create_folder, delete_folder, move_folder
+
+TEACHER = {"id": "t1", "role": "teacher"}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["test_folders"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+async def make_tree():
+    root = await create_folder(FolderCreate(name="root"), TEACHER)
+    other = await create_folder(FolderCreate(name="other"), TEACHER)
+    child = await create_folder(FolderCreate(name="child", parent_id=root["id"]), TEACHER)
+    leaf = await create_folder(FolderCreate(name="leaf", parent_id=child["id"]), TEACHER)
+    return root, other, child, leaf
+
+
+async def ancestors_of(db, folder_id):
+    return (await db.folders.find_one({"id": folder_id}))["ancestors"]
+
+
+def test_move_folder_rewrites_descendant_ancestors(db):
+    async def scenario():
+        root, other, child, leaf = await make_tree()
+        await move_folder(child["id"], FolderMove(parent_id=other["id"]), TEACHER)
+        assert await ancestors_of(db, child["id"]) == [other["id"]]
+        assert await ancestors_of(db, leaf["id"]) == [other["id"], child["id"]]
+
+    asyncio.run(scenario())
+
+
+def test_move_folder_to_top_level_drops_old_prefix(db):
+    async def scenario():
+        root, other, child, leaf = await make_tree()
+        await move_folder(child["id"], FolderMove(), TEACHER)
+        assert await ancestors_of(db, child["id"]) == []
+        assert await ancestors_of(db, leaf["id"]) == [child["id"]]
+
+    asyncio.run(scenario())
+
+
+def test_move_folder_into_own_subtree_is_rejected(db):
+    async def scenario():
+        root, other, child, leaf = await make_tree()
+        with pytest.raises(server.HTTPException) as exc:
+            await move_folder(root["id"], FolderMove(parent_id=leaf["id"]), TEACHER)
+        assert exc.value.status_code == 400
+        assert await ancestors_of(db, leaf["id"]) == [root["id"], child["id"]]
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_folder_deletes_release_a_shared_blob_once(db, monkeypatch):
+    real_subtree = server.subtree_folder_ids
+    both_listed = asyncio.Barrier(2)
+
+    async def subtree_after_both_look(folder_id):
+        ids = await real_subtree(folder_id)
+        await both_listed.wait()
+        return ids
+
+    monkeypatch.setattr(server, "subtree_folder_ids", subtree_after_both_look)
+
+    async def scenario():
+        root, other, child, leaf = await make_tree()
+        # Another user's file shares the blob, holding the third reference
+        await db.blobs.insert_one({"sha256": "s1", "refcount": 3})
+        await db.files.insert_many([
+            {"id": "f1", "folder_id": leaf["id"], "owner_id": TEACHER["id"], "storage": "blob", "sha256": "s1"},
+            {"id": "f2", "folder_id": other["id"], "owner_id": TEACHER["id"], "storage": "blob", "sha256": "s1"},
+            {"id": "f3", "folder_id": None, "owner_id": "u2", "storage": "blob", "sha256": "s1"},
+        ])
+        results = await asyncio.gather(
+            delete_folder(root["id"], TEACHER), delete_folder(root["id"], TEACHER)
+        )
+        blob = await db.blobs.find_one({"sha256": "s1"})
+        return results, blob
+
+    results, blob = asyncio.run(scenario())
+    assert sorted(r["files"] for r in results) == [0, 1]
+    assert blob["refcount"] == 2
+    assert "released_at" not in blob
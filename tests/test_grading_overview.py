@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from fastapi import Response
+
+import server
+from server import NEXT_CURSOR_HEADER, get_grading_overview
+
+TEACHER = {"id": "tina", "role": "teacher"}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["test_grading_overview"]
+    monkeypatch.setattr(server, "db", database)
+
+    async def seed():
+        await database.classes.insert_many([
+            {"id": "c1", "name": "Biology", "teacher_id": "tina"},
+            {"id": "c2", "name": "Other", "teacher_id": "tom"},
+        ])
+        await database.assignments.insert_many([
+            {"id": "a1", "class_id": "c1", "title": "Cells", "max_points": 100},
+            {"id": "a2", "class_id": "c2", "title": "Not mine", "max_points": 100},
+        ])
+        await database.submissions.insert_many([
+            {"id": f"s{n}", "assignment_id": "a1", "student_name": f"S{n}",
+             "grade": 90 if n % 2 else None, "submitted_at": f"2026-10-0{n}T00:00:00+00:00"}
+            for n in range(1, 6)
+        ] + [{"id": "x1", "assignment_id": "a2", "student_name": "X", "grade": None, "submitted_at": "2026-10-09"}])
+
+    asyncio.run(seed())
+    return database
+
+
+def test_grading_overview_pages_submissions_newest_first(db):
+    async def scenario():
+        pages, cursor = [], None
+        while True:
+            response = Response()
+            overview = await get_grading_overview(response, limit=2, cursor=cursor, current_user=TEACHER)
+            pages.append([s["id"] for s in overview["submissions"]])
+            assert overview["counts"] == {"pending": 2, "graded": 3}
+            cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if not cursor:
+                return pages
+
+    assert asyncio.run(scenario()) == [["s5", "s4"], ["s3", "s2"], ["s1"]]
+
+
+def test_grading_overview_is_teacher_only(db):
+    with pytest.raises(server.HTTPException) as exc:
+        asyncio.run(get_grading_overview(Response(), limit=2, cursor=None, current_user={"id": "s", "role": "student"}))
+    assert exc.value.status_code == 403
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from server import GLOBAL_SCOPE, apply_leaderboard_delta, rebuild_leaderboard
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["test_leaderboard"]
+    monkeypatch.setattr(server, "db", database)
+
+    async def seed():
+        await database.leaderboard.create_index([("scope", 1), ("student_id", 1)], unique=True)
+        await database.assignments.insert_many([{"id": "a1", "class_id": "c1"}, {"id": "a2", "class_id": "c1"}])
+        await database.submissions.insert_many([
+            {"id": "s1", "assignment_id": "a1", "student_id": "ana", "student_name": "Ana", "grade": 80},
+            {"id": "s2", "assignment_id": "a2", "student_id": "ana", "student_name": "Ana", "grade": 60},
+            {"id": "s3", "assignment_id": "a1", "student_id": "ben", "student_name": "Ben", "grade": 90},
+            {"id": "s4", "assignment_id": "a2", "student_id": "ben", "student_name": "Ben", "grade": None},
+        ])
+
+    asyncio.run(seed())
+    return database
+
+
+def rows(db):
+    docs = asyncio.run(db.leaderboard.find({}, {"_id": 0}).to_list(None))
+    return {(d["scope"], d["student_id"]): (d["total_points"], d["graded_count"]) for d in docs}
+
+
+def test_rebuild_recomputes_rows_and_drops_stale_ones(db):
+    asyncio.run(db.leaderboard.insert_many([
+        {"scope": "c1", "student_id": "ana", "total_points": 999, "graded_count": 9},
+        {"scope": "c9", "student_id": "gone", "total_points": 1, "graded_count": 1},
+    ]))
+    result = asyncio.run(rebuild_leaderboard())
+    assert result["removed"] == 1
+    assert rows(db) == {
+        ("c1", "ana"): (140, 2), (GLOBAL_SCOPE, "ana"): (140, 2),
+        ("c1", "ben"): (90, 1), (GLOBAL_SCOPE, "ben"): (90, 1),
+    }
+
+
+def test_rebuild_keeps_increments_made_while_it_runs(db, monkeypatch):
+    asyncio.run(rebuild_leaderboard())
+    real_write = server.write_rebuilt_leaderboard
+    graded = []
+
+    async def grade_lands_mid_rebuild(batch):
+        if not graded:
+            # Ben's second assignment is graded after the rebuild read the
+            # submissions but before it wrote his rows
+            await db.submissions.update_one({"id": "s4"}, {"$set": {"grade": 70}})
+            for scope in ("c1", GLOBAL_SCOPE):
+                await apply_leaderboard_delta(scope, "ben", "Ben", 70, 1)
+            graded.append(True)
+        return await real_write(batch)
+
+    monkeypatch.setattr(server, "write_rebuilt_leaderboard", grade_lands_mid_rebuild)
+    result = asyncio.run(rebuild_leaderboard())
+    assert result["kept"] == 2
+    assert rows(db)[("c1", "ben")] == (160, 2)
+    assert rows(db)[(GLOBAL_SCOPE, "ben")] == (160, 2)
+    assert rows(db)[("c1", "ana")] == (140, 2)
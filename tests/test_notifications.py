@@ -0,0 +1,106 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from server import NOTIFICATION_RETENTION_DAYS, NotificationRetention, rebuild_notification_counters
+
+NOW = datetime.now(timezone.utc)
+EXPIRED = NOW - timedelta(days=1)
+LATER = NOW + timedelta(days=30)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["test_notifications"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+def notification(n, user_id="u1", read=False, expires_at=EXPIRED, created_at="2026-09-01T00:00:00+00:00", **extra):
+    return {"id": f"n{n}", "user_id": user_id, "read": read, "created_at": created_at, "expires_at": expires_at, **extra}
+
+
+def counter(db, user_id="u1"):
+    return asyncio.run(db.notification_counters.find_one({"user_id": user_id}))["unread"]
+
+
+def retention():
+    return NotificationRetention(interval_seconds=0, batch_size=2)
+
+
+def test_sweep_deletes_expired_and_takes_unread_off_the_counter(db):
+    asyncio.run(db.notifications.insert_many([
+        notification(1), notification(2), notification(3, read=True),
+        notification(4, expires_at=LATER), notification(5, user_id="u2"),
+    ]))
+    asyncio.run(db.notification_counters.insert_many([
+        {"user_id": "u1", "unread": 3, "read_all_at": ""},
+        {"user_id": "u2", "unread": 1, "read_all_at": ""},
+    ]))
+    result = asyncio.run(retention().sweep())
+    assert result == {"deleted": 4, "unread_expired": 3}
+    assert [n["id"] for n in asyncio.run(db.notifications.find().to_list(None))] == ["n4"]
+    assert counter(db) == 1
+    assert counter(db, "u2") == 0
+
+
+def test_sweep_ignores_notifications_already_cleared_by_read_all(db):
+    asyncio.run(db.notifications.insert_many([
+        notification(1, created_at="2026-08-01T00:00:00+00:00"),
+        notification(2, created_at="2026-09-15T00:00:00+00:00"),
+    ]))
+    asyncio.run(db.notification_counters.insert_one(
+        {"user_id": "u1", "unread": 1, "read_all_at": "2026-09-01T00:00:00+00:00"}
+    ))
+    assert asyncio.run(retention().sweep())["unread_expired"] == 1
+    assert counter(db) == 0
+
+
+def test_repeated_and_overlapping_sweeps_count_each_notification_once(db):
+    asyncio.run(db.notifications.insert_many([notification(n) for n in range(5)]))
+    asyncio.run(db.notification_counters.insert_one({"user_id": "u1", "unread": 7, "read_all_at": ""}))
+
+    async def scenario():
+        first, second = await asyncio.gather(retention().sweep(), retention().sweep())
+        third = await retention().sweep()
+        return first["unread_expired"] + second["unread_expired"] + third["unread_expired"]
+
+    assert asyncio.run(scenario()) == 5
+    assert counter(db) == 2
+
+
+def test_claims_of_a_dead_sweeper_are_retaken(db):
+    asyncio.run(db.notifications.insert_many([
+        notification(1, sweep_id="dead", swept_at=NOW - timedelta(hours=1)),
+        notification(2, sweep_id="live", swept_at=NOW),
+    ]))
+    asyncio.run(db.notification_counters.insert_one({"user_id": "u1", "unread": 2, "read_all_at": ""}))
+    assert asyncio.run(retention().sweep()) == {"deleted": 1, "unread_expired": 1}
+    assert [n["id"] for n in asyncio.run(db.notifications.find().to_list(None))] == ["n2"]
+    assert counter(db) == 1
+
+
+def test_rebuild_counters_recomputes_unread_and_fills_expires_at(db):
+    legacy = notification(1, created_at="2026-09-10T00:00:00")
+    del legacy["expires_at"]
+    asyncio.run(db.notifications.insert_many([
+        legacy,
+        notification(2, created_at="2026-08-01T00:00:00+00:00"),
+        notification(3, read=True),
+        notification(4, user_id="u2"),
+    ]))
+    asyncio.run(db.notification_counters.insert_many([
+        {"user_id": "u1", "unread": 40, "read_all_at": "2026-09-01T00:00:00+00:00"},
+        {"user_id": "u3", "unread": 5, "read_all_at": ""},
+    ]))
+    result = asyncio.run(rebuild_notification_counters())
+    assert result == {"expires_at_set": 1, "counters": 3}
+    filled = asyncio.run(db.notifications.find_one({"id": "n1"}))["expires_at"]
+    expected = datetime(2026, 9, 10) + timedelta(days=NOTIFICATION_RETENTION_DAYS)
+    assert filled.replace(tzinfo=None) == expected
+    assert (counter(db), counter(db, "u2"), counter(db, "u3")) == (1, 1, 0)
+    assert asyncio.run(db.notification_counters.find_one({"user_id": "u2"}))["read_all_at"] == ""
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException, Response
+
+from server import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor, keyset_page
+
+# Scores repeat so the id tie-breaker decides the order inside a group
+DOCS = [{"id": f"i{n:02d}", "score": n % 3} for n in range(10)]
+
+
+def test_cursor_round_trips():
+    values = ["2026-10-01T12:00:00+00:00", 3, None, "id-é"]
+    cursor = encode_cursor(values)
+    assert "=" not in cursor
+    assert decode_cursor(cursor, len(values)) == values
+
+
+@pytest.mark.parametrize("cursor", ["!!!", "bm90IGpzb24", encode_cursor({"a": 1}), encode_cursor(["x"])])
+def test_invalid_cursor_is_400(cursor):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(cursor, 2)
+    assert exc.value.status_code == 400
+
+
+@pytest.fixture
+def collection():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    collection = mongomock_motor.AsyncMongoMockClient()["test_pagination"]["items"]
+    asyncio.run(collection.insert_many([dict(d) for d in DOCS]))
+    return collection
+
+
+def walk(collection, sort, limit):
+    async def scenario():
+        pages, cursor = [], None
+        while True:
+            response = Response()
+            docs = await keyset_page(collection, {}, {"_id": 0}, sort, limit, cursor, response)
+            pages.append([d["id"] for d in docs])
+            cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if not cursor:
+                return pages
+
+    return asyncio.run(scenario())
+
+
+def test_pages_cover_every_document_once_in_sort_order(collection):
+    sort = [("score", -1), ("id", 1)]
+    expected = [d["id"] for d in sorted(DOCS, key=lambda d: (-d["score"], d["id"]))]
+    pages = walk(collection, sort, 3)
+    assert [len(p) for p in pages] == [3, 3, 3, 1]
+    assert sum(pages, []) == expected
+
+
+def test_last_full_page_has_no_cursor(collection):
+    pages = walk(collection, [("id", 1)], 5)
+    assert [len(p) for p in pages] == [5, 5]
+
+
+def test_filter_applies_to_every_page(collection):
+    async def scenario():
+        response = Response()
+        first = await keyset_page(collection, {"score": 0}, {"_id": 0}, [("id", 1)], 2, None, response)
+        rest = await keyset_page(
+            collection, {"score": 0}, {"_id": 0}, [("id", 1)], 2, response.headers[NEXT_CURSOR_HEADER], Response()
+        )
+        return [d["id"] for d in first + rest]
+
+    assert asyncio.run(scenario()) == ["i00", "i03", "i06", "i09"]
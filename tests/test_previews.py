@@ -0,0 +1,103 @@
+import asyncio
+import io
+
+import pytest
+from PIL import Image
+from PyPDF2 import PdfWriter
+from starlette.requests import Request
+
+import server
+from server import PREVIEW_SIZES, LocalStorage, get_file_preview, preview_key, render_previews
+
+SHA = "ab" + "0" * 62
+OWNER = {"id": "u1", "role": "student"}
+
+
+def dimensions(data):
+    image = Image.open(io.BytesIO(data))
+    assert image.format == "WEBP"
+    return image.size
+
+
+def test_render_previews_bounds_each_size(tmp_path):
+    path = tmp_path / "photo.png"
+    Image.new("RGB", (800, 400), "red").save(path)
+    renders = render_previews(str(path), "image", (128, 512), 80)
+    assert dimensions(renders[128]) == (128, 64)
+    assert dimensions(renders[512]) == (512, 256)
+
+
+def test_render_previews_never_upscales(tmp_path):
+    path = tmp_path / "icon.png"
+    Image.new("RGBA", (100, 50)).save(path)
+    renders = render_previews(str(path), "image", (256,), 80)
+    assert dimensions(renders[256]) == (100, 50)
+
+
+def test_render_previews_uses_the_image_embedded_in_a_pdf(tmp_path):
+    path = tmp_path / "scan.pdf"
+    Image.new("RGB", (600, 300), "blue").save(path, "PDF")
+    renders = render_previews(str(path), "pdf", (128,), 80)
+    assert dimensions(renders[128]) == (128, 64)
+
+
+def test_render_previews_pdf_without_images_is_empty(tmp_path):
+    path = tmp_path / "blank.pdf"
+    writer = PdfWriter()
+    writer.add_blank_page(width=200, height=200)
+    with open(path, "wb") as f:
+        writer.write(f)
+    assert render_previews(str(path), "pdf", (128,), 80) == {}
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    database = mongomock_motor.AsyncMongoMockClient()["test_previews"]
+    monkeypatch.setattr(server, "db", database)
+    storage = LocalStorage(tmp_path)
+    monkeypatch.setattr(server.blob_store, "storage", storage)
+    for size in PREVIEW_SIZES:
+        path = tmp_path / preview_key(SHA, size)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(f"preview-{size}".encode())
+
+    async def seed():
+        await database.files.insert_one({"id": "f1", "owner_id": OWNER["id"], "sha256": SHA, "storage": "blob"})
+        await database.blobs.insert_one({"sha256": SHA, "preview_status": "ready", "preview_sizes": list(PREVIEW_SIZES)})
+
+    asyncio.run(seed())
+    return database
+
+
+def request(headers=None):
+    raw = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "headers": raw})
+
+
+def fetch(size, headers=None):
+    return asyncio.run(get_file_preview("f1", request(headers), size, OWNER))
+
+
+@pytest.mark.parametrize("size, bucket", [(1, 128), (128, 128), (129, 256), (300, 512), (4000, 512)])
+def test_preview_serves_the_smallest_bucket_covering_the_size(db, size, bucket):
+    response = fetch(size)
+    assert response.status_code == 200
+    assert response.body == f"preview-{bucket}".encode()
+    assert response.headers["etag"] == f'"{SHA}-{bucket}"'
+    assert "immutable" in response.headers["cache-control"]
+
+
+def test_preview_returns_304_for_a_matching_etag(db):
+    response = fetch(256, {"If-None-Match": f'"other", "{SHA}-256"'})
+    assert response.status_code == 304
+    assert response.body == b""
+    assert fetch(256, {"If-None-Match": f'"{SHA}-128"'}).status_code == 200
+
+
+def test_preview_missing_size_is_not_cached(db):
+    asyncio.run(db.blobs.update_one({"sha256": SHA}, {"$set": {"preview_sizes": [128]}}))
+    with pytest.raises(server.HTTPException) as exc:
+        fetch(256)
+    assert exc.value.status_code == 404
+    assert exc.value.headers["Cache-Control"] == "no-store"
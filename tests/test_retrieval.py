@@ -0,0 +1,71 @@
+import numpy as np
+
+import server
+from server import DocumentIndex, chunk_retrieval_fields, hashed_embedding
+
+TEXTS = [
+    "photosynthesis converts light energy in the chloroplast",
+    "cells divide by mitosis and the cell cycle has phases",
+    "the chloroplast and the mitochondria are organelles of the cell",
+    "osmosis moves water across a membrane of the cell",
+]
+
+
+def chunk(seq, text, embed=False):
+    doc = {"seq": seq, "length": len(text), **chunk_retrieval_fields(text)}
+    if embed:
+        doc["embedding"] = hashed_embedding(text).astype(np.float16).tobytes()
+    return doc
+
+
+def index(embed=False):
+    return DocumentIndex([chunk(seq, text, embed) for seq, text in enumerate(TEXTS)])
+
+
+def test_chunk_fields_count_terms_without_stopwords():
+    fields = chunk_retrieval_fields("The cell and the cell wall")
+    assert fields["terms"] == {"cell": 2, "wall": 1}
+    assert fields["term_count"] == 3
+
+
+def test_only_chunks_sharing_a_term_score():
+    scores = index().scores("What does mitosis do?")
+    assert scores[1] > 0
+    assert not scores[[0, 2, 3]].any()
+
+
+def test_rare_terms_outweigh_common_ones():
+    # "cell" is in three chunks, "photosynthesis" only in the first
+    scores = index().scores("cell photosynthesis")
+    assert scores.argmax() == 0
+
+
+def test_select_ranks_best_first_and_drops_weak_matches():
+    assert index().select("chloroplast photosynthesis", 10_000) == [0, 2]
+
+
+def test_select_stays_within_the_budget():
+    budget = len(TEXTS[2]) + len(TEXTS[0]) - 1
+    assert index().select("chloroplast organelles photosynthesis", budget) == [2]
+
+
+def test_select_always_returns_one_chunk():
+    assert index().select("mitosis", 5) == [1]
+
+
+def test_no_match_falls_back_to_document_order():
+    budget = len(TEXTS[0]) + len(TEXTS[1])
+    assert index().select("quantum chromodynamics", budget) == [0, 1]
+
+
+def test_embeddings_blend_into_normalized_scores():
+    embedded = index(embed=True)
+    assert embedded.embeddings.shape == (len(TEXTS), server.EMBEDDING_DIMS)
+    scores = embedded.scores("osmosis across a membrane")
+    assert scores.argmax() == 3
+    assert scores.max() <= 1.0 + 1e-6
+
+
+def test_embeddings_are_ignored_unless_every_chunk_has_one():
+    chunks = [chunk(0, TEXTS[0], embed=True), chunk(1, TEXTS[1])]
+    assert DocumentIndex(chunks).embeddings is None
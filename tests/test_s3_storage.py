@@ -0,0 +1,80 @@
+import asyncio
+import os
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from server import S3Storage
+
+BUCKET = "test-uploads"
+PART = 5 * 1024 * 1024  # S3's minimum multipart part size
+mock_aws = getattr(moto, "mock_aws", None) or moto.mock_s3
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        monkeypatch.setenv(name, "testing")
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        yield S3Storage(BUCKET, prefix="/blobs/", region="us-east-1", multipart_threshold=PART, part_size=PART)
+
+
+def source(tmp_path, data):
+    path = tmp_path / "upload.bin"
+    path.write_bytes(data)
+    return path
+
+
+def test_save_read_delete_round_trip(storage, tmp_path):
+    async def scenario():
+        path = source(tmp_path, b"hello")
+        await storage.save("ab/abc", path)
+        assert not path.exists()
+        assert await storage.exists("ab/abc")
+        assert await storage.read("ab/abc") == b"hello"
+        await storage.delete("ab/abc")
+        assert not await storage.exists("ab/abc")
+
+    asyncio.run(scenario())
+    assert storage.stats()["uploaded"] == 1
+    assert storage.stats()["multipart_uploads"] == 0
+
+
+def test_keys_are_stored_under_the_prefix(storage, tmp_path):
+    asyncio.run(storage.save("ab/abc", source(tmp_path, b"x")))
+    keys = [o["Key"] for o in storage.client.list_objects_v2(Bucket=BUCKET)["Contents"]]
+    assert keys == ["blobs/ab/abc"]
+
+
+def test_large_objects_use_multipart_upload(storage, tmp_path):
+    data = os.urandom(2 * PART + 1024)
+
+    async def scenario():
+        await storage.save("cd/big", source(tmp_path, data))
+        async with storage.local_copy("cd/big") as path:
+            assert path.read_bytes() == data
+        assert not path.exists()
+
+    asyncio.run(scenario())
+    head = storage.client.head_object(Bucket=BUCKET, Key="blobs/cd/big")
+    # Multipart ETags end in -<part count>
+    assert head["ETag"].strip('"').endswith("-3")
+    assert storage.stats()["multipart_uploads"] == 1
+    assert storage.stats()["bytes_uploaded"] == len(data)
+
+
+def test_missing_key_does_not_exist(storage):
+    assert asyncio.run(storage.exists("no/such")) is False
+
+
+def test_presigned_url_sets_the_download_name(storage):
+    url = asyncio.run(storage.presigned_url("ab/abc", "report final.pdf", "application/pdf"))
+    query = parse_qs(urlparse(url).query)
+    assert urlparse(url).path.endswith("/blobs/ab/abc")
+    assert query["response-content-disposition"] == ["attachment; filename*=UTF-8''report%20final.pdf"]
+    assert query["response-content-type"] == ["application/pdf"]
+    assert storage.stats()["presigned"] == 1
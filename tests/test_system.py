@@ -0,0 +1,19 @@
+import asyncio
+
+import pytest
+
+from server import HTTPException, get_index_report, get_metrics
+
+STUDENT = {"id": "s1", "role": "student"}
+
+
+@pytest.mark.parametrize("route", [get_metrics, get_index_report])
+def test_system_routes_are_teacher_only(route):
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(route(STUDENT))
+    assert exc.value.status_code == 403
+
+
+def test_metrics_report_every_subsystem():
+    metrics = asyncio.run(get_metrics({"id": "t1", "role": "teacher"}))
+    assert {"user_cache", "ai_cache", "blob_store", "search"} <= set(metrics)
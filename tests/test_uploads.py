@@ -0,0 +1,56 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+BOUNDARY = "upload-test-boundary"
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "MAX_UPLOAD_BYTES", 1024)
+    monkeypatch.setattr(server, "UPLOAD_FORM_OVERHEAD", 256)
+    monkeypatch.setattr(server.blob_store, "tmp_dir", tmp_path)
+    server.app.dependency_overrides[server.get_current_user] = lambda: {"id": "u1", "role": "student"}
+    # No startup hooks: these requests never reach the database
+    yield TestClient(server.app)
+    server.app.dependency_overrides.clear()
+
+
+def multipart(size):
+    return (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="big.bin"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + b"x" * size + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def chunks(body, size=256):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+def post(client, content):
+    return client.post(
+        "/api/files/upload", content=content,
+        headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+    )
+
+
+def test_oversized_content_length_is_refused_before_the_body_is_read(client):
+    response = post(client, multipart(4096))
+    assert response.status_code == 413
+    assert response.json()["detail"] == "File exceeds the 1024 byte upload limit"
+
+
+def test_oversized_chunked_body_is_cut_off_mid_stream(client, tmp_path):
+    # A generator body is sent without Content-Length
+    response = post(client, chunks(multipart(64 * 1024)))
+    assert response.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_file_over_the_limit_within_the_form_overhead_is_still_413(client, tmp_path):
+    response = post(client, chunks(multipart(1100)))
+    assert response.status_code == 413
+    assert list(tmp_path.iterdir()) == []